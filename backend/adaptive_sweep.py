@@ -0,0 +1,78 @@
+import numpy as np
+
+from .simulation import run_simulation
+from .data_visualization import gather_data
+
+
+# Adaptive sweep options used when adaptive_sweep_options does not define them
+DEFAULT_ADAPTIVE_SWEEP_OPTIONS = {
+    'resistance_tolerance': 0.05,
+    'm_tolerance': 0.1,
+    'max_points': 100,
+    'max_refinement_levels': 6,
+    'min_B_ext_spacing': 0.0,
+}
+
+
+""" GET FINAL MTJ RESISTANCE AND AVERAGE MAGNETIZATION OF EACH B_ext SWEEP VALUE OF LAST RUN, IN SWEEP ORDER """
+def get_converged_sweep_values(simulation_settings, scripts_folders):
+    B_ext = []
+    R_MTJ = []
+    m_average = []
+    for data in gather_data(simulation_settings, scripts_folders):
+        B_ext.append(data['B_ext'])
+        R_MTJ.append(data['R_MTJ'][-1])
+        m_average.append(data['m_average'][-1])
+    return np.array(B_ext), np.array(R_MTJ), np.array(m_average)
+
+
+""" SCORE CHANGE OF CONVERGED RESULTS BETWEEN NEIGHBOURING B_ext SWEEP VALUES; INTERVALS SCORING ABOVE 1 ARE REFINED """
+def get_interval_scores(R_MTJ, m_average, adaptive_sweep_options):
+    # Resistance changes are measured relative to the full resistance swing of the sweep
+    R_MTJ_range = R_MTJ.max() - R_MTJ.min()
+    dR_MTJ = np.abs(np.diff(R_MTJ)) / R_MTJ_range if R_MTJ_range > 0 else np.zeros(len(R_MTJ) - 1)
+    dm_average = np.linalg.norm(np.diff(m_average, axis=0), axis=-1)
+    return np.maximum(dR_MTJ / adaptive_sweep_options['resistance_tolerance'], dm_average / adaptive_sweep_options['m_tolerance'])
+
+
+""" INSERT MIDPOINTS INTO B_ext_uniform IN THE INTERVALS CHANGING MOST, WITHIN THE POINT BUDGET """
+def refine_B_ext_uniform(B_ext_uniform, B_ext_sweep, interval_scores, adaptive_sweep_options):
+    B_ext_uniform = [np.asarray(B_ext, dtype=np.float64) for B_ext in B_ext_uniform]
+    num_new_points = adaptive_sweep_options['max_points'] - len(B_ext_uniform)
+    # Intervals are found in sweep order, which in hysteresis modes visits B_ext_uniform forwards and/or backwards;
+    # each is identified by the index of its upper neighbour in B_ext_uniform, so both branches refine the same interval
+    insertion_indices = []
+    for i_interval in np.argsort(-interval_scores):
+        if interval_scores[i_interval] <= 1 or len(insertion_indices) >= num_new_points:
+            break
+        B_ext_a, B_ext_b = B_ext_sweep[i_interval], B_ext_sweep[i_interval + 1]
+        if np.linalg.norm(B_ext_b - B_ext_a) / 2 < adaptive_sweep_options['min_B_ext_spacing']:
+            continue
+        i_a = next(i for i, B_ext in enumerate(B_ext_uniform) if np.array_equal(B_ext, B_ext_a))
+        i_b = next(i for i, B_ext in enumerate(B_ext_uniform) if np.array_equal(B_ext, B_ext_b))
+        if max(i_a, i_b) not in insertion_indices:
+            insertion_indices.append(max(i_a, i_b))
+    # Inserting from the end keeps the remaining indices valid
+    for i in sorted(insertion_indices, reverse=True):
+        B_ext_uniform.insert(i, (B_ext_uniform[i - 1] + B_ext_uniform[i]) / 2)
+    return [[float(component) for component in B_ext] for B_ext in B_ext_uniform], len(insertion_indices)
+
+
+""" RUN B_ext SWEEP STARTING FROM COARSE B_ext_uniform GRID, RECURSIVELY REFINED WHERE RESISTANCE OR AVERAGE m CHANGE MOST """
+def run_adaptive_sweep(simulation_settings, scripts_folders, run_options=None, adaptive_sweep_options=None):
+    adaptive_sweep_options = {**DEFAULT_ADAPTIVE_SWEEP_OPTIONS, **(adaptive_sweep_options or {})}
+    # Every refinement level reruns the whole sweep, so already computed sweep values must come from the result cache
+    if not scripts_folders.get('RESULT_CACHE_FOLDER'):
+        raise ValueError('adaptive B_ext sweeps need scripts_folders["RESULT_CACHE_FOLDER"] to reuse computed sweep values')
+    B_ext_uniform = [[float(component) for component in B_ext] for B_ext in simulation_settings['B_ext_uniform']]
+    for refinement_level in range(adaptive_sweep_options['max_refinement_levels'] + 1):
+        simulation_settings = {**simulation_settings, 'B_ext_uniform': B_ext_uniform}
+        results_folders = run_simulation(simulation_settings, scripts_folders, run_options)
+        if refinement_level == adaptive_sweep_options['max_refinement_levels']:
+            break
+        B_ext_sweep, R_MTJ, m_average = get_converged_sweep_values(simulation_settings, scripts_folders)
+        interval_scores = get_interval_scores(R_MTJ, m_average, adaptive_sweep_options)
+        B_ext_uniform, num_new_points = refine_B_ext_uniform(B_ext_uniform, B_ext_sweep, interval_scores, adaptive_sweep_options)
+        if num_new_points == 0:
+            break
+    return B_ext_uniform, results_folders
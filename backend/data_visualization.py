@@ -1,205 +1,349 @@
 import os
+import glob
+import math
+import itertools
+import functools
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation, PillowWriter
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from .ovf_data_formatting import extract_data
+from .field_data import normalized_vector
+from .mumax_table import read_mumax_table
+from .simulation import get_B_ext_sweep_values, get_sweep_value_output_folders, get_quasi_static_steps_table_filename
+from .result_store import get_result_store_folder, load_result_store
+from .run_trace import traced
 
 
-""" GATHER DATA FROM SIMULATION RESULTS """
-def gather_data(simulation_settings, scripts_folders):
-    m_dynamics_folder = scripts_folders['M_DYNAMICS_DATA_FOLDER']
-    j_tunnel_folder = scripts_folders['J_TUNNEL_DATA_FOLDER']
+DEFAULT_PLOT_OPTIONS = {
+    'show_unit_sphere_dynamics': True,
+    'show_j_tunnel_convergence': True,
+    'show_j_tunnel_final': True,
+    # Saving figures into plot_folder with a non-interactive backend instead of showing them
+    'headless': False,
+    'plot_folder': 'plots',
+    'file_formats': ('png',),
+    # Processes rendering figures in headless mode, None for one per CPU
+    'num_plot_processes': None,
+    # None for one figure per B_ext sweep value, 'panels' for one figure with a panel per sweep value, 'animation' for one
+    # animation with a frame per sweep value (saved as GIF in headless mode)
+    'combine_sweep_values': None,
+    'animation_fps': 2,
+}
+
+# Points along each angle of the unit sphere surface mesh
+UNIT_SPHERE_MESH_POINTS = 100
+
+# Figures of per-sweep-value plots kept by each rendering process, redrawn for each sweep value instead of rebuilt
+FIGURE_TEMPLATES = {}
+
+
+""" GATHER DATA FROM SIMULATION RESULTS, ONE B_ext SWEEP VALUE AT A TIME IN SWEEP ORDER """
+@traced('gather_data')
+def gather_data(simulation_settings, scripts_folders, keep_fields=False):
     print('Preparing data for plots...')
-    # Extracting the final magnetization distribution for each quasi-static sub-simulation for each B_ext sweep value
-    # in such a way that the jth LLGS step of the jth B_ext sweep iteration can be accesed as: B_ext_sweep_step_m_dynamics[i][j]
-    B_ext_sweep_step_m_dynamics = []
-    for B_ext_sweep_value_folder in os.listdir(m_dynamics_folder):
-        # Looping through B_ext sweep step folder and appending to m_final_quasi_static_steps 
-        m_dynamics_quasi_static_steps_B_ext_sweep_value_folder = os.path.join(m_dynamics_folder, B_ext_sweep_value_folder)
-        m_final_quasi_static_steps = []
-        for m_final_quasi_static_step in os.listdir(m_dynamics_quasi_static_steps_B_ext_sweep_value_folder):
-            m_data = extract_data(os.path.join(m_dynamics_quasi_static_steps_B_ext_sweep_value_folder, m_final_quasi_static_step) , simulation_settings)
-            # Appending LLGS step result
-            m_final_quasi_static_steps.append(m_data)
-        # Appending B_ext sweep value results to B_ext_sweep_step_m_dynamics
-        B_ext_sweep_step_m_dynamics.append(m_final_quasi_static_steps)
-    # Extracting the final tunnel current distribution for each quasi-static sub-simulation for each B_ext sweep value
-    # in such a way that the jth LLGS step of the jth B_ext sweep iteration can be accesed as: B_ext_sweep_step_j_tunnel[i][j]
-    B_ext_sweep_step_j_tunnel = []
-    for B_ext_sweep_value_folder in os.listdir(j_tunnel_folder):
-        # Looping through B_ext sweep step folder and appending to m_final_quasi_static_steps
-        j_tunnel_quasi_static_steps_B_ext_sweep_value_folder = os.path.join(j_tunnel_folder, B_ext_sweep_value_folder)
-        j_tunnel_quasi_static_steps = []
-        for j_tunnel_quasi_static_step in os.listdir(j_tunnel_quasi_static_steps_B_ext_sweep_value_folder):
-            j_tunnel_data = extract_data((os.path.join(j_tunnel_quasi_static_steps_B_ext_sweep_value_folder, j_tunnel_quasi_static_step)), simulation_settings)
-            # Appending LLGS step result
-            j_tunnel_quasi_static_steps.append(j_tunnel_data)
-        # Appending B_ext sweep value results to B_ext_sweep_step_m_dynamics
-        B_ext_sweep_step_j_tunnel.append(j_tunnel_quasi_static_steps)
-    return [B_ext_sweep_step_m_dynamics, B_ext_sweep_step_j_tunnel]
-
-
-""" PLOT MAGNETIZATION TRAJECTORY FOR ALL SIMULATION ITERATIONS """
-def plot_average_magnetization_on_unit_sphere(B_ext_sweep_step_m_dynamics, simulation_settings):
-    for B_ext_sweep_step in range(len(B_ext_sweep_step_m_dynamics)):
-        m_dynamics_B_ext_sweep_step = B_ext_sweep_step_m_dynamics[B_ext_sweep_step]
+    # Each sweep value yields a dictionary with its B_ext value and the per-step average magnetization, total tunnel
+    # current and MTJ resistance; the saved m and J distributions and their step numbers are only added when keep_fields is set
+    if os.path.exists(os.path.join(get_result_store_folder(scripts_folders), 'metadata.json')):
+        yield from gather_data_from_result_store(scripts_folders, keep_fields)
+    else:
+        yield from gather_data_from_output_folders(simulation_settings, scripts_folders, keep_fields)
+
+
+""" GATHER DATA FROM RESULT STORE, USING ITS PER-STEP SCALARS """
+def gather_data_from_result_store(scripts_folders, keep_fields):
+    result_store = load_result_store(scripts_folders)
+    for i, num_steps in enumerate(result_store['quasi_static_steps_used']):
+        # Sweep values that were not stored (e.g. of an interrupted run) are left out
+        if num_steps == 0:
+            continue
+        data = {
+            'B_ext': result_store['B_ext'][i],
+            'm_average': np.array(result_store['m_average'][i, :num_steps]),
+            'I_total': np.array(result_store['I_total'][i, :num_steps]),
+            'R_MTJ': np.array(result_store['R_MTJ'][i, :num_steps]),
+        }
+        # Saved fields take consecutive slots from 0, so slicing them keeps the memory map and fields are only read from disk when used
+        if keep_fields:
+            num_fields = int(np.count_nonzero(result_store['field_steps'][i] >= 0))
+            data['field_steps'] = np.array(result_store['field_steps'][i, :num_fields])
+            data['m_data'] = result_store['m'][i, :num_fields]
+            data['j_data'] = result_store['J'][i, :num_fields]
+        yield data
+
+
+""" GATHER DATA FROM B_ext_sweep_<n> OUTPUT FOLDERS IN NUMERIC SWEEP ORDER, USING THEIR TABLES OF PER-STEP SCALARS """
+def gather_data_from_output_folders(simulation_settings, scripts_folders, keep_fields):
+    B_ext_uniform = get_B_ext_sweep_values(simulation_settings)
+    B_ext_sweep_value_folders = sorted(os.listdir(scripts_folders['M_DYNAMICS_DATA_FOLDER']), key=lambda folder: int(folder.split('_')[-1]))
+    for B_ext_sweep_value_folder in B_ext_sweep_value_folders:
+        num_sweep_value = int(B_ext_sweep_value_folder.split('_')[-1])
+        table = read_mumax_table(get_quasi_static_steps_table_filename(scripts_folders, num_sweep_value))
+        data = {
+            'B_ext': np.array(B_ext_uniform[num_sweep_value], dtype=np.float64),
+            'm_average': np.stack([table['mx'], table['my'], table['mz']], axis=-1),
+            'I_total': table['I_total'],
+            'R_MTJ': table['R_MTJ'],
+        }
+        if keep_fields:
+            m_dynamics_B_ext_sweep_folder, j_tunnel_B_ext_sweep_folder = get_sweep_value_output_folders(scripts_folders, num_sweep_value)
+            field_steps, m_fields = zip(*iterate_quasi_static_steps(m_dynamics_B_ext_sweep_folder, simulation_settings['m_quasi_static_final_name'][1:-1], simulation_settings))
+            _, j_fields = zip(*iterate_quasi_static_steps(j_tunnel_B_ext_sweep_folder, simulation_settings['j_tunnel_quasi_static_final_name'][1:-1], simulation_settings))
+            data['field_steps'] = np.array(field_steps)
+            data['m_data'] = np.stack(m_fields)
+            data['j_data'] = np.stack(j_fields)
+        yield data
+
+
+""" READ STEP NUMBER AND FIELD DATA OF EACH SAVED QUASI-STATIC STEP OF B_ext SWEEP VALUE FOLDER, IN STEP ORDER """
+def iterate_quasi_static_steps(B_ext_sweep_value_folder, filename_prefix, simulation_settings):
+    # Step files are numbered with leading zeros, so sorting by name sorts them by step
+    for quasi_static_step_file in sorted(glob.glob(f'{B_ext_sweep_value_folder}/{filename_prefix}*')):
+        i_step = int(os.path.basename(quasi_static_step_file)[len(filename_prefix):].split('.')[0])
+        yield i_step, extract_data(quasi_static_step_file, simulation_settings)
+
+
+""" UNIT SPHERE SURFACE MESH, COMPUTED ONCE AND SHARED BY ALL UNIT SPHERE PLOTS """
+@functools.lru_cache(maxsize=None)
+def get_unit_sphere_mesh():
+    u, v = np.linspace(0, 2 * np.pi, UNIT_SPHERE_MESH_POINTS), np.linspace(0, np.pi, UNIT_SPHERE_MESH_POINTS)
+    x = np.outer(np.cos(u), np.sin(v))
+    y = np.outer(np.sin(u), np.sin(v))
+    z = np.outer(np.ones_like(u), np.cos(v))
+    return x, y, z
+
+
+""" DRAW UNIT SPHERE SURFACE, AXIS LABELS AND TICKS INTO 3D AXIS """
+def setup_unit_sphere_axis(ax):
+    ax.plot_surface(*get_unit_sphere_mesh(), color='lightgray', alpha=0.2, linewidth=0)
+    ax.set_xlabel('mx')
+    ax.set_ylabel('my')
+    ax.set_zlabel('mz')
+    ax.grid(False)
+    ticks = [-1, 0, 1]
+    ax.set_xticks(ticks)
+    ax.set_yticks(ticks)
+    ax.set_zticks(ticks)
+    ax.set_box_aspect([1, 1, 1])
+
+
+""" DRAW NORMALIZED AVERAGE MAGNETIZATION TRAJECTORY OF B_ext SWEEP VALUE ONTO UNIT SPHERE AXIS; RETURNS THE DRAWN ARTISTS """
+def draw_unit_sphere_trajectory(ax, data, B_ext_sweep_step, num_sweep_values):
+    # Normalized average magnetization of each quasi-static step, shape (num_steps, 3)
+    trajectory = normalized_vector(data['m_average'])
+    m_x_trajectory = trajectory[:, 0]
+    m_y_trajectory = trajectory[:, 1]
+    m_z_trajectory = trajectory[:, 2]
+    artists = ax.plot(m_x_trajectory, m_y_trajectory, m_z_trajectory, linewidth=1, color='b')
+    # Plotting starting and ending magnetization, colored as the first two scatters of a new figure also on reused axes
+    artists.append(ax.scatter(m_x_trajectory[0], m_y_trajectory[0], m_z_trajectory[0], s=20, c='tab:blue', edgecolor='k', linewidth=0.5, zorder=5))
+    artists.append(ax.scatter(m_x_trajectory[-1], m_y_trajectory[-1], m_z_trajectory[-1], s=20, c='tab:orange', edgecolor='r', linewidth=0.5, zorder=5))
+    ax.set_title(f'Normalized Avg. Magnetization on Unit Sphere\nB_ext sweep step {B_ext_sweep_step+1}/{num_sweep_values}')
+    return artists
+
+
+""" DRAW AXIS LABELS AND GRID OF TUNNEL CURRENT CONVERGENCE AXIS """
+def setup_tunnel_current_convergence_axis(ax):
+    ax.set_xlabel('Quasi-Static Step')
+    ax.set_ylabel('Total Tunnel Current Across MTJ, A')
+    ax.grid(True)
+
+
+""" DRAW TOTAL TUNNEL CURRENT ACROSS MTJ OF EACH QUASI-STATIC STEP OF B_ext SWEEP VALUE; RETURNS THE DRAWN ARTISTS """
+def draw_tunnel_current_quasi_static_convergence(ax, data, B_ext_sweep_step, num_sweep_values):
+    total_current_B_ext_sweep_step = data['I_total']
+    artists = ax.plot(range(len(total_current_B_ext_sweep_step)), total_current_B_ext_sweep_step, marker='o', color='tab:red')
+    # Axis limits of reused axes only follow the currently drawn artists
+    ax.relim()
+    ax.autoscale_view()
+    ax.set_title(f'Convergence of Total Tunnel Current; B_ext sweep step {B_ext_sweep_step+1}/{num_sweep_values}')
+    return artists
+
+
+# Projection, axis setup, drawing of a B_ext sweep value and title of panels figure of each per-sweep-value plot
+SWEEP_VALUE_PLOTS = {
+    'unit_sphere_dynamics': ('3d', setup_unit_sphere_axis, draw_unit_sphere_trajectory, 'Normalized Avg. Magnetization on Unit Sphere'),
+    'j_tunnel_convergence': (None, setup_tunnel_current_convergence_axis, draw_tunnel_current_quasi_static_convergence, 'Convergence of Total Tunnel Current'),
+}
+
+
+""" CREATE FIGURE OF PER-SWEEP-VALUE PLOT WITH num_panels SET UP AXES, ARRANGED IN A NEARLY SQUARE GRID """
+def make_sweep_value_figure(plot_name, num_panels=1):
+    projection, setup_axis, _, _ = SWEEP_VALUE_PLOTS[plot_name]
+    if num_panels == 1:
         fig = plt.figure()
-        ax = fig.add_subplot(111, projection='3d')
-        trajectory = []
-        for m_final_quasi_static_step in m_dynamics_B_ext_sweep_step:
-            m_x_total = 0
-            m_y_total = 0
-            m_z_total = 0
-            for i in range(simulation_settings['Nx']):
-                for j in range(simulation_settings['Ny']):
-                    m_cell = m_final_quasi_static_step[i][j]
-                    m_x_total += m_cell[0]
-                    m_y_total += m_cell[1]
-                    m_z_total += m_cell[2]
-            norm = np.sqrt(m_x_total**2 + m_y_total**2 + m_z_total**2)
-            if norm != 0:
-                m_norm = [m_x_total/norm, m_y_total/norm, m_z_total/norm]
-            else:
-                m_norm = [0, 0, 0]
-            trajectory.append(m_norm)
-        m_x_trajectory = [point[0] for point in trajectory]
-        m_y_trajectory = [point[1] for point in trajectory]
-        m_z_trajectory = [point[2] for point in trajectory]
-        ax.plot(m_x_trajectory, m_y_trajectory, m_z_trajectory, linewidth=1, color='b')
-        # Plotting starting magnetization
-        ax.scatter(m_x_trajectory[0], m_y_trajectory[0], m_z_trajectory[0], s=20, edgecolor='k', linewidth=0.5, zorder=5)
-        # Plotting ending magnetization
-        ax.scatter(m_x_trajectory[-1], m_y_trajectory[-1], m_z_trajectory[-1], s=20, edgecolor='r', linewidth=0.5, zorder=5)
-        # Drawing unit sphere surface
-        u, v = np.linspace(0, 2 * np.pi, 100), np.linspace(0, np.pi, 100)
-        x = np.outer(np.cos(u), np.sin(v))
-        y = np.outer(np.sin(u), np.sin(v))
-        z = np.outer(np.ones_like(u), np.cos(v))
-        ax.plot_surface(x, y, z, color='lightgray', alpha=0.2, linewidth=0)
-        # Setting axis and labels
-        ax.set_xlabel('mx')
-        ax.set_ylabel('my')
-        ax.set_zlabel('mz')
-        ax.set_title(f'Normalized Avg. Magnetization on Unit Sphere\nB_ext sweep step {B_ext_sweep_step+1}/{len(B_ext_sweep_step_m_dynamics)}')
-        ax.legend(loc='upper left', bbox_to_anchor=(1.1, 1.05))
-        ax.grid(False)
-        ticks = [-1, 0, 1]
-        ax.set_xticks(ticks)
-        ax.set_yticks(ticks)
-        ax.set_zticks(ticks)
-        ax.set_box_aspect([1, 1, 1])
-        plt.tight_layout()
-        plt.show()
+    else:
+        num_columns = math.ceil(math.sqrt(num_panels))
+        num_rows = math.ceil(num_panels / num_columns)
+        fig = plt.figure(figsize=(4 * num_columns, 3.5 * num_rows))
+    for i_panel in range(num_panels):
+        ax = fig.add_subplot(*((1, 1) if num_panels == 1 else (num_rows, num_columns)), i_panel + 1, projection=projection)
+        setup_axis(ax)
+    return fig
 
 
-""" PLOT TOTAL TUNNEL CURRENT ACROSS MTJ FOR ALL SIMULATION ITERATIONS """
-def plot_tunnel_current_quasi_static_convergence(B_ext_sweep_step_j_tunnel, simulation_settings):
-    size_x = simulation_settings['size_x']
-    size_y = simulation_settings['size_y']
-    # Computing total current through MTJ for each quasi-static sub-simulation for each B_ext sweep value
-    for B_ext_sweep_step in range(len(B_ext_sweep_step_j_tunnel)):
-        total_current_B_ext_sweep_step = []
-        j_tunnel_B_ext_sweep_step = B_ext_sweep_step_j_tunnel[B_ext_sweep_step]
-        for j_tunnel_quasi_static_step in j_tunnel_B_ext_sweep_step:
-            j_array = np.array(j_tunnel_quasi_static_step).reshape(-1)
-            total_current = np.sum(j_array) * size_x * size_y
-            total_current_B_ext_sweep_step.append(total_current)
-        plt.figure()
-        plt.plot(range(len(total_current_B_ext_sweep_step)), total_current_B_ext_sweep_step, marker='o', color='tab:red')
-        plt.xlabel('Quasi-Static Step')
-        plt.ylabel('Total Tunnel Current Across MTJ, A')
-        plt.title(f'Convergence of Total Tunnel Current; B_ext sweep step {B_ext_sweep_step+1}/{len(B_ext_sweep_step_j_tunnel)}')
-        plt.grid(True)
-        plt.tight_layout()
+""" SHOW FIGURE, OR SAVE IT AS name IN EACH FILE FORMAT INTO PLOT FOLDER IN HEADLESS MODE """
+def show_or_save_figure(fig, name, plot_options):
+    fig.tight_layout()
+    if not plot_options['headless']:
         plt.show()
+        return
+    for file_format in plot_options['file_formats']:
+        fig.savefig(os.path.join(plot_options['plot_folder'], f'{name}.{file_format}'))
+
+
+""" RENDER FIGURE OF ONE B_ext SWEEP VALUE; IN HEADLESS MODE THE FIGURE OF THE PLOT IS REUSED BY LATER SWEEP VALUES, WITH ONLY
+THE DRAWN ARTISTS REMOVED """
+def render_sweep_value_figure(plot_name, data, B_ext_sweep_step, num_sweep_values, plot_options):
+    if plot_options['headless']:
+        if plot_name not in FIGURE_TEMPLATES:
+            FIGURE_TEMPLATES[plot_name] = make_sweep_value_figure(plot_name)
+        fig = FIGURE_TEMPLATES[plot_name]
+    else:
+        fig = make_sweep_value_figure(plot_name)
+    artists = SWEEP_VALUE_PLOTS[plot_name][2](fig.axes[0], data, B_ext_sweep_step, num_sweep_values)
+    show_or_save_figure(fig, f'{plot_name}_{B_ext_sweep_step:05d}', plot_options)
+    for artist in artists:
+        artist.remove()
 
 
-def plot_j_tunnel_converged(B_ext_sweep_step_j_tunnel, simulation_settings):
-    size_x = simulation_settings['size_x']
-    size_y = simulation_settings['size_y']
-    B_ext_uniform = simulation_settings['B_ext_uniform']
+""" RENDER ONE FIGURE WITH A PANEL PER B_ext SWEEP VALUE """
+def render_sweep_value_panels(plot_name, sweep_value_data, plot_options):
+    _, _, draw, title = SWEEP_VALUE_PLOTS[plot_name]
+    fig = make_sweep_value_figure(plot_name, len(sweep_value_data))
+    fig.suptitle(title)
+    for B_ext_sweep_step, (ax, data) in enumerate(zip(fig.axes, sweep_value_data)):
+        draw(ax, data, B_ext_sweep_step, len(sweep_value_data))
+        # Panels only name their sweep value, the plot is named by the figure title
+        ax.set_title(f'B_ext sweep step {B_ext_sweep_step+1}/{len(sweep_value_data)}')
+    show_or_save_figure(fig, f'{plot_name}_panels', plot_options)
+    plt.close(fig)
 
-    B_labels = []
-    final_tunnel_current_B_ext_sweep_step = []
-    final_R_MTJ_B_ext_sweep_step = []
 
-    for B_ext_sweep_step in range(len(B_ext_sweep_step_j_tunnel)):
-        j_tunnel_B_ext_sweep_step = B_ext_sweep_step_j_tunnel[B_ext_sweep_step]
-        index_final_quasi_static_step = len(j_tunnel_B_ext_sweep_step)
-        j_tunnel_quasi_static_step_final = j_tunnel_B_ext_sweep_step[index_final_quasi_static_step-1]
-        j_array = np.array(j_tunnel_quasi_static_step_final).reshape(-1)
-        total_current = np.sum(j_array) * size_x * size_y
-        final_tunnel_current_B_ext_sweep_step.append(total_current)
-        total_R_MTJ = simulation_settings['V_bias'] / total_current
-        final_R_MTJ_B_ext_sweep_step.append(total_R_MTJ)
-        B_labels.append(B_ext_uniform[B_ext_sweep_step])
+""" RENDER ANIMATION WITH A FRAME PER B_ext SWEEP VALUE, SAVED AS GIF IN HEADLESS MODE """
+def render_sweep_value_animation(plot_name, sweep_value_data, plot_options):
+    fig = make_sweep_value_figure(plot_name)
+    ax = fig.axes[0]
+    artists = []
 
-    plt.figure(figsize=(10, 6))
+    def draw_frame(B_ext_sweep_step):
+        for artist in artists:
+            artist.remove()
+        artists[:] = SWEEP_VALUE_PLOTS[plot_name][2](ax, sweep_value_data[B_ext_sweep_step], B_ext_sweep_step, len(sweep_value_data))
+        return artists
+
+    animation = FuncAnimation(fig, draw_frame, frames=len(sweep_value_data), interval=1000 / plot_options['animation_fps'], repeat=True)
+    if plot_options['headless']:
+        animation.save(os.path.join(plot_options['plot_folder'], f'{plot_name}_animation.gif'), writer=PillowWriter(fps=plot_options['animation_fps']))
+    else:
+        plt.show()
+    plt.close(fig)
+
+
+""" RENDER FINAL CONVERGED TUNNEL CURRENT AND MTJ RESISTANCE VS B_ext FIGURES """
+def render_j_tunnel_converged(final_tunnel_current_B_ext_sweep_step, final_R_MTJ_B_ext_sweep_step, B_labels, plot_options):
+    fig = plt.figure(figsize=(10, 6))
     plt.plot(range(len(final_tunnel_current_B_ext_sweep_step)), final_tunnel_current_B_ext_sweep_step, marker='o', color='tab:blue')
     plt.xticks(ticks=range(len(B_labels)), labels=B_labels, rotation=45, ha='right')
     plt.ylabel('Final Converged Tunnel Current, A')
     plt.xlabel('External Magnetic Field B_ext (T)')
     plt.title('Final Tunnel Current vs B_ext')
     plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    show_or_save_figure(fig, 'j_tunnel_final', plot_options)
+    plt.close(fig)
 
-    plt.figure(figsize=(10, 6))
+    fig = plt.figure(figsize=(10, 6))
     plt.plot(range(len(final_R_MTJ_B_ext_sweep_step)), final_R_MTJ_B_ext_sweep_step, marker='o', color='tab:blue')
     plt.xticks(ticks=range(len(B_labels)), labels=B_labels, rotation=45, ha='right')
     plt.ylabel('Final Full MTJ Resistance, Ohms')
     plt.xlabel('External Magnetic Field B_ext (T)')
     plt.title('Final Full MTJ Resistance vs B_ext')
     plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    show_or_save_figure(fig, 'R_MTJ_final', plot_options)
+    plt.close(fig)
 
 
+""" PLOT JOBS OF PER-SWEEP-VALUE PLOT: A FIGURE PER B_ext SWEEP VALUE, OR ONE PANELS FIGURE OR ANIMATION OF ALL OF THEM """
+def get_sweep_value_plot_jobs(plot_name, sweep_value_data, plot_options):
+    if plot_options['combine_sweep_values'] is None:
+        return [(render_sweep_value_figure, (plot_name, data, B_ext_sweep_step, len(sweep_value_data))) for B_ext_sweep_step, data in enumerate(sweep_value_data)]
+    if plot_options['combine_sweep_values'] == 'panels':
+        return [(render_sweep_value_panels, (plot_name, sweep_value_data))]
+    if plot_options['combine_sweep_values'] == 'animation':
+        return [(render_sweep_value_animation, (plot_name, sweep_value_data))]
+    raise ValueError(f'unknown combine_sweep_values "{plot_options["combine_sweep_values"]}", expected None, "panels" or "animation"')
 
 
-def plot_R_MTJ_converged(j_tunnel_converged, simulation_settings):
-    size_x = simulation_settings['size_x']
-    size_y = simulation_settings['size_y']
-    B_ext_uniform = simulation_settings['B_ext_uniform']
+""" SWITCH MATPLOTLIB OF PLOT PROCESS TO ITS NON-INTERACTIVE BACKEND, WHICH OPENS NO WINDOWS """
+def use_headless_backend():
+    plt.switch_backend('Agg')
 
-    total_R_MTJ = []
-    B_labels = []
 
-    for i, j_converged in enumerate(j_tunnel_converged):
-        j_array = np.array(j_converged).reshape(-1)
-        total_current = np.sum(j_array) * size_x * size_y
-        total_R_MTJ_B_ext_value = simulation_settings['V_bias'] / total_current
-        total_R_MTJ.append(total_R_MTJ_B_ext_value)
+""" CLOSE FIGURES KEPT FOR REUSE BY HEADLESS PLOTS OF THIS PROCESS """
+def close_figure_templates():
+    for fig in FIGURE_TEMPLATES.values():
+        plt.close(fig)
+    FIGURE_TEMPLATES.clear()
 
-        B = B_ext_uniform[i]
-        label = f"Bx={B[0]:.3f}, By={B[1]:.3f}, Bz={B[2]:.3f}"
-        B_labels.append(label)
 
-    plt.figure(figsize=(10, 6))
-    plt.plot(range(len(total_R_MTJ)), total_R_MTJ, marker='o', color='tab:blue')
-    plt.xticks(ticks=range(len(B_labels)), labels=B_labels, rotation=45, ha='right')
-    plt.ylabel('Final Converged MTJ Resistance, Ohms')
-    plt.xlabel('External Magnetic Field B_ext (T)')
-    plt.title('Final MTJ Resistance vs B_ext')
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+""" RUN PLOT JOB, A RENDER FUNCTION AND ITS ARGUMENTS """
+def run_plot_job(plot_job, plot_options):
+    render_function, args = plot_job
+    render_function(*args, plot_options)
 
 
+""" RUN PLOT JOBS ONE AFTER ANOTHER ON SCREEN, OR IN A POOL OF HEADLESS PROCESSES SAVING THE FIGURES """
+def run_plot_jobs(plot_jobs, plot_options):
+    if not plot_options['headless']:
+        for plot_job in plot_jobs:
+            run_plot_job(plot_job, plot_options)
+        return
+    os.makedirs(plot_options['plot_folder'], exist_ok=True)
+    num_processes = min(plot_options['num_plot_processes'] or os.cpu_count(), len(plot_jobs))
+    if num_processes <= 1:
+        # Figures are only saved, so the matplotlib backend of the caller is kept
+        try:
+            for plot_job in plot_jobs:
+                run_plot_job(plot_job, plot_options)
+        finally:
+            close_figure_templates()
+        return
+    # Plot processes are started fresh rather than forked, so that they inherit neither the threads nor the figures of this process;
+    # their figures are freed when they exit with the pool
+    with ProcessPoolExecutor(num_processes, mp_context=multiprocessing.get_context('spawn'), initializer=use_headless_backend) as executor:
+        # Consecutive jobs are handed out together, so that each process reuses its figures across the sweep values it renders
+        chunksize = max(1, len(plot_jobs) // (4 * num_processes))
+        list(executor.map(run_plot_job, plot_jobs, itertools.repeat(plot_options), chunksize=chunksize))
 
 
 def plot_results(simulation_settings, scripts_folders, plot_options):
 
-    B_ext_sweep_step_m_dynamics, B_ext_sweep_step_j_tunnel = gather_data(simulation_settings, scripts_folders)
+    # Per-step averages and sums of each B_ext sweep value; full field distributions are not kept in memory
+    sweep_value_data = list(gather_data(simulation_settings, scripts_folders))
+    plot_sweep_value_data(sweep_value_data, simulation_settings, plot_options)
+
+
+""" PLOT PER-STEP AVERAGES AND SUMS OF EACH B_ext SWEEP VALUE, FROM SIMULATION RESULTS OR MACROSPIN SOLVER """
+@traced('plotting')
+def plot_sweep_value_data(sweep_value_data, simulation_settings, plot_options):
+    plot_options = {**DEFAULT_PLOT_OPTIONS, **(plot_options or {})}
+    plot_jobs = []
 
     # Plotting average normalized magnetization dynamics at each LLGS step for each B_ext sweep value
     if plot_options['show_unit_sphere_dynamics']:
-        plot_average_magnetization_on_unit_sphere(B_ext_sweep_step_m_dynamics, simulation_settings)
-        
+        plot_jobs += get_sweep_value_plot_jobs('unit_sphere_dynamics', sweep_value_data, plot_options)
+
     # Plotting total tunnel current flowing through MTJ at each LLGS step for each B_ext sweep value
     if plot_options['show_j_tunnel_convergence']:
-        plot_tunnel_current_quasi_static_convergence(B_ext_sweep_step_j_tunnel, simulation_settings)
+        plot_jobs += get_sweep_value_plot_jobs('j_tunnel_convergence', sweep_value_data, plot_options)
 
     # Final converged tunnel current at each B_ext sweep step
     if plot_options['show_j_tunnel_final']:
-        plot_j_tunnel_converged(B_ext_sweep_step_j_tunnel, simulation_settings)
+        final_tunnel_current_B_ext_sweep_step = np.array([data['I_total'][-1] for data in sweep_value_data])
+        final_R_MTJ_B_ext_sweep_step = np.array([data['R_MTJ'][-1] for data in sweep_value_data])
+        B_labels = [[float(component) for component in data['B_ext']] for data in sweep_value_data]
+        plot_jobs.append((render_j_tunnel_converged, (final_tunnel_current_B_ext_sweep_step, final_R_MTJ_B_ext_sweep_step, B_labels)))
+
+    run_plot_jobs(plot_jobs, plot_options)
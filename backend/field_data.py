@@ -0,0 +1,77 @@
+import numpy as np
+
+
+""" CREATE UNIFORM VECTOR FIELD DISTRIBUTION OF SHAPE (Nx, Ny, 3) """
+def uniform_field(vector, simulation_settings):
+    Nx = simulation_settings['Nx']
+    Ny = simulation_settings['Ny']
+    field_data = np.empty((Nx, Ny, 3), dtype=np.float64)
+    # Broadcasting the same vector to every cell
+    field_data[...] = np.asarray(vector, dtype=np.float64)
+    return field_data
+
+
+""" AVERAGE VECTOR OF FIELD DISTRIBUTION(S) """
+def average_vector(field_data):
+    # Works for a single (Nx, Ny, 3) field as well as for stacks of shape (..., Nx, Ny, 3)
+    return np.asarray(field_data).mean(axis=(-3, -2), dtype=np.float64)
+
+
+""" NORMALIZED AVERAGE MAGNETIZATION OF FIELD DISTRIBUTION(S) """
+def normalized_average_magnetization(m_data):
+    return normalized_vector(average_vector(m_data))
+
+
+""" NORMALIZE VECTOR(S) ALONG LAST AXIS """
+def normalized_vector(vector):
+    norm = np.linalg.norm(vector, axis=-1, keepdims=True)
+    # Zero vectors are kept as zero vectors
+    safe_norm = np.where(norm != 0, norm, 1.0)
+    return np.where(norm != 0, vector / safe_norm, 0.0)
+
+
+""" TOTAL TUNNEL CURRENT THROUGH MTJ FOR TUNNEL CURRENT DENSITY DISTRIBUTION(S) """
+def total_tunnel_current(j_data, simulation_settings):
+    # Current through each cell is the z component of current density times the cell area
+    cell_area = (simulation_settings['size_x'] / simulation_settings['Nx']) * (simulation_settings['size_y'] / simulation_settings['Ny'])
+    return np.asarray(j_data)[..., 2].sum(axis=(-2, -1), dtype=np.float64) * cell_area
+
+
+""" READ VECTOR SETTING GIVEN EITHER AS PYTHON SEQUENCE OR AS MUMAX 'vector(x, y, z)' STRING """
+def get_vector_setting(simulation_settings, key):
+    value = simulation_settings[key]
+    if isinstance(value, str):
+        value = value.strip()[len('vector('):-1].split(',')
+    return np.array([float(component) for component in value], dtype=np.float64)
+
+
+""" TUNNEL CURRENT DENSITY DISTRIBUTION FOR FREE LAYER MAGNETIZATION (COS-ANGLE TMR MODEL OF MUMAX TEMPLATE) """
+def tunnel_current_density(m_data, simulation_settings):
+    Nx = simulation_settings['Nx']
+    Ny = simulation_settings['Ny']
+    m_data = np.asarray(m_data, dtype=np.float64)
+    m_reference = get_vector_setting(simulation_settings, 'm_reference')
+    # Relative angle between free and reference layer magnetization of each cell
+    cos_m_free_ref = (m_data @ m_reference) / (np.linalg.norm(m_data, axis=-1) * np.linalg.norm(m_reference))
+    # Each cell is treated as a mini MTJ connected in parallel with all others
+    R_p_cell = simulation_settings['R_p'] * (Nx * Ny)
+    R_ap_cell = simulation_settings['R_ap'] * (Nx * Ny)
+    R_cell = R_p_cell + (R_ap_cell - R_p_cell) / 2 * (1 - cos_m_free_ref)
+    cell_area = (simulation_settings['size_x'] / Nx) * (simulation_settings['size_y'] / Ny)
+    j_data = np.zeros(m_data.shape, dtype=np.float64)
+    j_data[..., 2] = simulation_settings['V_bias'] / R_cell / cell_area
+    return j_data
+
+
+""" RESAMPLE FIELD DISTRIBUTION ONTO (Nx, Ny) GRID COVERING THE SAME AREA, BY BILINEAR INTERPOLATION BETWEEN CELL CENTERS """
+def resample_field(field_data, Nx, Ny):
+    field_data = np.asarray(field_data, dtype=np.float64)
+    for axis, N in ((0, Nx), (1, Ny)):
+        N_source = field_data.shape[axis]
+        # Cell centers of the new grid in units of source cells; edge cells keep the value of the nearest source cell
+        position = np.clip((np.arange(N) + 0.5) * N_source / N - 0.5, 0, N_source - 1)
+        i_lower = np.floor(position).astype(int)
+        i_upper = np.minimum(i_lower + 1, N_source - 1)
+        weight = (position - i_lower).reshape((-1,) + (1,) * (field_data.ndim - axis - 1))
+        field_data = np.take(field_data, i_lower, axis=axis) * (1 - weight) + np.take(field_data, i_upper, axis=axis) * weight
+    return field_data
@@ -0,0 +1,238 @@
+import numpy as np
+
+from .field_data import get_vector_setting, tunnel_current_density
+from .simulation import get_B_ext_sweep_values
+from .run_trace import traced
+
+
+# Physical constants with the values used by mumax3
+GAMMA_LL = 1.7595e11
+MU0 = 4 * np.pi * 1e-7
+HBAR = 1.05457173e-34
+QE = 1.60217646e-19
+# The MTJ template places the fixed layer at the bottom (FIXEDLAYER_BOTTOM), reversing the spin-transfer torque
+# relative to mumax3's default top position
+FIXED_LAYER_POSITION_SIGN = -1
+
+# Scalar settings that may be given as arrays of parameter combinations, all broadcast against each other
+MACROSPIN_BATCH_SETTINGS = ('Msat', 'alpha', 'Ku1', 'lambda', 'Pol', 'epsilonprime', 'V_bias', 'R_p', 'R_ap')
+
+# Macrospin options used when macrospin_options does not define them
+DEFAULT_MACROSPIN_OPTIONS = {
+    'demag': True,
+    'max_precession_angle_per_time_step': 0.6,
+    'min_time_steps_per_quasi_static_step': 20,
+}
+
+
+""" AHARONI DEMAGNETIZATION FACTOR ALONG z OF RECTANGULAR PRISM OF SIZE 2a x 2b x 2c """
+def get_aharoni_demag_factor(a, b, c):
+    abc = np.sqrt(a**2 + b**2 + c**2)
+    ab = np.sqrt(a**2 + b**2)
+    bc = np.sqrt(b**2 + c**2)
+    ac = np.sqrt(a**2 + c**2)
+    pi_N_z = (
+        (b**2 - c**2) / (2 * b * c) * np.log((abc - a) / (abc + a))
+        + (a**2 - c**2) / (2 * a * c) * np.log((abc - b) / (abc + b))
+        + b / (2 * c) * np.log((ab + a) / (ab - a))
+        + a / (2 * c) * np.log((ab + b) / (ab - b))
+        + c / (2 * a) * np.log((bc - b) / (bc + b))
+        + c / (2 * b) * np.log((ac - a) / (ac + a))
+        + 2 * np.arctan(a * b / (c * abc))
+        + (a**3 + b**3 - 2 * c**3) / (3 * a * b * c)
+        + (a**2 + b**2 - 2 * c**2) / (3 * a * b * c) * abc
+        + c / (a * b) * (ac + bc)
+        - (ab**3 + bc**3 + ac**3) / (3 * a * b * c)
+    )
+    return pi_N_z / np.pi
+
+
+""" DEMAGNETIZATION FACTORS (N_x, N_y, N_z) OF FREE LAYER PRISM """
+def get_demag_factors(simulation_settings):
+    a = simulation_settings['size_x'] / 2
+    b = simulation_settings['size_y'] / 2
+    c = simulation_settings['size_z'] / 2
+    # N_x and N_y follow from N_z by rotating the prism
+    return np.array([get_aharoni_demag_factor(b, c, a), get_aharoni_demag_factor(c, a, b), get_aharoni_demag_factor(a, b, c)])
+
+
+""" GET MACROSPIN PARAMETERS, EACH BROADCASTABLE TO (*batch_shape, num_sweep_values) """
+def get_macrospin_parameters(simulation_settings, macrospin_options):
+    parameters = {key: np.asarray(simulation_settings[key], dtype=np.float64)[..., np.newaxis] for key in MACROSPIN_BATCH_SETTINGS}
+    parameters['anisU'] = get_vector_setting(simulation_settings, 'anisU')
+    parameters['anisU'] /= np.linalg.norm(parameters['anisU'])
+    parameters['fixedlayer'] = get_vector_setting(simulation_settings, 'fixedlayer')
+    parameters['fixedlayer'] /= np.linalg.norm(parameters['fixedlayer'])
+    # An isotropic part of the demagnetizing field is parallel to m and exerts no torque, so only the anisotropic part is kept
+    demag_factors = get_demag_factors(simulation_settings) if macrospin_options['demag'] else np.zeros(3)
+    parameters['demag_factors'] = demag_factors - demag_factors.min()
+    parameters['batch_shape'] = np.broadcast_shapes(*(parameters[key].shape[:-1] for key in MACROSPIN_BATCH_SETTINGS))
+    return parameters
+
+
+""" TUNNEL CURRENT DENSITY OF UNIFORMLY MAGNETIZED FREE LAYER (COS-ANGLE TMR MODEL OF MUMAX TEMPLATE ON A SINGLE CELL) """
+def macrospin_tunnel_current_density(m, simulation_settings, parameters):
+    macrospin_settings = {
+        **simulation_settings,
+        'Nx': 1,
+        'Ny': 1,
+        'V_bias': parameters['V_bias'],
+        'R_p': parameters['R_p'],
+        'R_ap': parameters['R_ap'],
+    }
+    return tunnel_current_density(m, macrospin_settings)[..., 2]
+
+
+""" CROSS PRODUCT OF VECTORS STORED COMPONENT-FIRST, SHAPE (3, ...) """
+def cross(a, b):
+    return np.array([a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]])
+
+
+""" DOT PRODUCT OF VECTORS STORED COMPONENT-FIRST, SHAPE (3, ...) """
+def dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+""" COEFFICIENTS OF MACROSPIN TORQUE, FIXED DURING A QUASI-STATIC STEP; VECTORS ARE STORED COMPONENT-FIRST """
+def get_macrospin_torque_coefficients(B_ext, j_z, simulation_settings, parameters):
+    alpha = parameters['alpha']
+    # Components first, with the sweep value axis (if any) aligned to the last axis of the batch
+    B_ext = np.moveaxis(np.asarray(B_ext, dtype=np.float64), -1, 0)
+    B_ext = B_ext.reshape((3,) + (1,) * (j_z.ndim - B_ext.ndim + 1) + B_ext.shape[1:])
+    # Slonczewski spin-transfer torque prefactor of the tunnel current
+    beta = FIXED_LAYER_POSITION_SIGN * HBAR / QE * j_z / (parameters['Msat'] * simulation_settings['size_z'])
+    return {
+        'B_ext': B_ext,
+        'anisotropy': 2 * parameters['Ku1'] / parameters['Msat'],
+        'demag': MU0 * parameters['Msat'] * parameters['demag_factors'].reshape((3,) + (1,) * j_z.ndim),
+        'alpha': alpha,
+        'gilbert': GAMMA_LL / (1 + alpha**2),
+        'beta': beta,
+        'beta_epsilonprime': beta * parameters['epsilonprime'],
+        'lambda2': parameters['lambda']**2,
+        'Pol': parameters['Pol'],
+    }
+
+
+""" LANDAU-LIFSHITZ AND SLONCZEWSKI TORQUE dm/dt OF MACROSPIN (SAME FORM AS MUMAX3), FOR COMPONENT-FIRST m """
+def get_macrospin_torque(m, torque_coefficients, parameters):
+    c = torque_coefficients
+    # Effective field: applied field, uniaxial anisotropy and demagnetizing field of the prism
+    u = parameters['anisU']
+    B_eff = c['B_ext'] + c['anisotropy'] * dot(m, u) * u.reshape((3,) + (1,) * (m.ndim - 1)) - c['demag'] * m
+    m_x_B = cross(m, B_eff)
+    # Slonczewski spin-transfer torque of the tunnel current polarized along the fixed layer
+    p = parameters['fixedlayer']
+    epsilon = c['Pol'] * c['lambda2'] / ((c['lambda2'] + 1) + (c['lambda2'] - 1) * dot(p, m))
+    A = c['beta'] * epsilon
+    B = c['beta_epsilonprime']
+    p_x_m = cross(p, m)
+    return c['gilbert'] * ((A + c['alpha'] * B) * cross(m, p_x_m) + (B - c['alpha'] * A) * p_x_m - m_x_B - c['alpha'] * cross(m, m_x_B))
+
+
+""" INTEGRATE MACROSPIN OVER ONE QUASI-STATIC STEP WITH FIXED TUNNEL CURRENT, BY RK4 """
+def run_macrospin_quasi_static_step(m, B_ext, j_z, simulation_settings, parameters, num_time_steps):
+    dt = simulation_settings['t_quasi_static_step'] / num_time_steps
+    torque_coefficients = get_macrospin_torque_coefficients(B_ext, j_z, simulation_settings, parameters)
+    # Integrating with components first keeps each component contiguous
+    m = np.moveaxis(m, -1, 0).copy()
+    for _ in range(num_time_steps):
+        k1 = get_macrospin_torque(m, torque_coefficients, parameters)
+        k2 = get_macrospin_torque(m + dt / 2 * k1, torque_coefficients, parameters)
+        k3 = get_macrospin_torque(m + dt / 2 * k2, torque_coefficients, parameters)
+        k4 = get_macrospin_torque(m + dt * k3, torque_coefficients, parameters)
+        m += dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        m /= np.sqrt(dot(m, m))
+    return np.moveaxis(m, 0, -1)
+
+
+""" NUMBER OF RK4 TIME STEPS PER QUASI-STATIC STEP, RESOLVING THE FASTEST PRECESSION OF THE BATCH """
+def get_num_time_steps(B_ext_sweep, simulation_settings, parameters, macrospin_options):
+    Msat = parameters['Msat']
+    # Upper bound of effective field and spin-torque field magnitude, the latter for the largest (parallel state) current
+    j_z_max = np.abs(parameters['V_bias'] / np.minimum(parameters['R_p'], parameters['R_ap'])) / (simulation_settings['size_x'] * simulation_settings['size_y'])
+    B_max = (
+        np.linalg.norm(B_ext_sweep, axis=-1).max()
+        + np.max(2 * np.abs(parameters['Ku1']) / Msat)
+        + np.max(MU0 * Msat * parameters['demag_factors'].max())
+        + np.max(HBAR / QE * j_z_max / (Msat * simulation_settings['size_z']) * (np.abs(parameters['Pol']) + np.abs(parameters['epsilonprime'])))
+    )
+    num_time_steps = int(np.ceil(simulation_settings['t_quasi_static_step'] * GAMMA_LL * B_max / macrospin_options['max_precession_angle_per_time_step']))
+    return max(macrospin_options['min_time_steps_per_quasi_static_step'], num_time_steps)
+
+
+""" RUN QUASI-STATIC STEPS OF MACROSPINS FOR ALL B_ext SWEEP VALUES GIVEN ALONG THE LAST BATCH AXIS """
+def run_macrospin_quasi_static_steps(m, B_ext, simulation_settings, parameters, num_time_steps):
+    num_quasi_static_steps = simulation_settings['num_quasi_static_steps']
+    j_tunnel_convergence_tolerance = simulation_settings.get('j_tunnel_convergence_tolerance') or 0
+    m_convergence_tolerance = simulation_settings.get('m_convergence_tolerance') or 0
+    area = simulation_settings['size_x'] * simulation_settings['size_y']
+    m_average = np.full(m.shape[:-1] + (num_quasi_static_steps, 3), np.nan)
+    I_total = np.full(m.shape[:-1] + (num_quasi_static_steps,), np.nan)
+    # Macrospins drop out of the quasi-static steps once they have converged, with the criteria of the mumax template
+    active = np.ones(m.shape[:-1], dtype=bool)
+    I_total_previous = np.zeros(m.shape[:-1])
+    for i_step in range(num_quasi_static_steps):
+        j_z = macrospin_tunnel_current_density(m, simulation_settings, parameters)
+        I_total[active, i_step] = (j_z * area)[active]
+        m_next = run_macrospin_quasi_static_step(m, B_ext, j_z, simulation_settings, parameters, num_time_steps)
+        m_average[active, i_step] = m_next[active]
+        converged = np.zeros_like(active)
+        if j_tunnel_convergence_tolerance > 0 or m_convergence_tolerance > 0:
+            j_tunnel_converged = (j_tunnel_convergence_tolerance <= 0) | ((i_step > 0) & (np.abs(j_z * area - I_total_previous) <= j_tunnel_convergence_tolerance * np.abs(j_z * area)))
+            m_converged = (m_convergence_tolerance <= 0) | (np.linalg.norm(m_next - m, axis=-1) <= m_convergence_tolerance)
+            converged = j_tunnel_converged & m_converged
+        m = np.where(active[..., np.newaxis], m_next, m)
+        I_total_previous = j_z * area
+        active &= ~converged
+        if not active.any():
+            break
+    return m, m_average, I_total
+
+
+""" SIMULATE B_ext SWEEP OF MACROSPIN FREE LAYER FOR ALL PARAMETER COMBINATIONS AT ONCE """
+@traced('macrospin_sweep')
+def run_macrospin_sweep(simulation_settings, macrospin_options=None):
+    macrospin_options = {**DEFAULT_MACROSPIN_OPTIONS, **(macrospin_options or {})}
+    parameters = get_macrospin_parameters(simulation_settings, macrospin_options)
+    B_ext_sweep = np.array(get_B_ext_sweep_values(simulation_settings), dtype=np.float64)
+    num_time_steps = get_num_time_steps(B_ext_sweep, simulation_settings, parameters, macrospin_options)
+    m_start = np.broadcast_to(np.asarray(simulation_settings['m_free_start_uniform'], dtype=np.float64), parameters['batch_shape'] + (1, 3))
+    m_start = m_start / np.linalg.norm(m_start, axis=-1, keepdims=True)
+    # Without hysteresis, all sweep values start from the same magnetization and are computed together
+    if simulation_settings.get('sweep_continuation') is None:
+        m_start = np.broadcast_to(m_start, parameters['batch_shape'] + (len(B_ext_sweep), 3))
+        _, m_average, I_total = run_macrospin_quasi_static_steps(m_start, B_ext_sweep, simulation_settings, parameters, num_time_steps)
+    # In hysteresis mode, each sweep value continues from the final magnetization of the previous one
+    else:
+        m = m_start
+        m_average = []
+        I_total = []
+        for B_ext in B_ext_sweep:
+            m, m_average_sweep_value, I_total_sweep_value = run_macrospin_quasi_static_steps(m, B_ext, simulation_settings, parameters, num_time_steps)
+            m_average.append(m_average_sweep_value[..., 0, :, :])
+            I_total.append(I_total_sweep_value[..., 0, :])
+        m_average = np.stack(m_average, axis=-3)
+        I_total = np.stack(I_total, axis=-2)
+    # Results indexed as [*batch_shape, sweep value, quasi-static step], NaN after a sweep value has converged
+    return {
+        'B_ext': B_ext_sweep,
+        'm_average': m_average,
+        'I_total': I_total,
+        'R_MTJ': parameters['V_bias'][..., np.newaxis] / I_total,
+        'quasi_static_steps_used': np.sum(~np.isnan(I_total), axis=-1),
+    }
+
+
+""" PER-SWEEP-VALUE DATA OF ONE PARAMETER COMBINATION, IN THE FORM YIELDED BY gather_data FOR PLOTTING """
+def get_macrospin_sweep_value_data(macrospin_results, parameter_index=()):
+    sweep_value_data = []
+    for num_sweep_value, B_ext in enumerate(macrospin_results['B_ext']):
+        num_steps = macrospin_results['quasi_static_steps_used'][parameter_index][num_sweep_value]
+        sweep_value_data.append({
+            'B_ext': B_ext,
+            'm_average': macrospin_results['m_average'][parameter_index][num_sweep_value, :num_steps],
+            'I_total': macrospin_results['I_total'][parameter_index][num_sweep_value, :num_steps],
+            'R_MTJ': macrospin_results['R_MTJ'][parameter_index][num_sweep_value, :num_steps],
+        })
+    return sweep_value_data
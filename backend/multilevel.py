@@ -0,0 +1,77 @@
+import os
+import shutil
+
+from .simulation import DEFAULT_SIMULATION_SETTINGS, get_B_ext_sweep_values, get_m_final_filename, run_simulation
+from .mumax_template_editing import generate_ovf_headers_footers
+from .ovf_data_formatting import extract_data, convert_to_ovf
+from .field_data import resample_field, normalized_vector
+
+
+# Multilevel options used when multilevel_options does not define them
+DEFAULT_MULTILEVEL_OPTIONS = {
+    'num_levels': 3,
+    'coarsening_factor': 2,
+    'coarse_num_quasi_static_steps': None,
+}
+
+
+""" GET (Nx, Ny) GRID OF EACH LEVEL, FROM COARSEST TO THE GRID OF simulation_settings """
+def get_level_grids(simulation_settings, multilevel_options):
+    level_grids = []
+    for level in range(multilevel_options['num_levels']):
+        coarsening = multilevel_options['coarsening_factor'] ** (multilevel_options['num_levels'] - 1 - level)
+        level_grid = (max(1, round(simulation_settings['Nx'] / coarsening)), max(1, round(simulation_settings['Ny'] / coarsening)))
+        # Levels too coarse to differ from the next one are skipped
+        if not level_grids or level_grid != level_grids[-1]:
+            level_grids.append(level_grid)
+    return level_grids
+
+
+""" GET OUTPUT FOLDERS OF COARSE LEVEL, INSIDE MULTILEVEL FOLDER """
+def get_level_scripts_folders(scripts_folders, level):
+    level_folder = os.path.join(scripts_folders.get('MULTILEVEL_FOLDER', 'multilevel'), f'level_{level}')
+    return {
+        **scripts_folders,
+        'M_DYNAMICS_DATA_FOLDER': os.path.join(level_folder, 'm_dynamics'),
+        'J_TUNNEL_DATA_FOLDER': os.path.join(level_folder, 'j_tunnel_iterations'),
+        'RESULT_STORE_FOLDER': os.path.join(level_folder, 'result_store'),
+        'SWEEP_SUMMARY_FILE': os.path.join(level_folder, 'sweep_summary.json'),
+    }
+
+
+""" INTERPOLATE FINAL MAGNETIZATION OF EACH B_ext SWEEP VALUE ONTO THE NEXT GRID AND SAVE IT AS ITS STARTING OVF FILE """
+def prolongate_final_magnetization(level_settings, level_scripts_folders, next_level_settings, start_folder):
+    shutil.rmtree(start_folder, ignore_errors=True)
+    os.makedirs(start_folder)
+    m_header, m_footer = generate_ovf_headers_footers(next_level_settings, level_scripts_folders.get('OVF_HEADER_CACHE_FOLDER'))['m']
+    m_free_start_files = []
+    for num_sweep_value in range(len(level_settings['B_ext_uniform'])):
+        m_final_data = extract_data(get_m_final_filename(level_settings, level_scripts_folders, num_sweep_value), level_settings)
+        # Interpolated magnetization is renormalized to unit length in every cell
+        m_free_start_data = normalized_vector(resample_field(m_final_data, next_level_settings['Nx'], next_level_settings['Ny']))
+        m_free_start_filename = os.path.join(start_folder, f'm_free_start_data_{num_sweep_value:05d}.ovf')
+        convert_to_ovf(m_free_start_filename, m_header, m_footer, m_free_start_data)
+        m_free_start_files.append(m_free_start_filename)
+    return m_free_start_files
+
+
+""" RUN QUASI-STATIC SIMULATION COARSE TO FINE: EACH LEVEL STARTS FROM THE INTERPOLATED RESULTS OF THE COARSER ONE """
+def run_multilevel_simulation(simulation_settings, scripts_folders, run_options=None, multilevel_options=None):
+    multilevel_options = {**DEFAULT_MULTILEVEL_OPTIONS, **(multilevel_options or {})}
+    simulation_settings = {**DEFAULT_SIMULATION_SETTINGS, **simulation_settings}
+    # Levels are run on the sweep values in simulation order, so that starting files line up with them
+    simulation_settings['B_ext_uniform'] = get_B_ext_sweep_values(simulation_settings)
+    simulation_settings['sweep_continuation'] = 'up' if simulation_settings['sweep_continuation'] is not None else None
+    level_grids = get_level_grids(simulation_settings, multilevel_options)
+    m_free_start_files = simulation_settings['m_free_start_files']
+    for level, (Nx, Ny) in enumerate(level_grids[:-1]):
+        # Coarse levels only have to bring the magnetization close to its final state
+        level_settings = {**simulation_settings, 'Nx': Nx, 'Ny': Ny, 'm_free_start_files': m_free_start_files}
+        if multilevel_options['coarse_num_quasi_static_steps'] is not None:
+            level_settings['num_quasi_static_steps'] = multilevel_options['coarse_num_quasi_static_steps']
+        level_scripts_folders = get_level_scripts_folders(scripts_folders, level)
+        run_simulation(level_settings, level_scripts_folders, run_options)
+        next_level_settings = {**simulation_settings, 'Nx': level_grids[level + 1][0], 'Ny': level_grids[level + 1][1]}
+        start_folder = os.path.join(scripts_folders.get('MULTILEVEL_FOLDER', 'multilevel'), f'level_{level + 1}_start')
+        m_free_start_files = prolongate_final_magnetization(level_settings, level_scripts_folders, next_level_settings, start_folder)
+    return run_simulation({**simulation_settings, 'm_free_start_files': m_free_start_files}, scripts_folders, run_options)
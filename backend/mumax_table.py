@@ -0,0 +1,42 @@
+import io
+import os
+import numpy as np
+
+
+""" READ HEADER LINE AND ROWS OF MUMAX TABLE """
+def read_mumax_table_rows(table_filename):
+    with open(table_filename, 'r') as f:
+        header = f.readline()
+    return header, np.loadtxt(table_filename, ndmin=2)
+
+
+""" READ HEADER LINE AND COMPLETELY WRITTEN ROWS OF MUMAX TABLE THAT MAY STILL BE BEING WRITTEN """
+def read_written_mumax_table_rows(table_filename):
+    with open(table_filename, 'r') as f:
+        content = f.read()
+    header, _, rows = content.partition('\n')
+    # A row mumax is still writing lacks its line ending
+    rows = rows[:rows.rfind('\n') + 1]
+    if not rows.strip():
+        return f'{header}\n', np.empty((0, len(get_mumax_table_columns(header))))
+    return f'{header}\n', np.loadtxt(io.StringIO(rows), ndmin=2)
+
+
+""" GET QUANTITY NAMES OF MUMAX TABLE HEADER, WRITTEN AS "# name (unit)" COLUMNS SEPARATED BY TABS """
+def get_mumax_table_columns(header):
+    return [column.split(' (')[0].strip() for column in header.lstrip('#').strip().split('\t')]
+
+
+""" READ MUMAX TABLE INTO DICTIONARY OF COLUMNS BY QUANTITY NAME """
+def read_mumax_table(table_filename):
+    header, rows = read_mumax_table_rows(table_filename)
+    return {name: rows[:, i] for i, name in enumerate(get_mumax_table_columns(header))}
+
+
+""" APPEND ROWS TO MUMAX-STYLE TABLE, WRITING THE HEADER WHEN THE TABLE IS NEW """
+def append_mumax_table_rows(table_filename, header, rows):
+    write_header = not os.path.exists(table_filename)
+    with open(table_filename, 'a') as f:
+        if write_header:
+            f.write(header)
+        np.savetxt(f, rows, delimiter='\t', fmt='%.10e')
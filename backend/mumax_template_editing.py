@@ -1,42 +1,96 @@
 import os
 import shutil
 import subprocess
+import re
+import hashlib
+import json
+import time
+
+from .ovf_data_formatting import OVF_QUANTITIES, get_ovf_data_format, build_ovf_header_footer, get_header_data_format, parse_ovf_header_fields
+from .run_trace import traced
+
+
+# Assignment of a mumax script line: "name := value" declares a variable, "name = value" sets a parameter
+MUMAX_ASSIGNMENT_PATTERN = re.compile(r'^(?P<left>\s*(?P<name>[A-Za-z_][A-Za-z0-9_]*)\s*)(?P<op>:=|=)(?!=)(?P<value>.*)$', re.DOTALL)
+
+# Compiled mumax templates by filename
+COMPILED_SCRIPT_TEMPLATES = {}
+# Rendered scripts kept for reuse per template
+RENDERED_SCRIPT_CACHE_SIZE = 256
 
 
 """ EXTRACT HEADER FROM TEMPLATE OVF FILE """
 def extract_header(filepath):
-    with open(filepath, 'r') as f:
-        lines = f.readlines()
-    header_lines = []
-    for line in lines:
-        header_lines.append(line)
-        if line.strip() == '# Begin: Data Text':
-                break
-    header = ''.join(header_lines)
+    # Reading in binary mode, since the data block of binary ovf files is not valid text
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    header_end = content.index(b'\n', content.index(b'# Begin: Data')) + 1
+    header = content[:header_end].decode()
     return header
 
 
 """ EXTRACT FOOTER FROM TEMPLATE OVF FILE """
 def extract_footer(filepath):
-    footer_lines = []
-    in_footer = False
-    with open(filepath, 'r') as f:
-        for line in f:
-            if in_footer:
-                footer_lines.append(line)
-            elif line.strip() == '# End: Data Text':
-                footer_lines.append(line)
-                in_footer = True
-    return ''.join(footer_lines)
-
-
-""" GENERATE OVF FILE HEADERS AND FOOTERS FOR SIMULATION PARAMETERS """
-def generate_ovf_headers_footers(simulation_settings, generation_script_template):
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    # Binary data blocks are not followed by a newline, so the footer is located by its last data marker
+    footer_start = content.rindex(b'# End: Data')
+    return content[footer_start:].decode()
+
+
+""" GENERATE OVF FILE HEADERS AND FOOTERS FOR SIMULATION PARAMETERS, OPTIONALLY CACHED ON DISK """
+@traced('generate_ovf_headers_footers')
+def generate_ovf_headers_footers(simulation_settings, cache_folder=None):
+    # Headers depend only on grid size, cell size and data format
+    Nx = simulation_settings['Nx']
+    Ny = simulation_settings['Ny']
+    Nz = simulation_settings['Nz']
+    grid_parameters = {
+        'Nx': Nx,
+        'Ny': Ny,
+        'Nz': Nz,
+        'cell_size_x': simulation_settings['size_x'] / Nx,
+        'cell_size_y': simulation_settings['size_y'] / Ny,
+        'cell_size_z': simulation_settings['size_z'] / Nz,
+        'data_format': get_ovf_data_format(simulation_settings),
+    }
+    cache_filename = None
+    if cache_folder is not None:
+        cache_key = hashlib.sha1(json.dumps(grid_parameters, sort_keys=True).encode()).hexdigest()
+        cache_filename = os.path.join(cache_folder, f'ovf_headers_footers_{cache_key}.json')
+        if os.path.exists(cache_filename):
+            # Cache files left unreadable, e.g. by an older run interrupted while writing them, are rebuilt
+            try:
+                with open(cache_filename, 'r') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+    # Building header and footer of each quantity
+    parameters_headers_footers = {}
+    for quantity, (title, unit) in OVF_QUANTITIES.items():
+        header, footer = build_ovf_header_footer(title, unit, **grid_parameters)
+        parameters_headers_footers[quantity] = [header, footer]
+    if cache_filename is not None:
+        os.makedirs(cache_folder, exist_ok=True)
+        # Writing into a temporary file in the same folder first, so that concurrent runs never read a partially written cache file
+        temporary_cache_filename = f'{cache_filename}.{os.getpid()}.{time.monotonic_ns()}'
+        try:
+            with open(temporary_cache_filename, 'w') as f:
+                json.dump(parameters_headers_footers, f)
+            os.replace(temporary_cache_filename, cache_filename)
+        finally:
+            if os.path.exists(temporary_cache_filename):
+                os.remove(temporary_cache_filename)
+    return parameters_headers_footers
+
+
+""" GENERATE OVF FILE HEADERS AND FOOTERS BY RUNNING MUMAX ON TEMPLATE CREATION SCRIPT """
+def generate_ovf_headers_footers_with_mumax(simulation_settings, generation_script_template, mumax3_executable='mumax3'):
         # Insterting simulation settings into ovf generation script
         temporary_script_filename = 'ovf_generation_script_temporary.mx3'
         paste_settings_to_script_template(simulation_settings, generation_script_template, temporary_script_filename)
         # Running ovf generation script
-        subprocess.run(['mumax3', temporary_script_filename])
+        subprocess.run([mumax3_executable, temporary_script_filename], check=True)
         # Getting ovf files from output folder
         output_folder = f'{os.path.splitext(temporary_script_filename)[0]}.out'
         m_ovf = f'{output_folder}/m.ovf'
@@ -60,25 +114,88 @@ def generate_ovf_headers_footers(simulation_settings, generation_script_template
         return parameters_headers_footers
 
 
-""" INSERT SCRIPT SETTINGS INTO MUMAX TEMPLATE """
-def paste_settings_to_script_template(simulation_settings, template_filename, output_filename):
+""" PARSE MUMAX TEMPLATE ONCE INTO ITS LINES AND NAMED SLOTS: THE FIRST ":=" OR "=" ASSIGNMENT OF EACH NAME OUTSIDE OF ANY
+BLOCK; SLOTS LEFT EMPTY IN THE TEMPLATE HAVE TO BE FILLED BY THE SETTINGS """
+def compile_script_template(template_filename):
     with open(template_filename, 'r') as file:
         lines = file.readlines()
-    for key, value in simulation_settings.items():
-        for i, line in enumerate(lines):
-            if key in line:
-                if f'{key} :=' in line:
-                    op = ':='
-                elif f'{key} =' in line:
-                    op = '='
-                else:
-                    continue
-                parts = line.split(op)
-                if len(parts) == 2:
-                    left = parts[0].rstrip()
-                    right = parts[1].lstrip()
-                    value_str = str(value)
-                    lines[i] = f'{left} {op} {value_str}\n'
-                    break
+    slots = {}
+    required_slots = []
+    block_depth = 0
+    for i, line in enumerate(lines):
+        code = line.split('//')[0]
+        if block_depth == 0:
+            match = MUMAX_ASSIGNMENT_PATTERN.match(code)
+            if match is not None and match.group('name') not in slots:
+                slots[match.group('name')] = (i, match.group('left').rstrip(), match.group('op'))
+                if not match.group('value').strip():
+                    required_slots.append(match.group('name'))
+        block_depth += code.count('{') - code.count('}')
+    return {
+        'template_filename': template_filename,
+        'lines': tuple(lines),
+        'slots': slots,
+        'required_slots': tuple(required_slots),
+        'renders': {},
+    }
+
+
+""" GET COMPILED MUMAX TEMPLATE, COMPILING IT ON FIRST USE AND AGAIN WHEN THE TEMPLATE FILE CHANGES """
+def get_compiled_script_template(template_filename):
+    template_stat = os.stat(template_filename)
+    template_version = (template_stat.st_mtime_ns, template_stat.st_size)
+    compiled_template = COMPILED_SCRIPT_TEMPLATES.get(template_filename)
+    if compiled_template is None or compiled_template['version'] != template_version:
+        compiled_template = {**compile_script_template(template_filename), 'version': template_version}
+        COMPILED_SCRIPT_TEMPLATES[template_filename] = compiled_template
+    return compiled_template
+
+
+""" RENDER COMPILED MUMAX TEMPLATE WITH SCRIPT SETTINGS INTO SCRIPT TEXT; SETTINGS WITHOUT SLOT ARE IGNORED, AND RENDERS OF
+IDENTICAL SLOT VALUES ARE REUSED """
+def render_script_template(compiled_template, script_settings):
+    missing_slots = [name for name in compiled_template['required_slots'] if name not in script_settings]
+    if missing_slots:
+        raise ValueError(f'{compiled_template["template_filename"]}: no settings for empty template slots {", ".join(missing_slots)}')
+    slot_values = tuple((name, str(script_settings[name])) for name in compiled_template['slots'] if name in script_settings)
+    renders = compiled_template['renders']
+    script = renders.get(slot_values)
+    if script is None:
+        lines = list(compiled_template['lines'])
+        for name, value in slot_values:
+            i, left, op = compiled_template['slots'][name]
+            lines[i] = f'{left} {op} {value}\n'
+        script = ''.join(lines)
+        if len(renders) >= RENDERED_SCRIPT_CACHE_SIZE:
+            renders.clear()
+        renders[slot_values] = script
+    return script
+
+
+""" INSERT SCRIPT SETTINGS INTO MUMAX TEMPLATE """
+@traced('render_mumax_script', written_filename_argument='output_filename')
+def paste_settings_to_script_template(simulation_settings, template_filename, output_filename):
+    script = render_script_template(get_compiled_script_template(template_filename), simulation_settings)
     with open(output_filename, 'w') as file:
-        file.writelines(lines)
+        file.write(script)
+
+
+""" CHECK SYNTHESIZED OVF HEADERS AND FOOTERS AGAINST THOSE WRITTEN BY MUMAX """
+def validate_ovf_headers_footers(simulation_settings, generation_script_template, mumax3_executable='mumax3'):
+    synthesized = generate_ovf_headers_footers(simulation_settings)
+    written_by_mumax = generate_ovf_headers_footers_with_mumax(simulation_settings, generation_script_template, mumax3_executable)
+    # The creation script uses unit cell sizes, so only grid size, value layout and data format are compared
+    compared_fields = ('xnodes', 'ynodes', 'znodes', 'valuedim', 'meshtype')
+    for quantity in synthesized:
+        synthesized_header, synthesized_footer = synthesized[quantity]
+        mumax_header, mumax_footer = written_by_mumax[quantity]
+        synthesized_fields = parse_ovf_header_fields(synthesized_header)
+        mumax_fields = parse_ovf_header_fields(mumax_header)
+        for field in compared_fields:
+            if synthesized_fields.get(field) != mumax_fields.get(field):
+                raise ValueError(f'{quantity} ovf header: {field} is "{synthesized_fields.get(field)}", mumax writes "{mumax_fields.get(field)}"')
+        if get_header_data_format(synthesized_header) != get_header_data_format(mumax_header):
+            raise ValueError(f'{quantity} ovf header: data format differs from mumax output')
+        if synthesized_footer.split() != mumax_footer.split():
+            raise ValueError(f'{quantity} ovf footer differs from mumax output')
+
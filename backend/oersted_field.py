@@ -0,0 +1,69 @@
+import functools
+import numpy as np
+
+
+# Vacuum permeability, same value as used by the mumax templates
+MU0_SI = 1.256e-6
+
+
+""" OERSTED FIELD GREEN'S FUNCTION KERNEL OF UNIT CURRENT, ON ZERO-PADDED (2Nx, 2Ny) GRID """
+def get_oersted_kernel(Nx, Ny, cell_size_x, cell_size_y):
+    # Offsets between field and source cell in wrap-around order: 0, 1, ..., N-1, -N, ..., -1
+    dx = np.fft.fftfreq(2 * Nx, 1 / (2 * Nx)) * cell_size_x
+    dy = np.fft.fftfreq(2 * Ny, 1 / (2 * Ny)) * cell_size_y
+    dx, dy = np.meshgrid(dx, dy, indexing='ij')
+    r_squared = dx**2 + dy**2
+    # A cell's own current does not contribute to the field at its center
+    r_squared[0, 0] = np.inf
+    # Field of a straight current along z: B = mu0 * I / (2 * pi * r^2) * (z x r)
+    kernel_x = -MU0_SI / (2 * np.pi) * dy / r_squared
+    kernel_y = MU0_SI / (2 * np.pi) * dx / r_squared
+    return kernel_x, kernel_y
+
+
+""" FOURIER SPECTRUM OF OERSTED FIELD KERNEL, COMPUTED ONCE PER GRID GEOMETRY """
+@functools.lru_cache(maxsize=8)
+def get_oersted_kernel_spectrum(Nx, Ny, cell_size_x, cell_size_y):
+    kernel_x, kernel_y = get_oersted_kernel(Nx, Ny, cell_size_x, cell_size_y)
+    return np.fft.rfft2(kernel_x), np.fft.rfft2(kernel_y)
+
+
+""" GET CELL SIZES AND CURRENT THROUGH EACH CELL FROM TUNNEL CURRENT DENSITY DISTRIBUTION """
+def get_cell_currents(j_data, simulation_settings):
+    cell_size_x = simulation_settings['size_x'] / simulation_settings['Nx']
+    cell_size_y = simulation_settings['size_y'] / simulation_settings['Ny']
+    I_cell = np.asarray(j_data, dtype=np.float64)[..., 2] * cell_size_x * cell_size_y
+    return cell_size_x, cell_size_y, I_cell
+
+
+""" COMPUTE OERSTED FIELD OF TUNNEL CURRENT BY ZERO-PADDED FFT CONVOLUTION """
+def compute_oersted_field(j_data, simulation_settings):
+    Nx = simulation_settings['Nx']
+    Ny = simulation_settings['Ny']
+    cell_size_x, cell_size_y, I_cell = get_cell_currents(j_data, simulation_settings)
+    kernel_x_spectrum, kernel_y_spectrum = get_oersted_kernel_spectrum(Nx, Ny, cell_size_x, cell_size_y)
+    # Zero padding to (2Nx, 2Ny) turns the circular FFT convolution into the linear one
+    I_spectrum = np.fft.rfft2(I_cell, s=(2 * Nx, 2 * Ny))
+    B_oe_data = np.zeros((Nx, Ny, 3), dtype=np.float64)
+    B_oe_data[..., 0] = np.fft.irfft2(I_spectrum * kernel_x_spectrum, s=(2 * Nx, 2 * Ny))[:Nx, :Ny]
+    B_oe_data[..., 1] = np.fft.irfft2(I_spectrum * kernel_y_spectrum, s=(2 * Nx, 2 * Ny))[:Nx, :Ny]
+    return B_oe_data
+
+
+""" COMPUTE OERSTED FIELD OF TUNNEL CURRENT BY DIRECT SUMMATION OVER ALL CELL PAIRS (REFERENCE) """
+def compute_oersted_field_brute_force(j_data, simulation_settings):
+    Nx = simulation_settings['Nx']
+    Ny = simulation_settings['Ny']
+    cell_size_x, cell_size_y, I_cell = get_cell_currents(j_data, simulation_settings)
+    i, j = np.meshgrid(np.arange(Nx), np.arange(Ny), indexing='ij')
+    B_oe_data = np.zeros((Nx, Ny, 3), dtype=np.float64)
+    # Adding the contribution of each source cell (m, n) to every field cell
+    for m in range(Nx):
+        for n in range(Ny):
+            dx = cell_size_x * (i - m)
+            dy = cell_size_y * (j - n)
+            r_squared = dx**2 + dy**2
+            r_squared[m, n] = np.inf
+            B_oe_data[..., 0] += -MU0_SI * I_cell[m, n] / (2 * np.pi) * dy / r_squared
+            B_oe_data[..., 1] += MU0_SI * I_cell[m, n] / (2 * np.pi) * dx / r_squared
+    return B_oe_data
@@ -1,57 +1,187 @@
-""" EXTRACT DATA FROM OVF FILE AND CONVERT IT TO PYTHON READABLE FORMAT """
-def extract_data(filepath, simulation_settings):
-    # Extracting data in string format
-    data_lines = []
-    extracting_data = False
-    with open(filepath, 'r') as f:
-        for line in f:
-            if line.strip() == '# Begin: Data Text':
-                extracting_data = True
-                continue
-            elif line.strip() == '# End: Data Text':
+import os
+import warnings
+import numpy as np
+
+from .run_trace import traced
+
+
+# Control values stored in front of OVF2 binary data blocks to validate byte order and precision
+OVF_BINARY_CONTROL_VALUES = {
+    'Binary 4': (np.dtype('<f4'), 1234567.0),
+    'Binary 8': (np.dtype('<f8'), 123456789012345.0),
+}
+
+# Title and unit of each ovf quantity used by the project
+OVF_QUANTITIES = {
+    'm': ('m', '1'),
+    'Bext': ('B_ext', 'T'),
+    'J': ('J', 'A/m2'),
+}
+
+
+""" GET OVF DATA FORMAT MATCHING MUMAX OutputFormat SETTING """
+def get_ovf_data_format(simulation_settings):
+    output_format = str(simulation_settings.get('OutputFormat', 'OVF2_TEXT')).upper()
+    return 'Text' if output_format.endswith('TEXT') else 'Binary 4'
+
+
+""" BUILD OVF2 HEADER AND FOOTER OF VECTOR QUANTITY IN THE LAYOUT WRITTEN BY MUMAX3 """
+def build_ovf_header_footer(title, unit, Nx, Ny, Nz, cell_size_x, cell_size_y, cell_size_z, data_format):
+    header_lines = [
+        'OOMMF OVF 2.0',
+        'Segment count: 1',
+        'Begin: Segment',
+        'Begin: Header',
+        f'Title: {title}',
+        'meshtype: rectangular',
+        'meshunit: m',
+        'xmin: 0',
+        'ymin: 0',
+        'zmin: 0',
+        f'xmax: {Nx * cell_size_x!r}',
+        f'ymax: {Ny * cell_size_y!r}',
+        f'zmax: {Nz * cell_size_z!r}',
+        'valuedim: 3',
+        f'valuelabels: {title}_x {title}_y {title}_z',
+        f'valueunits: {unit} {unit} {unit}',
+        'Desc: Total simulation time:  0  s',
+        f'xbase: {cell_size_x / 2!r}',
+        f'ybase: {cell_size_y / 2!r}',
+        f'zbase: {cell_size_z / 2!r}',
+        f'xnodes: {Nx}',
+        f'ynodes: {Ny}',
+        f'znodes: {Nz}',
+        f'xstepsize: {cell_size_x!r}',
+        f'ystepsize: {cell_size_y!r}',
+        f'zstepsize: {cell_size_z!r}',
+        'End: Header',
+        f'Begin: Data {data_format}',
+    ]
+    header = ''.join(f'# {line}\n' for line in header_lines)
+    footer = f'# End: Data {data_format}\n# End: Segment\n'
+    return header, footer
+
+
+""" PARSE "# key: value" ENTRIES OF OVF HEADER """
+def parse_ovf_header_fields(header):
+    header_fields = {}
+    for line in header.splitlines():
+        if line.startswith('#') and ':' in line:
+            key, value = line[1:].split(':', 1)
+            header_fields[key.strip().lower()] = value.strip()
+    return header_fields
+
+
+""" READ OVF FILE HEADER: DATA FORMAT, BYTE OFFSET OF DATA BLOCK AND HEADER FIELDS """
+def read_ovf_layout(filepath):
+    header_lines = []
+    data_format = None
+    data_offset = 0
+    with open(filepath, 'rb') as f:
+        for raw_line in f:
+            data_offset += len(raw_line)
+            line = raw_line.decode('ascii', errors='replace').strip()
+            if line.startswith('# Begin: Data '):
+                data_format = line[len('# Begin: Data '):].strip()
                 break
-            if extracting_data:
-                data_lines.append(line)
-    data_string = ''.join(data_lines)
-    # COnverting data to numeric values
+            header_lines.append(line)
+    if data_format is None:
+        raise ValueError(f'{filepath} does not contain an OVF data block')
+    return data_format, data_offset, parse_ovf_header_fields('\n'.join(header_lines))
+
+
+""" CHECK THAT OVF FILE GRID MATCHES SIMULATION SETTINGS """
+def check_ovf_grid(filepath, header_fields, simulation_settings):
+    for key, setting in (('xnodes', 'Nx'), ('ynodes', 'Ny')):
+        if key in header_fields and int(header_fields[key]) != simulation_settings[setting]:
+            raise ValueError(f'{filepath}: {key} = {header_fields[key]} does not match {setting} = {simulation_settings[setting]}')
+
+
+""" EXTRACT DATA FROM OVF FILE AND CONVERT IT TO (Nx, Ny, 3) NUMPY ARRAY """
+@traced('extract_data', read_filename_argument='filepath')
+def extract_data(filepath, simulation_settings, mmap=False):
+    data_format, data_offset, header_fields = read_ovf_layout(filepath)
+    check_ovf_grid(filepath, header_fields, simulation_settings)
     Nx = simulation_settings['Nx']
     Ny = simulation_settings['Ny']
-    flat_values = list(map(float, data_string.split()))
-    data_numeric = [[None for _ in range(Ny)] for _ in range(Nx)]
-    index = 0
-    for j in range(Ny):
-        for i in range(Nx):
-            vector = flat_values[index:index+3]
-            data_numeric[i][j] = vector
-            index += 3
-    return data_numeric
-
-
-""" CONVERT OVF FILE FORMATTING FROM DOS FILE TO UNIX """
-def convert_to_unix(filename):
-    with open(filename, 'r') as f:
-        content = f.read()
-    with open(filename, 'w', newline='\n') as f:
-        f.write(content)
-
-
-""" CONSTRUCT OVF FILE FROM PYTHON DATA """
+    num_values = Nx * Ny * 3
+    # Text data: converting the whole data block to numeric values in a single pass
+    if data_format == 'Text':
+        with open(filepath, 'r') as f:
+            content = f.read()
+        data_start = content.index('\n', content.index('# Begin: Data Text')) + 1
+        data_end = content.index('# End: Data Text', data_start)
+        # Depending on the numpy version, a token that is not a number stops parsing with a warning or raises an error
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                flat_values = np.fromstring(content[data_start:data_end], dtype=np.float64, sep=' ')
+            except (DeprecationWarning, ValueError):
+                raise ValueError(f'{filepath}: OVF "Text" data contains values that are not numbers') from None
+        if flat_values.size != num_values:
+            raise ValueError(f'{filepath}: expected {num_values} values, found {flat_values.size}')
+        # Cells are stored with the x index running fastest
+        return np.ascontiguousarray(flat_values.reshape(Ny, Nx, 3).transpose(1, 0, 2))
+    # Binary data: validating the control value, then loading the data block without intermediate copies
+    if data_format not in OVF_BINARY_CONTROL_VALUES:
+        raise ValueError(f'{filepath}: unsupported OVF data format "{data_format}"')
+    dtype, control_value = OVF_BINARY_CONTROL_VALUES[data_format]
+    with open(filepath, 'rb') as f:
+        f.seek(data_offset)
+        stored_control_value = np.frombuffer(f.read(dtype.itemsize), dtype=dtype)
+        if stored_control_value.size != 1 or stored_control_value[0] != control_value:
+            raise ValueError(f'{filepath}: invalid OVF "{data_format}" control value {stored_control_value}')
+        if mmap:
+            flat_values = np.memmap(filepath, dtype=dtype, mode='r', offset=data_offset + dtype.itemsize, shape=(num_values,))
+        else:
+            flat_values = np.fromfile(f, dtype=dtype, count=num_values)
+    if flat_values.size != num_values:
+        raise ValueError(f'{filepath}: expected {num_values} values, found {flat_values.size}')
+    # Cells are stored with the x index running fastest; the transpose is a view, not a copy
+    return flat_values.reshape(Ny, Nx, 3).transpose(1, 0, 2)
+
+
+""" CHECK WHETHER OVF FILE IS COMPLETELY WRITTEN, ENDING WITH THE END OF ITS SEGMENT """
+def is_ovf_file_complete(filepath):
+    end_of_segment = b'# End: Segment'
+    with open(filepath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - len(end_of_segment) - 2))
+        return f.read().rstrip().endswith(end_of_segment)
+
+
+""" GET DATA FORMAT DECLARED BY OVF HEADER """
+def get_header_data_format(header):
+    for line in reversed(header.strip().splitlines()):
+        if line.strip().startswith('# Begin: Data '):
+            return line.strip()[len('# Begin: Data '):].strip()
+    raise ValueError('OVF header does not end with a "# Begin: Data" line')
+
+
+""" CONSTRUCT OVF FILE FROM (Nx, Ny, 3) NUMPY ARRAY """
+@traced('convert_to_ovf', written_filename_argument='output_filename')
 def convert_to_ovf(output_filename, header, footer, data):
-    Nx = len(data)
-    Ny = len(data[0])
-    with open(output_filename, 'w') as f:
-        # Writing header
-        f.write(header)
-        if not header.endswith('\n'):
-            f.write('\n')
-        # Writing data
-        for j in range(Ny):
-            for i in range(Nx):
-                vector = data[i][j]
-                line = f'{vector[0]} {vector[1]} {vector[2]}\n'
-                f.write(line)
-        # Writing footer
-        if not footer.startswith('\n') and not footer.startswith('#'):
-            f.write('\n')
-        f.write(footer)
-    convert_to_unix(output_filename)
+    data = np.asarray(data)
+    data_format = get_header_data_format(header)
+    # Reordering cells so that the x index runs fastest
+    flat_values = data.transpose(1, 0, 2).reshape(-1)
+    if not header.endswith('\n'):
+        header += '\n'
+    # Text data is written as one formatted block with unix line endings
+    if data_format == 'Text':
+        with open(output_filename, 'w', newline='\n') as f:
+            f.write(header)
+            f.write(('%r %r %r\n' * (flat_values.size // 3)) % tuple(flat_values.astype(np.float64).tolist()))
+            if not footer.startswith('\n') and not footer.startswith('#'):
+                f.write('\n')
+            f.write(footer)
+        return
+    # Binary data is written as control value followed by the raw little-endian values
+    if data_format not in OVF_BINARY_CONTROL_VALUES:
+        raise ValueError(f'unsupported OVF data format "{data_format}"')
+    dtype, control_value = OVF_BINARY_CONTROL_VALUES[data_format]
+    with open(output_filename, 'wb') as f:
+        f.write(header.encode())
+        f.write(np.array([control_value], dtype=dtype).tobytes())
+        f.write(flat_values.astype(dtype).tobytes())
+        f.write(footer.lstrip('\n').encode())
@@ -0,0 +1,139 @@
+import os
+import json
+import shutil
+import itertools
+import numpy as np
+
+from .simulation import DEFAULT_SIMULATION_SETTINGS, get_B_ext_sweep_values, run_simulation
+from .data_visualization import gather_data
+
+
+# Settings that determine the grid of a run, and with it the OVF headers and footers of its input files
+GRID_SETTINGS = ('Nx', 'Ny', 'Nz', 'size_x', 'size_y', 'size_z', 'OutputFormat')
+
+
+""" GET SETTINGS OF EACH POINT OF SWEEP AXIS: 'cartesian' TAKES ALL COMBINATIONS OF THE VALUES OF ITS SETTINGS, 'zip' THE iTH VALUES
+OF ALL ITS SETTINGS TOGETHER, 'latin_hypercube' num_samples POINTS SAMPLING EACH (low, high) RANGE ONCE PER EQUAL-WIDTH STRATUM """
+def get_axis_points(axis):
+    names = list(axis['settings'])
+    if axis['type'] == 'cartesian':
+        return [dict(zip(names, values)) for values in itertools.product(*axis['settings'].values())]
+    if axis['type'] == 'zip':
+        num_points = {len(values) for values in axis['settings'].values()}
+        if len(num_points) != 1:
+            raise ValueError(f'zipped sweep axis over {", ".join(names)} needs the same number of values for each setting')
+        return [dict(zip(names, values)) for values in zip(*axis['settings'].values())]
+    if axis['type'] == 'latin_hypercube':
+        num_samples = axis['num_samples']
+        rng = np.random.default_rng(axis.get('seed'))
+        samples = {}
+        for name, (low, high) in axis['settings'].items():
+            # One sample inside each of the num_samples strata of the range, strata shuffled independently per setting
+            strata = rng.permutation(num_samples)
+            samples[name] = low + (strata + rng.random(num_samples)) / num_samples * (high - low)
+        return [{name: float(samples[name][i]) for name in names} for i in range(num_samples)]
+    raise ValueError(f'unknown sweep axis type "{axis["type"]}", expected "cartesian", "zip" or "latin_hypercube"')
+
+
+""" HASHABLE KEY OF SETTINGS, EQUAL FOR SETTINGS GIVING THE SAME RESULTS """
+def get_settings_key(settings):
+    return json.dumps(settings, sort_keys=True, default=lambda value: value.tolist() if hasattr(value, 'tolist') else str(value))
+
+
+""" EXPAND SWEEP SPECIFICATION INTO THE SETTINGS OF EACH POINT OF THE SWEEP, INDEXED BY ONE COORDINATE PER AXIS """
+def expand_parameter_sweep(simulation_settings, sweep_spec):
+    axes_points = [get_axis_points(axis) for axis in sweep_spec['axes']]
+    points = {}
+    for coordinates in itertools.product(*[range(len(axis_points)) for axis_points in axes_points]):
+        point_settings = {**simulation_settings}
+        for axis_points, i in zip(axes_points, coordinates):
+            point_settings.update(axis_points[i])
+        points[coordinates] = point_settings
+    return axes_points, points
+
+
+""" GROUP POINTS OF SWEEP INTO SIMULATION RUNS: POINTS WITH IDENTICAL SETTINGS ARE COMPUTED ONCE, AND POINTS DIFFERING ONLY IN
+THEIR B_ext VALUES ARE MERGED INTO ONE RUN OF ALL THEIR DISTINCT B_ext VALUES; RUNS ARE ORDERED BY GRID """
+def get_parameter_sweep_runs(points):
+    runs = {}
+    for coordinates, point_settings in points.items():
+        point_settings = {**DEFAULT_SIMULATION_SETTINGS, **point_settings}
+        # In hysteresis mode the B_ext values form a chain, so only identical sweeps are merged
+        if point_settings['sweep_continuation'] is None:
+            run_key = get_settings_key({key: value for key, value in point_settings.items() if key != 'B_ext_uniform'})
+        else:
+            run_key = get_settings_key(point_settings)
+        run = runs.setdefault(run_key, {'settings': {**point_settings, 'B_ext_uniform': []}, 'B_ext_indices': {}, 'points': {}})
+        if point_settings['sweep_continuation'] is None:
+            sweep_values = []
+            for B_ext in point_settings['B_ext_uniform']:
+                B_ext = tuple(float(component) for component in B_ext)
+                if B_ext not in run['B_ext_indices']:
+                    run['B_ext_indices'][B_ext] = len(run['settings']['B_ext_uniform'])
+                    run['settings']['B_ext_uniform'].append(list(B_ext))
+                sweep_values.append(run['B_ext_indices'][B_ext])
+        else:
+            run['settings']['B_ext_uniform'] = point_settings['B_ext_uniform']
+            sweep_values = list(range(len(get_B_ext_sweep_values(point_settings))))
+        run['points'][coordinates] = sweep_values
+    # Runs sharing a grid run one after another, reusing the OVF headers and footers generated for the first of them
+    return sorted(runs.values(), key=lambda run: get_grid_key(run['settings']))
+
+
+""" GET FOLDER OF RUNS OF PARAMETER SWEEP """
+def get_parameter_sweep_folder(scripts_folders):
+    return scripts_folders.get('PARAMETER_SWEEP_FOLDER', 'parameter_sweep')
+
+
+""" GET GRID OF RUN, SHARED BY RUNS WITH THE SAME OVF HEADERS AND FOOTERS """
+def get_grid_key(settings):
+    return get_settings_key([settings.get(key) for key in GRID_SETTINGS])
+
+
+""" GET OUTPUT FOLDERS OF iTH RUN OF PARAMETER SWEEP, INSIDE PARAMETER SWEEP FOLDER """
+def get_run_scripts_folders(scripts_folders, i_run):
+    run_folder = os.path.join(get_parameter_sweep_folder(scripts_folders), f'run_{i_run:05d}')
+    return {
+        **scripts_folders,
+        'M_DYNAMICS_DATA_FOLDER': os.path.join(run_folder, 'm_dynamics'),
+        'J_TUNNEL_DATA_FOLDER': os.path.join(run_folder, 'j_tunnel_iterations'),
+        'RESULT_STORE_FOLDER': os.path.join(run_folder, 'result_store'),
+        'SWEEP_SUMMARY_FILE': os.path.join(run_folder, 'sweep_summary.json'),
+    }
+
+
+""" RUN SWEEP OF SIMULATION SETTINGS OVER THE AXES OF sweep_spec, EACH POINT SWEEPING ITS B_ext_uniform AS USUAL; RETURNS THE
+SETTINGS OF EACH AXIS POINT, THE RUNS, AND FOR EACH POINT ITS RUN AND SWEEP VALUES IN AN ARRAY INDEXED BY AXIS COORDINATES """
+def run_parameter_sweep(simulation_settings, scripts_folders, sweep_spec, run_options=None):
+    axes_points, points = expand_parameter_sweep(simulation_settings, sweep_spec)
+    runs = get_parameter_sweep_runs(points)
+    point_runs = np.empty(tuple(len(axis_points) for axis_points in axes_points), dtype=object)
+    # Clearing runs of previous parameter sweeps
+    shutil.rmtree(get_parameter_sweep_folder(scripts_folders), ignore_errors=True)
+    validated_grids = set()
+    for i_run, run in enumerate(runs):
+        run['scripts_folders'] = get_run_scripts_folders(scripts_folders, i_run)
+        # OVF headers and footers are only checked against mumax once per grid
+        run_options_of_run = {**(run_options or {})}
+        if get_grid_key(run['settings']) in validated_grids:
+            run_options_of_run['validate_ovf_headers'] = False
+        validated_grids.add(get_grid_key(run['settings']))
+        print(f'PARAMETER SWEEP:   run {i_run + 1} / {len(runs)} ({len(run["points"])} points)')
+        run_simulation(run['settings'], run['scripts_folders'], run_options_of_run)
+        for coordinates, sweep_values in run['points'].items():
+            point_runs[coordinates] = {'run': i_run, 'sweep_values': sweep_values}
+    return {'axes': axes_points, 'runs': runs, 'points': point_runs}
+
+
+""" GATHER DATA OF EACH B_ext SWEEP VALUE OF PARAMETER SWEEP POINT, AS gather_data DOES FOR A SINGLE RUN """
+def get_parameter_sweep_point_data(parameter_sweep_results, coordinates, keep_fields=False):
+    point = parameter_sweep_results['points'][tuple(coordinates)]
+    run = parameter_sweep_results['runs'][point['run']]
+    sweep_value_data = list(gather_data(run['settings'], run['scripts_folders'], keep_fields))
+    if run['settings']['sweep_continuation'] is not None:
+        return sweep_value_data
+    # Sweep values of merged runs are told apart by their B_ext value, distinct within the run
+    sweep_value_data_by_B_ext = {tuple(float(component) for component in data['B_ext']): data for data in sweep_value_data}
+    B_ext_uniform = [tuple(run['settings']['B_ext_uniform'][i]) for i in point['sweep_values']]
+    # Sweep values that were not stored (e.g. of an interrupted run) are left out, as gather_data does
+    return [sweep_value_data_by_B_ext[B_ext] for B_ext in B_ext_uniform if B_ext in sweep_value_data_by_B_ext]
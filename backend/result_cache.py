@@ -0,0 +1,168 @@
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+
+from .run_trace import traced
+
+
+# File marking a cache entry as completely written
+COMPLETE_MARKER = 'COMPLETE'
+# Suffix of cache entries that are still being written, followed by the pid of the writing process
+PARTIAL_SUFFIX = '.partial'
+# Seconds after which partial cache entries count as left behind, even if a process with their pid is running
+PARTIAL_ENTRY_MAX_AGE = 3600
+# Settings that do not change the results of an individual B_ext sweep value (its B_ext and
+# starting magnetization enter the cache key separately)
+PER_SWEEP_VALUE_SETTINGS = ('B_ext_uniform', 'sweep_continuation', 'm_free_start_files')
+# Version of the cached results; increasing it invalidates all cache entries written before
+RESULT_CACHE_VERSION = 2
+# Python modules computing the tunnel current and Oersted field of each step when oersted_field_from_python is set
+PYTHON_PHYSICS_MODULES = ('field_data.py', 'oersted_field.py')
+
+
+""" HASH OF MUMAX TEMPLATE, SETTINGS SHARED BY ALL B_ext SWEEP VALUES OF RUN AND CODE COMPUTING THEM: THE MUMAX EXECUTABLE
+AND, WITH THE OERSTED FIELD FROM PYTHON, THE PYTHON PHYSICS MODULES """
+def get_run_cache_key(simulation_settings, scripts_folders, mumax3_executable):
+    key_hash = hashlib.sha256()
+    key_hash.update(f'{RESULT_CACHE_VERSION}\n'.encode())
+    # Results of different mumax executables (e.g. the stub and the real one) are never mixed up
+    key_hash.update(get_executable_identity(mumax3_executable).encode())
+    if simulation_settings.get('oersted_field_from_python'):
+        for module_filename in PYTHON_PHYSICS_MODULES:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module_filename), 'rb') as f:
+                key_hash.update(f.read())
+    # The template together with the settings determines the rendered script
+    with open(scripts_folders['MTJ_SCRIPT_TEMPLATE'], 'rb') as f:
+        key_hash.update(f.read())
+    shared_settings = {key: value for key, value in simulation_settings.items() if key not in PER_SWEEP_VALUE_SETTINGS}
+    key_hash.update(json.dumps(shared_settings, sort_keys=True, default=str).encode())
+    return key_hash.hexdigest()
+
+
+""" IDENTITY OF EXECUTABLE: ITS RESOLVED PATH, SIZE AND MODIFICATION TIME, CHANGING WHEN IT IS REPLACED OR UPDATED """
+def get_executable_identity(executable):
+    executable_filename = os.path.realpath(shutil.which(executable) or executable)
+    if not os.path.exists(executable_filename):
+        return executable_filename
+    executable_stat = os.stat(executable_filename)
+    return f'{executable_filename}\n{executable_stat.st_size}\n{executable_stat.st_mtime_ns}\n'
+
+
+""" CACHE KEY OF B_ext SWEEP VALUE FROM RUN KEY, B_ext VALUE AND STARTING STATE """
+def get_sweep_value_cache_key(run_cache_key, B_ext_uniform, start_state_key):
+    key_hash = hashlib.sha256()
+    key_hash.update(run_cache_key.encode())
+    key_hash.update(np.asarray(B_ext_uniform, dtype=np.float64).tobytes())
+    key_hash.update(start_state_key.encode())
+    return key_hash.hexdigest()
+
+
+""" HASH OF STARTING MAGNETIZATION DATA """
+def get_field_data_key(field_data):
+    return hashlib.sha256(np.ascontiguousarray(field_data, dtype=np.float64).tobytes()).hexdigest()
+
+
+""" CACHE ENTRY FOLDER OF KEY """
+def get_cache_entry_folder(cache_folder, cache_key):
+    return os.path.join(cache_folder, cache_key)
+
+
+""" COPY RESULT FOLDERS OF CACHED B_ext SWEEP VALUE TO OUTPUT FOLDERS; RETURNS FALSE ON CACHE MISS """
+def restore_cached_results(cache_folder, cache_key, output_folders):
+    entry_folder = get_cache_entry_folder(cache_folder, cache_key)
+    marker_filename = os.path.join(entry_folder, COMPLETE_MARKER)
+    if not os.path.exists(marker_filename):
+        return False
+    for i_folder, output_folder in enumerate(output_folders):
+        shutil.rmtree(output_folder, ignore_errors=True)
+        shutil.copytree(os.path.join(entry_folder, str(i_folder)), output_folder, copy_function=link_or_copy)
+    # Marking the entry as recently used for garbage collection
+    os.utime(marker_filename)
+    return True
+
+
+""" STORE RESULT FOLDERS OF B_ext SWEEP VALUE IN CACHE """
+@traced('store_results_in_result_cache')
+def store_results(cache_folder, cache_key, output_folders):
+    entry_folder = get_cache_entry_folder(cache_folder, cache_key)
+    if os.path.exists(os.path.join(entry_folder, COMPLETE_MARKER)):
+        return
+    # Writing into a partial folder first, so that interrupted writes are never mistaken for results
+    partial_folder = f'{entry_folder}{PARTIAL_SUFFIX}.{os.getpid()}.{time.monotonic_ns()}'
+    for i_folder, output_folder in enumerate(output_folders):
+        shutil.copytree(output_folder, os.path.join(partial_folder, str(i_folder)), copy_function=link_or_copy)
+    with open(os.path.join(partial_folder, COMPLETE_MARKER), 'w') as f:
+        f.write(cache_key)
+    shutil.rmtree(entry_folder, ignore_errors=True)
+    os.rename(partial_folder, entry_folder)
+
+
+""" HARD LINK FILE, FALLING BACK TO A COPY ACROSS FILE SYSTEMS """
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+    return destination
+
+
+""" CHECK WHETHER PARTIAL CACHE ENTRY MAY STILL BE WRITTEN: IT IS RECENT AND THE PROCESS WRITING IT IS ALIVE """
+def is_partial_cache_entry_in_progress(entry_folder):
+    if time.time() - os.path.getmtime(entry_folder) > PARTIAL_ENTRY_MAX_AGE:
+        return False
+    try:
+        pid = int(os.path.basename(entry_folder).split(PARTIAL_SUFFIX)[1].split('.')[1])
+    except (IndexError, ValueError):
+        return False
+    # Only POSIX can probe a process without touching it; on Windows os.kill would terminate it
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+""" REMOVE CACHE ENTRIES LEFT INCOMPLETE BY KILLED JOBS, KEEPING THOSE OTHER PROCESSES ARE STILL WRITING """
+def discard_partial_cache_entries(cache_folder):
+    for entry_folder in glob.glob(os.path.join(cache_folder, '*')):
+        if not os.path.isdir(entry_folder) or os.path.exists(os.path.join(entry_folder, COMPLETE_MARKER)):
+            continue
+        if PARTIAL_SUFFIX in os.path.basename(entry_folder) and is_partial_cache_entry_in_progress(entry_folder):
+            continue
+        shutil.rmtree(entry_folder, ignore_errors=True)
+
+
+""" REMOVE CACHE ENTRIES OLDER THAN max_age_days, THEN LEAST RECENTLY USED ENTRIES UNTIL CACHE FITS max_size_bytes """
+def garbage_collect_result_cache(cache_folder, max_age_days=None, max_size_bytes=None):
+    if not os.path.isdir(cache_folder):
+        return
+    discard_partial_cache_entries(cache_folder)
+    entries = []
+    for entry_folder in glob.glob(os.path.join(cache_folder, '*')):
+        # Partial entries still being written are neither complete nor counted
+        if not os.path.exists(os.path.join(entry_folder, COMPLETE_MARKER)):
+            continue
+        last_used = os.path.getmtime(os.path.join(entry_folder, COMPLETE_MARKER))
+        size = sum(os.path.getsize(filename) for filename in glob.glob(os.path.join(entry_folder, '**'), recursive=True) if os.path.isfile(filename))
+        entries.append((last_used, size, entry_folder))
+    entries.sort()
+    if max_age_days is not None:
+        oldest_kept = time.time() - max_age_days * 24 * 3600
+        for last_used, size, entry_folder in [entry for entry in entries if entry[0] < oldest_kept]:
+            shutil.rmtree(entry_folder, ignore_errors=True)
+        entries = [entry for entry in entries if entry[0] >= oldest_kept]
+    if max_size_bytes is not None:
+        total_size = sum(size for _, size, _ in entries)
+        for last_used, size, entry_folder in entries:
+            if total_size <= max_size_bytes:
+                break
+            shutil.rmtree(entry_folder, ignore_errors=True)
+            total_size -= size
@@ -0,0 +1,128 @@
+import os
+import glob
+import json
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from .ovf_data_formatting import extract_data
+from .mumax_table import read_mumax_table
+from .run_trace import traced
+
+
+# Field data is stored in single precision, the precision mumax computes and saves it in
+RESULT_STORE_DTYPE = np.float32
+
+
+""" GET FOLDER OF RESULT STORE OF RUN """
+def get_result_store_folder(scripts_folders):
+    return scripts_folders.get('RESULT_STORE_FOLDER', os.path.join(os.path.dirname(scripts_folders['M_DYNAMICS_DATA_FOLDER']), 'result_store'))
+
+
+""" GET NUMBER OF QUASI-STATIC STEPS BETWEEN SAVED m AND J DISTRIBUTIONS (0 SAVES THE FINAL STEP ONLY) """
+def get_field_output_interval(simulation_settings):
+    # Full output saves the fields of every step, minimal output only those of every field_output_interval steps and the final step
+    if simulation_settings['output_level'] == 'full':
+        return 1
+    if simulation_settings['output_level'] == 'minimal':
+        return simulation_settings['field_output_interval'] or 0
+    raise ValueError(f'unknown output_level "{simulation_settings["output_level"]}", expected "full" or "minimal"')
+
+
+""" GET NUMBER OF m AND J FIELDS SAVED PER B_ext SWEEP VALUE AT MOST: EVERY field_output_interval STEPS AND THE FINAL STEP """
+def get_num_field_slots(num_quasi_static_steps, field_output_interval):
+    if field_output_interval == 0:
+        return 1
+    return get_field_slot(num_quasi_static_steps - 1, field_output_interval) + 1
+
+
+""" GET INDEX OF SAVED FIELD OF QUASI-STATIC STEP; A FINAL STEP BETWEEN TWO INTERVAL STEPS TAKES THE INDEX AFTER THE LAST
+INTERVAL STEP, SO THAT THE SAVED FIELDS OF A SWEEP VALUE ALWAYS TAKE CONSECUTIVE INDICES FROM 0 """
+def get_field_slot(i_step, field_output_interval):
+    if field_output_interval == 0:
+        return 0
+    return -(-i_step // field_output_interval)
+
+
+""" CREATE EMPTY RESULT STORE FOR ALL B_ext SWEEP VALUES AND QUASI-STATIC STEPS OF RUN """
+def create_result_store(simulation_settings, scripts_folders):
+    result_store_folder = get_result_store_folder(scripts_folders)
+    os.makedirs(result_store_folder, exist_ok=True)
+    num_sweep_values = len(simulation_settings['B_ext_uniform'])
+    num_quasi_static_steps = simulation_settings['num_quasi_static_steps']
+    field_output_interval = get_field_output_interval(simulation_settings)
+    num_field_slots = get_num_field_slots(num_quasi_static_steps, field_output_interval)
+    # Final magnetization and tunnel current density of each saved quasi-static step, indexed as [sweep, saved field, x, y, component],
+    # so that minimal output only takes the space of the fields it saves
+    field_shape = (num_sweep_values, num_field_slots, simulation_settings['Nx'], simulation_settings['Ny'], 3)
+    for name in ('m', 'J'):
+        open_memmap(os.path.join(result_store_folder, f'{name}.npy'), mode='w+', dtype=RESULT_STORE_DTYPE, shape=field_shape).flush()
+    # Quasi-static step of each saved field, -1 for fields not saved
+    np.save(os.path.join(result_store_folder, 'field_steps.npy'), np.full(field_shape[:2], -1, dtype=np.int32))
+    # Per-step total tunnel current, MTJ resistance and average magnetization, NaN for steps that were not run
+    np.save(os.path.join(result_store_folder, 'I_total.npy'), np.full((num_sweep_values, num_quasi_static_steps), np.nan))
+    np.save(os.path.join(result_store_folder, 'R_MTJ.npy'), np.full((num_sweep_values, num_quasi_static_steps), np.nan))
+    np.save(os.path.join(result_store_folder, 'm_average.npy'), np.full((num_sweep_values, num_quasi_static_steps, 3), np.nan))
+    # Number of quasi-static steps of each sweep value, 0 until the sweep value is stored
+    np.save(os.path.join(result_store_folder, 'quasi_static_steps_used.npy'), np.zeros(num_sweep_values, dtype=np.int32))
+    metadata = {
+        'B_ext': [[float(component) for component in B_ext] for B_ext in simulation_settings['B_ext_uniform']],
+        'Nx': simulation_settings['Nx'],
+        'Ny': simulation_settings['Ny'],
+        'num_quasi_static_steps': num_quasi_static_steps,
+        'field_output_interval': field_output_interval,
+    }
+    with open(os.path.join(result_store_folder, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+
+""" WRITE m OR J FIELD OF ONE QUASI-STATIC STEP OF B_ext SWEEP VALUE FROM ITS OVF FILE INTO RESULT STORE """
+def store_sweep_value_field(simulation_settings, scripts_folders, num_sweep_value, name, i_step, filename):
+    result_store_folder = get_result_store_folder(scripts_folders)
+    i_field = get_field_slot(i_step, get_field_output_interval(simulation_settings))
+    field_store = np.load(os.path.join(result_store_folder, f'{name}.npy'), mmap_mode='r+')
+    # Binary field data is copied from the memory-mapped file straight into the store, without reading it into memory first
+    field_store[num_sweep_value, i_field] = extract_data(filename, simulation_settings, mmap=True)
+    field_store.flush()
+    field_steps_store = np.load(os.path.join(result_store_folder, 'field_steps.npy'), mmap_mode='r+')
+    field_steps_store[num_sweep_value, i_field] = i_step
+    field_steps_store.flush()
+
+
+""" WRITE RESULTS OF B_ext SWEEP VALUE FROM ITS OUTPUT FOLDERS AND TABLE OF PER-STEP SCALARS INTO RESULT STORE; WITH
+store_fields FALSE, ITS FIELDS ARE ALREADY STORED AS THEIR FILES COMPLETED """
+@traced('store_results_in_result_store')
+def store_sweep_value_results(simulation_settings, scripts_folders, num_sweep_value, output_folders, table_filename, store_fields=True):
+    result_store_folder = get_result_store_folder(scripts_folders)
+    # Sweep values computed in parallel write to their own rows, so the store files are opened per sweep value
+    table = read_mumax_table(table_filename)
+    i_steps = table['step_index'].astype(int)
+    I_total_store = np.load(os.path.join(result_store_folder, 'I_total.npy'), mmap_mode='r+')
+    R_MTJ_store = np.load(os.path.join(result_store_folder, 'R_MTJ.npy'), mmap_mode='r+')
+    m_average_store = np.load(os.path.join(result_store_folder, 'm_average.npy'), mmap_mode='r+')
+    I_total_store[num_sweep_value, i_steps] = table['I_total']
+    R_MTJ_store[num_sweep_value, i_steps] = table['R_MTJ']
+    m_average_store[num_sweep_value, i_steps] = np.stack([table['mx'], table['my'], table['mz']], axis=-1)
+    for store in (I_total_store, R_MTJ_store, m_average_store):
+        store.flush()
+    # Field files are numbered by their quasi-static step
+    if store_fields:
+        filename_prefixes = [simulation_settings['m_quasi_static_final_name'][1:-1], simulation_settings['j_tunnel_quasi_static_final_name'][1:-1]]
+        for name, filename_prefix, output_folder in zip(('m', 'J'), filename_prefixes, output_folders):
+            for filename in glob.glob(f'{output_folder}/{filename_prefix}*'):
+                i_step = int(os.path.basename(filename)[len(filename_prefix):].split('.')[0])
+                store_sweep_value_field(simulation_settings, scripts_folders, num_sweep_value, name, i_step, filename)
+    # The step count is written last and marks the sweep value as stored
+    quasi_static_steps_used = np.load(os.path.join(result_store_folder, 'quasi_static_steps_used.npy'), mmap_mode='r+')
+    quasi_static_steps_used[num_sweep_value] = len(i_steps)
+    quasi_static_steps_used.flush()
+
+
+""" OPEN RESULT STORE FOR READING; FIELD AND PER-STEP DATA ARE MEMORY-MAPPED AND ONLY READ WHEN ACCESSED """
+def load_result_store(scripts_folders):
+    result_store_folder = get_result_store_folder(scripts_folders)
+    with open(os.path.join(result_store_folder, 'metadata.json'), 'r') as f:
+        result_store = json.load(f)
+    result_store['B_ext'] = np.array(result_store['B_ext'])
+    for name in ('m', 'J', 'field_steps', 'I_total', 'R_MTJ', 'm_average', 'quasi_static_steps_used'):
+        result_store[name] = np.load(os.path.join(result_store_folder, f'{name}.npy'), mmap_mode='r')
+    return result_store
@@ -0,0 +1,166 @@
+import os
+import csv
+import json
+import time
+import inspect
+import datetime
+import threading
+import functools
+
+
+# Run trace spans are recorded into, None when no run is traced
+ACTIVE_RUN_TRACE = None
+ACTIVE_RUN_TRACE_LOCK = threading.Lock()
+
+# Columns of each span in the run trace files
+RUN_TRACE_COLUMNS = ('stage', 'thread', 'start_s', 'duration_s', 'bytes_read', 'bytes_written', 'details')
+
+
+""" START TRACING RUN, UNLESS A RUN TRACE IS ALREADY ACTIVE; RETURNS THE NEW RUN TRACE, OR None WHEN AN OUTER ONE IS RECORDING """
+def start_run_trace():
+    global ACTIVE_RUN_TRACE
+    with ACTIVE_RUN_TRACE_LOCK:
+        if ACTIVE_RUN_TRACE is not None:
+            return None
+        ACTIVE_RUN_TRACE = {
+            'start_time': datetime.datetime.now().isoformat(timespec='microseconds'),
+            'start': time.perf_counter(),
+            'spans': [],
+        }
+        return ACTIVE_RUN_TRACE
+
+
+""" RECORD SPAN OF STAGE STARTED AT start (time.perf_counter() VALUE) AND ENDING NOW INTO ACTIVE RUN TRACE """
+def record_span(stage, start, bytes_read=0, bytes_written=0, details=None):
+    run_trace = ACTIVE_RUN_TRACE
+    if run_trace is None:
+        return
+    # Spans are kept as tuples, since runs with many sweep values and steps record many of them
+    run_trace['spans'].append((
+        stage,
+        threading.current_thread().name,
+        start - run_trace['start'],
+        time.perf_counter() - start,
+        bytes_read,
+        bytes_written,
+        details
+    ))
+
+
+""" DECORATE FUNCTION SO THAT EACH CALL IS RECORDED AS A SPAN OF stage; FILES NAMED BY THE ARGUMENTS read_filename_argument AND
+written_filename_argument COUNT AS BYTES READ AND WRITTEN. GENERATORS RECORD ONE SPAN PER YIELDED ITEM """
+def traced(stage, read_filename_argument=None, written_filename_argument=None):
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        def get_file_size(argument, args, kwargs):
+            if argument is None or ACTIVE_RUN_TRACE is None:
+                return 0
+            filename = signature.bind(*args, **kwargs).arguments[argument]
+            return os.path.getsize(filename) if os.path.exists(filename) else 0
+
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def traced_generator(*args, **kwargs):
+                generator = function(*args, **kwargs)
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        record_span(stage, start)
+                        return
+                    record_span(stage, start)
+                    yield item
+            return traced_generator
+
+        @functools.wraps(function)
+        def traced_function(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            record_span(stage, start, get_file_size(read_filename_argument, args, kwargs), get_file_size(written_filename_argument, args, kwargs))
+            return result
+        return traced_function
+    return decorator
+
+
+""" SUM UP SPANS OF RUN TRACE BY STAGE, IN ORDER OF TOTAL TIME """
+def get_run_trace_summary(run_trace, wall_time):
+    summary = {}
+    for stage, _, _, duration, bytes_read, bytes_written, _ in run_trace['spans']:
+        stage_summary = summary.setdefault(stage, {'stage': stage, 'calls': 0, 'total_s': 0.0, 'bytes_read': 0, 'bytes_written': 0})
+        stage_summary['calls'] += 1
+        stage_summary['total_s'] += duration
+        stage_summary['bytes_read'] += bytes_read
+        stage_summary['bytes_written'] += bytes_written
+    for stage_summary in summary.values():
+        stage_summary['mean_ms'] = 1e3 * stage_summary['total_s'] / stage_summary['calls']
+        stage_summary['fraction_of_wall_time'] = stage_summary['total_s'] / wall_time if wall_time > 0 else 0.0
+    return sorted(summary.values(), key=lambda stage_summary: -stage_summary['total_s'])
+
+
+""" FORMAT RUN TRACE SUMMARY AS TABLE; STAGES CALLED FROM PARALLEL JOBS OR INSIDE OTHER STAGES CAN ADD UP TO MORE THAN THE WALL TIME """
+def format_run_trace_summary(summary, wall_time):
+    lines = [
+        f'{"stage":<28}{"calls":>8}{"total s":>11}{"mean ms":>11}{"% wall":>8}{"MB read":>10}{"MB written":>12}',
+    ]
+    for stage_summary in summary:
+        lines.append(
+            f'{stage_summary["stage"]:<28}{stage_summary["calls"]:>8}{stage_summary["total_s"]:>11.3f}{stage_summary["mean_ms"]:>11.3f}'
+            f'{100 * stage_summary["fraction_of_wall_time"]:>8.1f}{stage_summary["bytes_read"] / 1e6:>10.2f}{stage_summary["bytes_written"] / 1e6:>12.2f}'
+        )
+    lines.append(f'wall time: {wall_time:.3f} s')
+    return '\n'.join(lines)
+
+
+""" STOP TRACING RUN, SAVING ITS SPANS AND SUMMARY AS JSON AND CSV FILES INTO run_trace_folder AND PRINTING THE SUMMARY """
+def finish_run_trace(run_trace, run_trace_folder=None):
+    global ACTIVE_RUN_TRACE
+    if run_trace is None:
+        return
+    with ACTIVE_RUN_TRACE_LOCK:
+        ACTIVE_RUN_TRACE = None
+    wall_time = time.perf_counter() - run_trace['start']
+    summary = get_run_trace_summary(run_trace, wall_time)
+    print(format_run_trace_summary(summary, wall_time))
+    if run_trace_folder is None:
+        return
+    os.makedirs(run_trace_folder, exist_ok=True)
+    run_trace_filename = os.path.join(run_trace_folder, f'run_trace_{run_trace["start_time"].replace(":", "-")}')
+    with open(f'{run_trace_filename}.json', 'w') as f:
+        json.dump({
+            'start_time': run_trace['start_time'],
+            'wall_time_s': wall_time,
+            'summary': summary,
+            'spans': [dict(zip(RUN_TRACE_COLUMNS, span)) for span in run_trace['spans']],
+        }, f, indent=4, default=str)
+    with open(f'{run_trace_filename}.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(RUN_TRACE_COLUMNS)
+        for span in run_trace['spans']:
+            writer.writerow(span[:-1] + (json.dumps(span[-1]) if span[-1] is not None else '',))
+
+
+""" FORMAT PROGRESS LINE OF B_ext SWEEP WITH ESTIMATED REMAINING TIME FROM THE SWEEP VALUES COMPUTED BY THIS RUN SO FAR """
+def format_progress_line(num_computed, num_total, num_restored, elapsed_time):
+    progress_line = f'COMPUTED:   B_ext sweep {num_computed} / {num_total}'
+    # Sweep values restored from the result cache are counted as computed, but marked as such
+    if num_restored > 0:
+        progress_line += f' ({num_restored} cached)'
+    progress_line += f'   elapsed {format_duration(elapsed_time)}'
+    if num_computed > num_restored:
+        remaining_time = elapsed_time / (num_computed - num_restored) * (num_total - num_computed)
+        progress_line += f'   ETA {format_duration(remaining_time)}'
+    return progress_line
+
+
+""" FORMAT DURATION IN SECONDS AS H:MM:SS """
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+
+""" OVERWRITE CURRENT TERMINAL LINE WITH PROGRESS LINE """
+def print_progress_line(progress_line, final=False):
+    print(f'\r{progress_line}\033[K', end='\n' if final else '', flush=True)
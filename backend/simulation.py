@@ -2,111 +2,706 @@ import os
 import shutil
 import subprocess
 import glob
+import queue
+import json
+import time
+import threading
+import numpy as np
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, CancelledError, wait, FIRST_EXCEPTION
 
-from .mumax_template_editing import generate_ovf_headers_footers, paste_settings_to_script_template
-from .ovf_data_formatting import extract_data, convert_to_ovf
+from .mumax_template_editing import generate_ovf_headers_footers, validate_ovf_headers_footers, paste_settings_to_script_template
+from .ovf_data_formatting import extract_data, convert_to_ovf, is_ovf_file_complete
+from .field_data import uniform_field, tunnel_current_density, total_tunnel_current, average_vector
+from .oersted_field import compute_oersted_field
+from .mumax_table import read_mumax_table, read_mumax_table_rows, read_written_mumax_table_rows, get_mumax_table_columns, append_mumax_table_rows
+from .result_store import get_field_output_interval, create_result_store, store_sweep_value_field, store_sweep_value_results
+from .result_cache import get_run_cache_key, get_sweep_value_cache_key, get_field_data_key, restore_cached_results, store_results, garbage_collect_result_cache
+from .run_trace import traced, record_span, start_run_trace, finish_run_trace, format_progress_line, print_progress_line
+
+
+# Simulation settings used when simulation_settings does not define them
+DEFAULT_SIMULATION_SETTINGS = {
+    'oersted_field_from_python': False,
+    'sweep_continuation': None,
+    'j_tunnel_convergence_tolerance': None,
+    'm_convergence_tolerance': None,
+    'output_level': 'full',
+    'field_output_interval': None,
+    'm_free_start_files': None,
+}
+
+# Output of each mumax run, saved in its job folder; the last lines are reported when the run fails
+MUMAX_LOG_FILENAME = 'mumax3_output.txt'
+MUMAX_LOG_TAIL_LINES = 20
+
+# Seconds between refreshes of the progress line
+PROGRESS_INTERVAL = 1.0
+
+# Per-step scalars of each B_ext sweep value, saved next to its magnetization files
+QUASI_STATIC_STEPS_TABLE_FILENAME = 'quasi_static_steps_table.txt'
+
+# Execution options used when run_options does not override them
+DEFAULT_RUN_OPTIONS = {
+    'num_parallel_jobs': 1,
+    'gpu_ids': None,
+    'mumax3_executable': 'mumax3',
+    'sweep_batch_size': 1,
+    'validate_ovf_headers': False,
+    'result_cache_max_age_days': None,
+    'result_cache_max_size_gb': None,
+    'output_harvest_interval': 0.2,
+}
 
 
 """ CREATE STARTING FREE LAYER MAGNETIZATION DATA """
 def get_m_free_start_data(m_free_start_filename, simulation_settings, num_iter):
-    Nx = simulation_settings['Nx']
-    Ny = simulation_settings['Ny']
-    m_free_start_data = [[None for _ in range(Ny)] for _ in range(Nx)]
     # During the first iteration, the free layer magnetization is set to be uniform
     if num_iter == 0:
-        for j in range(Ny):
-            for i in range(Nx):
-                m_free_start_data[i][j] = simulation_settings['m_free_start_uniform']
+        m_free_start_data = uniform_field(simulation_settings['m_free_start_uniform'], simulation_settings)
     # During subsequent iterations, the free layer magnetization is set equal to the previous iteration result
     else:
         m_free_start_data = extract_data(m_free_start_filename, simulation_settings)
     return m_free_start_data
 
 
+""" CREATE STARTING FREE LAYER MAGNETIZATION DATA OF B_ext SWEEP VALUE THAT DOES NOT CONTINUE FROM ANOTHER ONE """
+def get_sweep_value_m_free_start_data(simulation_settings, num_sweep_value):
+    # Starting magnetization files given per sweep value (e.g. results on a coarser grid) replace the uniform state
+    if simulation_settings['m_free_start_files'] is not None:
+        return extract_data(simulation_settings['m_free_start_files'][num_sweep_value], simulation_settings)
+    return get_m_free_start_data(None, simulation_settings, 0)
+
+
+""" GET B_ext VALUES IN THE ORDER THEY ARE SIMULATED """
+def get_B_ext_sweep_values(simulation_settings):
+    # B_ext_uniform is the up branch of the sweep; hysteresis modes follow it down, or up and back down
+    B_ext_uniform = list(simulation_settings['B_ext_uniform'])
+    sweep_continuation = simulation_settings.get('sweep_continuation')
+    if sweep_continuation in (None, 'up'):
+        return B_ext_uniform
+    if sweep_continuation == 'down':
+        return B_ext_uniform[::-1]
+    if sweep_continuation == 'up_down':
+        return B_ext_uniform + B_ext_uniform[-2::-1]
+    raise ValueError(f'unknown sweep_continuation "{sweep_continuation}", expected None, "up", "down" or "up_down"')
+
+
+""" GET FINAL MAGNETIZATION FILE OF B_ext SWEEP VALUE """
+def get_m_final_filename(simulation_settings, scripts_folders, num_sweep_value):
+    m_dynamics_B_ext_sweep_folder, _ = get_sweep_value_output_folders(scripts_folders, num_sweep_value)
+    m_final_filename_prefix = simulation_settings['m_quasi_static_final_name'][1:-1]
+    return sorted(glob.glob(f'{m_dynamics_B_ext_sweep_folder}/{m_final_filename_prefix}*'))[-1]
+
+
 """ GET EXTERNAL MAGNETIC FIELD DISTRIBUTION """
 def get_B_ext_data(simulation_settings, num_sweep_value):
-    Nx = simulation_settings['Nx']
-    Ny = simulation_settings['Ny']
     B_ext_uniform = simulation_settings['B_ext_uniform'][num_sweep_value]
-    B_ext_data = [[None for _ in range(Ny)] for _ in range(Nx)]
-    for j in range(Ny):
-        for i in range(Nx):
-            B_ext_data[i][j] = [B_ext_uniform[0], B_ext_uniform[1], B_ext_uniform[2]]
-    return B_ext_data
+    return uniform_field(B_ext_uniform, simulation_settings)
 
 """ REMOVE PREVIOUS RESULTS AND TEMPORARY FILES FROM PROJECT FOLDERS """
 def preclean_folders(scripts_folders):
     # Clearing previous simulation dynamics data
-    shutil.rmtree(scripts_folders['M_DYNAMICS_DATA_FOLDER'])
+    shutil.rmtree(scripts_folders['M_DYNAMICS_DATA_FOLDER'], ignore_errors=True)
     os.makedirs(scripts_folders['M_DYNAMICS_DATA_FOLDER'], exist_ok=True)
 
     # Clearing previous simulation tunnel current data
-    shutil.rmtree(scripts_folders['J_TUNNEL_DATA_FOLDER'])
+    shutil.rmtree(scripts_folders['J_TUNNEL_DATA_FOLDER'], ignore_errors=True)
     os.makedirs(scripts_folders['J_TUNNEL_DATA_FOLDER'], exist_ok=True)
 
+    # Clearing scratch folders left behind by interrupted runs
+    shutil.rmtree(get_scratch_folder(scripts_folders), ignore_errors=True)
 
-""" RUN QUASI-STATIC SIMULATION: LLGS COMPUTATION WITH ITERATIVELY CHANGING TUNNEL CURRENT AND OERSTED FIELD DISTRIBUTION """
-def run_simulation(simulation_settings, scripts_folders):
 
-    # Cleaning up project folders
-    preclean_folders(scripts_folders)
+""" GET ROOT FOLDER FOR PER-JOB WORKING DIRECTORIES """
+def get_scratch_folder(scripts_folders):
+    return scripts_folders.get('SCRATCH_FOLDER', 'scratch')
 
-    # Generating ovf headers and footers for given settings
-    parameters_headers_footers_data = generate_ovf_headers_footers(simulation_settings, scripts_folders['OVF_TEMPLATE_CREATION_SCRIPT'])
 
-    # Looping through each B_ext value
-    num_sweep_values_total = len(simulation_settings['B_ext_uniform'])
-    for num_sweep_value in range(num_sweep_values_total):
-    
+""" GET RESULT FOLDERS OF B_ext SWEEP VALUE """
+def get_sweep_value_output_folders(scripts_folders, num_sweep_value):
+    m_dynamics_B_ext_sweep_folder = f'{scripts_folders["M_DYNAMICS_DATA_FOLDER"]}/B_ext_sweep_{num_sweep_value}'
+    j_tunnel_B_ext_sweep_folder = f'{scripts_folders["J_TUNNEL_DATA_FOLDER"]}/B_ext_sweep_{num_sweep_value}'
+    return m_dynamics_B_ext_sweep_folder, j_tunnel_B_ext_sweep_folder
+
+
+""" GET TABLE OF PER-STEP SCALARS OF B_ext SWEEP VALUE """
+def get_quasi_static_steps_table_filename(scripts_folders, num_sweep_value):
+    m_dynamics_B_ext_sweep_folder, _ = get_sweep_value_output_folders(scripts_folders, num_sweep_value)
+    return os.path.join(m_dynamics_B_ext_sweep_folder, QUASI_STATIC_STEPS_TABLE_FILENAME)
+
+
+""" GET NUMBER OF QUASI-STATIC STEPS USED BY B_ext SWEEP VALUE """
+def get_quasi_static_steps_used(scripts_folders, num_sweep_value):
+    return len(read_mumax_table(get_quasi_static_steps_table_filename(scripts_folders, num_sweep_value))['step_index'])
+
+
+""" GET FILE SUMMARIZING B_ext VALUE AND NUMBER OF QUASI-STATIC STEPS USED OF EACH SWEEP VALUE """
+def get_sweep_summary_filename(scripts_folders):
+    return scripts_folders.get('SWEEP_SUMMARY_FILE', os.path.join(os.path.dirname(scripts_folders['M_DYNAMICS_DATA_FOLDER']), 'sweep_summary.json'))
+
+
+""" SAVE B_ext VALUE AND NUMBER OF QUASI-STATIC STEPS USED OF EACH SWEEP VALUE """
+def save_sweep_summary(simulation_settings, scripts_folders, results_folders):
+    sweep_summary = []
+    for num_sweep_value in range(len(results_folders)):
+        sweep_summary.append({
+            'B_ext': [float(component) for component in simulation_settings['B_ext_uniform'][num_sweep_value]],
+            'quasi_static_steps_used': get_quasi_static_steps_used(scripts_folders, num_sweep_value),
+        })
+    with open(get_sweep_summary_filename(scripts_folders), 'w') as f:
+        json.dump(sweep_summary, f, indent=4)
+
+
+""" GET INPUT OVF FILENAME OF iTH B_ext SWEEP VALUE WITHIN MUMAX RUN """
+def get_job_input_filename(job_folder, name, i_sweep):
+    return os.path.join(job_folder, f'{name}_{i_sweep:05d}.ovf')
+
+
+""" PREPARE INPUT OVF FILES AND MUMAX SCRIPT OF GROUP OF B_ext SWEEP VALUES IN THEIR OWN WORKING FOLDER; IN HYSTERESIS
+MODE, THE STARTING MAGNETIZATION OF A GROUP CONTINUING A PREVIOUS ONE IS ONLY WRITTEN ONCE THAT ONE HAS FINISHED """
+@traced('prepare_job_inputs')
+def prepare_sweep_values_job(simulation_settings, scripts_folders, parameters_headers_footers_data, sweep_values, job_folder):
+    os.makedirs(job_folder, exist_ok=True)
+
+    for i_sweep, num_sweep_value in enumerate(sweep_values):
         # Creating ovf file of external magnetic field
         B_ext_data = get_B_ext_data(simulation_settings, num_sweep_value)
         convert_to_ovf(
-            'B_ext_data.ovf',
+            get_job_input_filename(job_folder, 'B_ext_data', i_sweep),
             parameters_headers_footers_data['Bext'][0],
             parameters_headers_footers_data['Bext'][1],
             B_ext_data
         )
 
-        # Creating ovf file for starting magnetization distribution in free layer
-        m_free_data = get_m_free_start_data('m_free_start_data.ovf', simulation_settings, 0)
+        # Creating ovf file for starting magnetization distribution in free layer; in hysteresis mode only the
+        # first sweep value of the group needs one, continuing from the final magnetization of the previous sweep value
+        if simulation_settings['sweep_continuation'] is not None and (i_sweep > 0 or num_sweep_value > 0):
+            continue
         convert_to_ovf(
-            'm_free_start_data.ovf',
+            get_job_input_filename(job_folder, 'm_free_start_data', i_sweep),
             parameters_headers_footers_data['m'][0],
             parameters_headers_footers_data['m'][1],
-            m_free_data
+            get_sweep_value_m_free_start_data(simulation_settings, num_sweep_value)
         )
 
-        # Inserting settings into script
-        paste_settings_to_script_template(simulation_settings, scripts_folders['MTJ_SCRIPT_TEMPLATE'], scripts_folders['MTJ_SCRIPT_INSTANCE'])
+    return render_job_script(simulation_settings, scripts_folders, job_folder, len(sweep_values))
+
+
+""" IN HYSTERESIS MODE, CREATE STARTING MAGNETIZATION OF GROUP OF B_ext SWEEP VALUES FROM FINAL MAGNETIZATION OF PREVIOUS SWEEP VALUE """
+def prepare_continued_m_free_start(simulation_settings, scripts_folders, parameters_headers_footers_data, sweep_values, job_folder):
+    if simulation_settings['sweep_continuation'] is None or sweep_values[0] == 0:
+        return
+    m_final_filename = get_m_final_filename(simulation_settings, scripts_folders, sweep_values[0] - 1)
+    convert_to_ovf(
+        get_job_input_filename(job_folder, 'm_free_start_data', 0),
+        parameters_headers_footers_data['m'][0],
+        parameters_headers_footers_data['m'][1],
+        get_m_free_start_data(m_final_filename, simulation_settings, sweep_values[0])
+    )
+
+
+""" INSERT SETTINGS INTO MUMAX SCRIPT OF JOB COMPUTING num_sweep_values B_ext SWEEP VALUES """
+def render_job_script(simulation_settings, scripts_folders, job_folder, num_sweep_values):
+    script_settings = {
+        **simulation_settings,
+        'num_sweep_values': num_sweep_values,
+        'continue_from_previous_sweep_value': simulation_settings['sweep_continuation'] is not None,
+        'j_tunnel_convergence_tolerance': simulation_settings['j_tunnel_convergence_tolerance'] or 0,
+        'm_convergence_tolerance': simulation_settings['m_convergence_tolerance'] or 0,
+        'field_output_interval': get_field_output_interval(simulation_settings),
+    }
+    # With the Oersted field from Python, each mumax run computes a single quasi-static step and Python checks convergence
+    if simulation_settings['oersted_field_from_python']:
+        script_settings['num_quasi_static_steps'] = 1
+        script_settings['j_tunnel_convergence_tolerance'] = 0
+        script_settings['m_convergence_tolerance'] = 0
+    script_filename = os.path.basename(scripts_folders['MTJ_SCRIPT_INSTANCE'])
+    paste_settings_to_script_template(script_settings, scripts_folders['MTJ_SCRIPT_TEMPLATE'], os.path.join(job_folder, script_filename))
+    return script_filename
+
+
+""" CHECK CONVERGENCE OF QUASI-STATIC STEP WITH THE SAME CRITERIA AS THE MUMAX TEMPLATE """
+def is_quasi_static_step_converged(simulation_settings, i_step, I_total, I_total_previous, m_average, m_average_previous):
+    j_tunnel_convergence_tolerance = simulation_settings['j_tunnel_convergence_tolerance'] or 0
+    m_convergence_tolerance = simulation_settings['m_convergence_tolerance'] or 0
+    if j_tunnel_convergence_tolerance <= 0 and m_convergence_tolerance <= 0:
+        return False
+    j_tunnel_converged = j_tunnel_convergence_tolerance <= 0 or (i_step > 0 and abs(I_total - I_total_previous) <= j_tunnel_convergence_tolerance * abs(I_total))
+    m_converged = m_convergence_tolerance <= 0 or np.linalg.norm(m_average - m_average_previous) <= m_convergence_tolerance
+    return j_tunnel_converged and m_converged
+
+
+""" START MUMAX PROCESS, REGISTERING IT WITH THE RUNNING MUMAX PROCESSES OF THE RUN SO THAT A FAILED JOB CAN STOP IT; NO NEW
+PROCESSES START ONCE THE RUN IS STOPPED """
+def start_mumax_process(command, job_folder, mumax_log, mumax_processes):
+    if mumax_processes is None:
+        return subprocess.Popen(command, cwd=job_folder, stdout=mumax_log, stderr=subprocess.STDOUT)
+    with mumax_processes['lock']:
+        if mumax_processes['stopped']:
+            raise CancelledError(f'{os.path.basename(job_folder)}: run stopped after a failed job')
+        process = subprocess.Popen(command, cwd=job_folder, stdout=mumax_log, stderr=subprocess.STDOUT)
+        mumax_processes['running'].add(process)
+    return process
+
+
+""" STOP RUN: KILL ALL RUNNING MUMAX PROCESSES AND KEEP NEW ONES FROM STARTING, SO THAT THE OTHER JOBS FAIL RIGHT AWAY """
+def stop_mumax_processes(mumax_processes):
+    with mumax_processes['lock']:
+        mumax_processes['stopped'] = True
+        for process in mumax_processes['running']:
+            process.kill()
+
+
+""" RUN MUMAX SCRIPT INSIDE JOB FOLDER, SO THAT RELATIVE INPUT FILENAMES RESOLVE TO THIS JOB'S FILES; while_running IS
+CALLED EVERY output_harvest_interval SECONDS UNTIL MUMAX EXITS, OVERLAPPING PYTHON WORK WITH THE SIMULATION """
+def run_mumax_script(run_options, script_filename, job_folder, gpu_ids_queue, while_running=None, mumax_processes=None):
+    gpu_id = gpu_ids_queue.get() if gpu_ids_queue is not None else None
+    try:
+        command = [run_options['mumax3_executable']]
+        if gpu_id is not None:
+            command += ['-gpu', str(gpu_id)]
+        command += [script_filename]
+        # mumax output is kept in the job folder, so that failed runs can report it
+        mumax_log_filename = os.path.join(job_folder, MUMAX_LOG_FILENAME)
+        start = time.perf_counter()
+        with open(mumax_log_filename, 'w') as mumax_log:
+            process = start_mumax_process(command, job_folder, mumax_log, mumax_processes)
+        try:
+            while True:
+                if while_running is not None:
+                    while_running()
+                try:
+                    process.wait(timeout=run_options['output_harvest_interval'])
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            if mumax_processes is not None:
+                with mumax_processes['lock']:
+                    mumax_processes['running'].discard(process)
+        if process.returncode != 0:
+            with open(mumax_log_filename, 'r', errors='replace') as f:
+                mumax_log_tail = ''.join(f.readlines()[-MUMAX_LOG_TAIL_LINES:])
+            raise subprocess.CalledProcessError(process.returncode, command, output=mumax_log_tail)
+        mumax_run_details = {'job': os.path.basename(job_folder), 'gpu_id': gpu_id}
+        mumax_run_details.update(get_simulated_time_rate(script_filename, job_folder, time.perf_counter() - start))
+        record_span('mumax3', start, details=mumax_run_details)
+    finally:
+        if gpu_ids_queue is not None:
+            gpu_ids_queue.put(gpu_id)
+
+
+""" GET SIMULATED TIME OF FINISHED MUMAX RUN FROM THE TIME COLUMN OF ITS TABLE, AND SIMULATED TIME PER SECOND OF WALL TIME """
+def get_simulated_time_rate(script_filename, job_folder, wall_time):
+    table_filename = os.path.join(get_mumax_script_output_folder(script_filename, job_folder), 'table.txt')
+    if not os.path.exists(table_filename):
+        return {}
+    t = read_mumax_table(table_filename)['t']
+    simulated_time = float(t[-1]) if len(t) > 0 else 0.0
+    return {'simulated_time_s': simulated_time, 'simulated_time_rate': simulated_time / wall_time if wall_time > 0 else None}
 
-        # Running MTJ script
-        subprocess.run(
-            ['mumax3', scripts_folders['MTJ_SCRIPT_INSTANCE']],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
+
+""" GET OUTPUT FOLDER OF MUMAX SCRIPT INSIDE JOB FOLDER """
+def get_mumax_script_output_folder(script_filename, job_folder):
+    return os.path.join(job_folder, f'{os.path.splitext(script_filename)[0]}.out')
+
+
+""" MOVE COMPLETELY WRITTEN m AND J FILES OF MUMAX SCRIPT INTO B_ext_sweep_<n> OUTPUT FOLDERS, SHIFTING QUASI-STATIC STEP
+NUMBERS BY step_offset; WITH store_fields, EACH FILE IS ALSO WRITTEN INTO THE RESULT STORE AS SOON AS IT IS MOVED """
+@traced('harvest_outputs')
+def harvest_sweep_values_outputs(simulation_settings, scripts_folders, script_filename, sweep_values, job_folder, step_offset=0, store_fields=False):
+    mumax_script_output_folder = get_mumax_script_output_folder(script_filename, job_folder)
+    filename_prefixes = [simulation_settings['m_quasi_static_final_name'][1:-1], simulation_settings['j_tunnel_quasi_static_final_name'][1:-1]]
+    for i_sweep, num_sweep_value in enumerate(sweep_values):
+        # Each B_ext sweep value's outputs carry the prefix set by the script
+        output_prefix = f'B_ext_sweep_{i_sweep:05d}_'
+        output_folders = get_sweep_value_output_folders(scripts_folders, num_sweep_value)
+        for name, filename_prefix, output_folder in zip(('m', 'J'), filename_prefixes, output_folders):
+            for file in glob.glob(f'{mumax_script_output_folder}/{output_prefix}{filename_prefix}*'):
+                # Files mumax is still writing are left for a later harvest
+                if not is_ovf_file_complete(file):
+                    continue
+                i_step = int(os.path.basename(file)[len(output_prefix) + len(filename_prefix):].split('.')[0]) + step_offset
+                output_filename = os.path.join(output_folder, f'{filename_prefix}{i_step:05d}.ovf')
+                os.makedirs(output_folder, exist_ok=True)
+                try:
+                    shutil.move(file, output_filename)
+                except PermissionError:
+                    # Files still held open by mumax cannot be moved on Windows
+                    continue
+                if store_fields:
+                    store_sweep_value_field(simulation_settings, scripts_folders, num_sweep_value, name, i_step, output_filename)
+
+
+""" APPEND ROWS OF iTH B_ext SWEEP VALUE OF MUMAX SCRIPT TABLE TO THE TABLE OF PER-STEP SCALARS OF THE SWEEP VALUE """
+def append_sweep_value_table_rows(scripts_folders, num_sweep_value, i_sweep, table_header, table_rows):
+    # Per-step scalars of all sweep values of the script share one table, told apart by their sweep index
+    table_columns = get_mumax_table_columns(table_header)
+    sweep_value_table_rows = table_rows[table_rows[:, table_columns.index('sweep_index')] == i_sweep]
+    sweep_value_table_rows[:, table_columns.index('sweep_index')] = num_sweep_value
+    os.makedirs(get_sweep_value_output_folders(scripts_folders, num_sweep_value)[0], exist_ok=True)
+    append_mumax_table_rows(get_quasi_static_steps_table_filename(scripts_folders, num_sweep_value), table_header, sweep_value_table_rows)
+
+
+""" SPLIT RESULTS OF MUMAX SCRIPT INTO B_ext_sweep_<n> OUTPUT FOLDERS, SHIFTING QUASI-STATIC STEP NUMBERS BY step_offset;
+SWEEP VALUES ALREADY FINISHED WHILE MUMAX WAS RUNNING HAVE THEIR TABLE ROWS ALREADY """
+@traced('collect_results')
+def collect_sweep_values_results(simulation_settings, scripts_folders, script_filename, sweep_values, job_folder, step_offset=0, store_fields=False, finished_sweep_values=()):
+    mumax_script_output_folder = get_mumax_script_output_folder(script_filename, job_folder)
+    table_header, table_rows = read_mumax_table_rows(os.path.join(mumax_script_output_folder, 'table.txt'))
+    table_rows[:, get_mumax_table_columns(table_header).index('step_index')] += step_offset
+    results_folders = []
+    for i_sweep, num_sweep_value in enumerate(sweep_values):
+        results_folders.append(get_sweep_value_output_folders(scripts_folders, num_sweep_value))
+        if num_sweep_value not in finished_sweep_values:
+            append_sweep_value_table_rows(scripts_folders, num_sweep_value, i_sweep, table_header, table_rows)
+    # Moving the files not yet harvested while mumax was running
+    harvest_sweep_values_outputs(simulation_settings, scripts_folders, script_filename, sweep_values, job_folder, step_offset, store_fields)
+    shutil.rmtree(mumax_script_output_folder)
+    return results_folders
+
+
+""" RUN QUASI-STATIC STEPS OF GROUP OF B_ext SWEEP VALUES ONE MUMAX RUN PER STEP, WITH TUNNEL CURRENT AND OERSTED FIELD FROM PYTHON """
+def run_python_oersted_steps(simulation_settings, scripts_folders, run_options, parameters_headers_footers_data, sweep_values, job_folder, gpu_ids_queue, while_running=None, finish_sweep_value=None, mumax_processes=None):
+    m_final_filename_prefix = simulation_settings['m_quasi_static_final_name'][1:-1]
+    B_ext_data = {}
+    m_data = {}
+    I_total_previous = {}
+    for i_sweep, num_sweep_value in enumerate(sweep_values):
+        B_ext_data[num_sweep_value] = get_B_ext_data(simulation_settings, num_sweep_value)
+        m_data[num_sweep_value] = extract_data(get_job_input_filename(job_folder, 'm_free_start_data', i_sweep), simulation_settings)
+    # Sweep values drop out of the mumax runs once they have converged
+    active_sweep_values = list(sweep_values)
+    for i_step in range(simulation_settings['num_quasi_static_steps']):
+        I_total = {}
+        for i_sweep, num_sweep_value in enumerate(active_sweep_values):
+            # Tunnel current and its Oersted field for the magnetization at the start of the step
+            j_data = tunnel_current_density(m_data[num_sweep_value], simulation_settings)
+            I_total[num_sweep_value] = total_tunnel_current(j_data, simulation_settings)
+            B_oe_data = compute_oersted_field(j_data, simulation_settings)
+            convert_to_ovf(
+                get_job_input_filename(job_folder, 'm_free_start_data', i_sweep),
+                parameters_headers_footers_data['m'][0],
+                parameters_headers_footers_data['m'][1],
+                m_data[num_sweep_value]
+            )
+            convert_to_ovf(
+                get_job_input_filename(job_folder, 'J_tunnel_data', i_sweep),
+                parameters_headers_footers_data['J'][0],
+                parameters_headers_footers_data['J'][1],
+                j_data
+            )
+            convert_to_ovf(
+                get_job_input_filename(job_folder, 'B_ext_data', i_sweep),
+                parameters_headers_footers_data['Bext'][0],
+                parameters_headers_footers_data['Bext'][1],
+                B_ext_data[num_sweep_value] + B_oe_data
+            )
+        # Running a single quasi-static step of every active B_ext sweep value and continuing from their final magnetization
+        script_filename = render_job_script(simulation_settings, scripts_folders, job_folder, len(active_sweep_values))
+        harvest_outputs = partial(harvest_sweep_values_outputs, simulation_settings, scripts_folders, script_filename, active_sweep_values, job_folder, i_step)
+        run_mumax_script(run_options, script_filename, job_folder, gpu_ids_queue, partial(call_all, [harvest_outputs, while_running]), mumax_processes)
+        results_folders = collect_sweep_values_results(simulation_settings, scripts_folders, script_filename, active_sweep_values, job_folder, i_step)
+        unconverged_sweep_values = []
+        for num_sweep_value, (m_dynamics_B_ext_sweep_folder, _) in zip(active_sweep_values, results_folders):
+            m_average_previous = average_vector(m_data[num_sweep_value])
+            m_data[num_sweep_value] = extract_data(os.path.join(m_dynamics_B_ext_sweep_folder, f'{m_final_filename_prefix}{i_step:05d}.ovf'), simulation_settings)
+            if not is_quasi_static_step_converged(
+                simulation_settings,
+                i_step,
+                I_total[num_sweep_value],
+                I_total_previous.get(num_sweep_value, 0.0),
+                average_vector(m_data[num_sweep_value]),
+                m_average_previous
+            ):
+                unconverged_sweep_values.append(num_sweep_value)
+            I_total_previous[num_sweep_value] = I_total[num_sweep_value]
+        # Converged sweep values are finished right away, the others once they have run every step
+        is_final_step = i_step == simulation_settings['num_quasi_static_steps'] - 1
+        for num_sweep_value in active_sweep_values:
+            if is_final_step or num_sweep_value not in unconverged_sweep_values:
+                # Every step's fields were needed to continue from; those not due for output are only removed now that the final step is known
+                remove_unsaved_field_outputs(simulation_settings, scripts_folders, num_sweep_value)
+                if finish_sweep_value is not None:
+                    finish_sweep_value(num_sweep_value, True)
+        active_sweep_values = unconverged_sweep_values
+        if not active_sweep_values:
+            break
+    return [get_sweep_value_output_folders(scripts_folders, num_sweep_value) for num_sweep_value in sweep_values]
+
+
+""" REMOVE m AND J FILES OF B_ext SWEEP VALUE NOT DUE FOR OUTPUT, KEEPING EVERY field_output_interval STEPS AND THE FINAL STEP """
+def remove_unsaved_field_outputs(simulation_settings, scripts_folders, num_sweep_value):
+    field_output_interval = get_field_output_interval(simulation_settings)
+    if field_output_interval == 1:
+        return
+    num_steps = get_quasi_static_steps_used(scripts_folders, num_sweep_value)
+    filename_prefixes = [simulation_settings['m_quasi_static_final_name'][1:-1], simulation_settings['j_tunnel_quasi_static_final_name'][1:-1]]
+    for filename_prefix, output_folder in zip(filename_prefixes, get_sweep_value_output_folders(scripts_folders, num_sweep_value)):
+        for i_step in range(num_steps - 1):
+            if field_output_interval == 0 or i_step % field_output_interval != 0:
+                os.remove(os.path.join(output_folder, f'{filename_prefix}{i_step:05d}.ovf'))
+
+
+""" GET RESULT CACHE KEY OF EACH B_ext SWEEP VALUE FROM MUMAX TEMPLATE AND EXECUTABLE, SETTINGS, B_ext VALUE AND STARTING MAGNETIZATION """
+def get_sweep_value_cache_keys(simulation_settings, scripts_folders, run_options):
+    run_cache_key = get_run_cache_key(simulation_settings, scripts_folders, run_options['mumax3_executable'])
+    cache_keys = []
+    for num_sweep_value, B_ext_uniform in enumerate(simulation_settings['B_ext_uniform']):
+        # In hysteresis mode the starting magnetization is the result of the previous sweep value, identified by its key
+        if simulation_settings['sweep_continuation'] is not None and num_sweep_value > 0:
+            start_state_key = cache_keys[-1]
+        else:
+            start_state_key = get_field_data_key(get_sweep_value_m_free_start_data(simulation_settings, num_sweep_value))
+        cache_keys.append(get_sweep_value_cache_key(run_cache_key, B_ext_uniform, start_state_key))
+    return cache_keys
+
+
+""" COPY CACHED RESULTS TO OUTPUT FOLDERS; RETURNS B_ext SWEEP VALUES THAT STILL HAVE TO BE COMPUTED """
+@traced('restore_cached_results')
+def restore_cached_sweep_values(simulation_settings, scripts_folders, result_cache):
+    cache_folder, cache_keys = result_cache
+    sweep_values_to_compute = []
+    for num_sweep_value, cache_key in enumerate(cache_keys):
+        # In hysteresis mode, cached results are only reused up to the first sweep value that has to be computed
+        if sweep_values_to_compute and simulation_settings['sweep_continuation'] is not None:
+            sweep_values_to_compute.append(num_sweep_value)
+        elif not restore_cached_results(cache_folder, cache_key, get_sweep_value_output_folders(scripts_folders, num_sweep_value)):
+            sweep_values_to_compute.append(num_sweep_value)
+    return sweep_values_to_compute
+
+
+""" CALL EACH FUNCTION OF LIST, SKIPPING None """
+def call_all(functions):
+    for function in functions:
+        if function is not None:
+            function()
+
+
+""" GET FUTURE OF INPUTS OF iTH GROUP OF B_ext SWEEP VALUES, STARTING TO PREPARE THEM IN THE BACKGROUND IF NOT STARTED YET """
+def get_prepared_sweep_values_job(job_preparation, i_batch):
+    if i_batch >= len(job_preparation['job_arguments']):
+        return None
+    with job_preparation['lock']:
+        if i_batch not in job_preparation['futures']:
+            job_preparation['futures'][i_batch] = job_preparation['executor'].submit(prepare_sweep_values_job, *job_preparation['job_arguments'][i_batch])
+        return job_preparation['futures'][i_batch]
+
+
+""" WRITE FINISHED B_ext SWEEP VALUE INTO RESULT STORE AND RESULT CACHE, SO THAT AN INTERRUPTED RUN RESUMES AFTER IT """
+def finish_sweep_value(simulation_settings, scripts_folders, result_cache, finished_sweep_values, num_sweep_value, store_fields):
+    output_folders = get_sweep_value_output_folders(scripts_folders, num_sweep_value)
+    store_sweep_value_results(simulation_settings, scripts_folders, num_sweep_value, output_folders, get_quasi_static_steps_table_filename(scripts_folders, num_sweep_value), store_fields)
+    if result_cache is not None:
+        cache_folder, cache_keys = result_cache
+        store_results(cache_folder, cache_keys[num_sweep_value], output_folders)
+    finished_sweep_values.add(num_sweep_value)
+
+
+""" FINISH B_ext SWEEP VALUES THE RUNNING MUMAX SCRIPT HAS MOVED PAST: THE TABLE HAS ROWS OF A LATER SWEEP VALUE, AND THE m AND
+J FILES OF THE FINAL STEP IN THE TABLE ARE HARVESTED, WITH NO OTHER FILES OF THE SWEEP VALUE LEFT BEHIND """
+def finish_harvested_sweep_values(simulation_settings, scripts_folders, script_filename, sweep_values, job_folder, finished_sweep_values, finish_sweep_value):
+    mumax_script_output_folder = get_mumax_script_output_folder(script_filename, job_folder)
+    table_filename = os.path.join(mumax_script_output_folder, 'table.txt')
+    if not os.path.exists(table_filename):
+        return
+    # Only the rows mumax has flushed to the table so far are known
+    table_header, table_rows = read_written_mumax_table_rows(table_filename)
+    if len(table_rows) == 0:
+        return
+    table_columns = get_mumax_table_columns(table_header)
+    sweep_index = table_rows[:, table_columns.index('sweep_index')]
+    filename_prefixes = [simulation_settings['m_quasi_static_final_name'][1:-1], simulation_settings['j_tunnel_quasi_static_final_name'][1:-1]]
+    for i_sweep, num_sweep_value in enumerate(sweep_values[:int(sweep_index.max())]):
+        if num_sweep_value in finished_sweep_values:
+            continue
+        # mumax saves fields in the background, so the final step's files may still be missing after the next sweep value started
+        i_final_step = int(table_rows[sweep_index == i_sweep, table_columns.index('step_index')][-1])
+        final_step_filenames = [os.path.join(output_folder, f'{filename_prefix}{i_final_step:05d}.ovf') for filename_prefix, output_folder in zip(filename_prefixes, get_sweep_value_output_folders(scripts_folders, num_sweep_value))]
+        if not all(os.path.exists(filename) for filename in final_step_filenames) or glob.glob(f'{mumax_script_output_folder}/B_ext_sweep_{i_sweep:05d}_*'):
+            continue
+        append_sweep_value_table_rows(scripts_folders, num_sweep_value, i_sweep, table_header, table_rows)
+        finish_sweep_value(num_sweep_value, False)
+
+
+""" PREPARE, RUN AND COLLECT iTH GROUP OF B_ext SWEEP VALUES; OUTPUTS ARE HARVESTED, SWEEP VALUES ARE STORED AS SOON AS THEY ARE
+FINISHED AND THE INPUTS OF THE GROUP STARTING NEXT ARE PREPARED WHILE MUMAX RUNS; PARTIAL RESULTS ARE DISCARDED ON FAILURE """
+def run_sweep_values(simulation_settings, scripts_folders, run_options, parameters_headers_footers_data, job_preparation, i_batch, gpu_ids_queue, finished_sweep_values, result_cache=None):
+    _, _, _, sweep_values, job_folder = job_preparation['job_arguments'][i_batch]
+    finish = partial(finish_sweep_value, simulation_settings, scripts_folders, result_cache, finished_sweep_values)
+    try:
+        script_filename = get_prepared_sweep_values_job(job_preparation, i_batch).result()
+        prepare_continued_m_free_start(simulation_settings, scripts_folders, parameters_headers_footers_data, sweep_values, job_folder)
+        # The group starting next is the one waiting for the first of the parallel jobs to finish
+        prepare_next_job = partial(get_prepared_sweep_values_job, job_preparation, i_batch + job_preparation['num_parallel_jobs'])
+        if simulation_settings['oersted_field_from_python']:
+            results_folders = run_python_oersted_steps(simulation_settings, scripts_folders, run_options, parameters_headers_footers_data, sweep_values, job_folder, gpu_ids_queue, prepare_next_job, finish, job_preparation['mumax_processes'])
+        else:
+            # Field files are written into the result store as soon as mumax completes them, and sweep values as soon as mumax moves past them
+            harvest_outputs = partial(harvest_sweep_values_outputs, simulation_settings, scripts_folders, script_filename, sweep_values, job_folder, 0, True)
+            finish_harvested = partial(finish_harvested_sweep_values, simulation_settings, scripts_folders, script_filename, sweep_values, job_folder, finished_sweep_values, finish)
+            run_mumax_script(run_options, script_filename, job_folder, gpu_ids_queue, partial(call_all, [harvest_outputs, finish_harvested, prepare_next_job]), job_preparation['mumax_processes'])
+            results_folders = collect_sweep_values_results(simulation_settings, scripts_folders, script_filename, sweep_values, job_folder, 0, True, finished_sweep_values)
+            for num_sweep_value in sweep_values:
+                if num_sweep_value not in finished_sweep_values:
+                    finish(num_sweep_value, False)
+        return results_folders
+    except BaseException:
+        # Sweep values finished before the failure are kept, as they are in the result store and cache
+        for num_sweep_value in sweep_values:
+            if num_sweep_value in finished_sweep_values:
+                continue
+            for folder in get_sweep_value_output_folders(scripts_folders, num_sweep_value):
+                shutil.rmtree(folder, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(job_folder, ignore_errors=True)
+
+
+""" SPLIT B_ext SWEEP VALUES INTO GROUPS COMPUTED BY ONE MUMAX RUN EACH """
+def get_sweep_value_batches(sweep_values, simulation_settings, run_options):
+    batch_size = run_options['sweep_batch_size']
+    # In hysteresis mode the sweep values form a single chain: a mumax run carries the magnetization
+    # from one sweep value to the next, except with the Oersted field from Python, where Python does
+    if simulation_settings['sweep_continuation'] is not None:
+        if simulation_settings['oersted_field_from_python']:
+            batch_size = 1
+        elif batch_size is None:
+            batch_size = len(sweep_values)
+    # By default, all sweep values are shared out evenly between the parallel jobs
+    if batch_size is None:
+        batch_size = -(-len(sweep_values) // max(1, run_options['num_parallel_jobs']))
+    batch_size = max(1, batch_size)
+    return [sweep_values[i:i+batch_size] for i in range(0, len(sweep_values), batch_size)]
+
+
+""" RUN QUASI-STATIC SIMULATION: LLGS COMPUTATION WITH ITERATIVELY CHANGING TUNNEL CURRENT AND OERSTED FIELD DISTRIBUTION; THE
+STAGES OF THE RUN ARE TRACED INTO RUN_TRACE_FOLDER, UNLESS THE CALLER IS ALREADY TRACING A LARGER RUN """
+def run_simulation(simulation_settings, scripts_folders, run_options=None):
+    run_trace = start_run_trace()
+    try:
+        return run_simulation_stages(simulation_settings, scripts_folders, run_options)
+    finally:
+        finish_run_trace(run_trace, scripts_folders.get('RUN_TRACE_FOLDER'))
+
+
+""" RUN STAGES OF QUASI-STATIC SIMULATION """
+@traced('run_simulation')
+def run_simulation_stages(simulation_settings, scripts_folders, run_options=None):
+    simulation_settings = {**DEFAULT_SIMULATION_SETTINGS, **simulation_settings}
+    simulation_settings['B_ext_uniform'] = get_B_ext_sweep_values(simulation_settings)
+    run_options = {**DEFAULT_RUN_OPTIONS, **(run_options or {})}
+
+    # Cleaning up project folders
+    preclean_folders(scripts_folders)
+
+    # Generating ovf headers and footers for given settings, optionally checking them once against mumax output
+    parameters_headers_footers_data = generate_ovf_headers_footers(simulation_settings, scripts_folders.get('OVF_HEADER_CACHE_FOLDER'))
+    if run_options['validate_ovf_headers']:
+        validate_ovf_headers_footers(simulation_settings, scripts_folders['OVF_TEMPLATE_CREATION_SCRIPT'], run_options['mumax3_executable'])
+
+    # GPUs are handed out to running jobs one at a time through a queue
+    gpu_ids_queue = None
+    if run_options['gpu_ids']:
+        gpu_ids_queue = queue.Queue()
+        for gpu_id in run_options['gpu_ids']:
+            gpu_ids_queue.put(gpu_id)
+
+    # Results of all B_ext sweep values are collected in one store, filled in as sweep values finish
+    create_result_store(simulation_settings, scripts_folders)
+
+    # Reusing results of B_ext sweep values already computed with the same inputs, so that interrupted runs resume
+    num_sweep_values_total = len(simulation_settings['B_ext_uniform'])
+    sweep_values_to_compute = list(range(num_sweep_values_total))
+    result_cache = None
+    if scripts_folders.get('RESULT_CACHE_FOLDER'):
+        result_cache_max_size_gb = run_options['result_cache_max_size_gb']
+        garbage_collect_result_cache(
+            scripts_folders['RESULT_CACHE_FOLDER'],
+            run_options['result_cache_max_age_days'],
+            None if result_cache_max_size_gb is None else result_cache_max_size_gb * 1024**3
         )
+        result_cache = (scripts_folders['RESULT_CACHE_FOLDER'], get_sweep_value_cache_keys(simulation_settings, scripts_folders, run_options))
+        sweep_values_to_compute = restore_cached_sweep_values(simulation_settings, scripts_folders, result_cache)
+        for num_sweep_value in sorted(set(range(num_sweep_values_total)) - set(sweep_values_to_compute)):
+            store_sweep_value_results(simulation_settings, scripts_folders, num_sweep_value, get_sweep_value_output_folders(scripts_folders, num_sweep_value), get_quasi_static_steps_table_filename(scripts_folders, num_sweep_value))
+
+    # Each group of B_ext sweep values is computed by one mumax run in its own working folder inside the scratch folder
+    scratch_folder = get_scratch_folder(scripts_folders)
+    sweep_value_batches = get_sweep_value_batches(sweep_values_to_compute, simulation_settings, run_options)
+
+    # Running groups of B_ext sweep values in a pool of parallel jobs; in hysteresis mode each group
+    # continues from the previous one, so groups run one after another in sweep order
+    num_parallel_jobs = max(1, run_options['num_parallel_jobs'])
+    if simulation_settings['sweep_continuation'] is not None:
+        num_parallel_jobs = 1
+    # Inputs of the groups are prepared by a background thread, each while the jobs before it run
+    job_preparation = {
+        'executor': ThreadPoolExecutor(max_workers=1),
+        'futures': {},
+        'lock': threading.Lock(),
+        'num_parallel_jobs': num_parallel_jobs,
+        # mumax processes of the running jobs, killed when one of the jobs fails
+        'mumax_processes': {'lock': threading.Lock(), 'running': set(), 'stopped': False},
+        'job_arguments': [
+            (simulation_settings, scripts_folders, parameters_headers_footers_data, sweep_values, os.path.join(scratch_folder, f'B_ext_sweep_{sweep_values[0]}'))
+            for sweep_values in sweep_value_batches
+        ],
+    }
+    try:
+        # The groups started first have nothing to wait for, so their inputs are prepared right away
+        for i_batch in range(num_parallel_jobs):
+            get_prepared_sweep_values_job(job_preparation, i_batch)
+        # B_ext sweep values finished by any job, added to by the job threads and counted by the progress line
+        finished_sweep_values = set()
+        with ThreadPoolExecutor(max_workers=num_parallel_jobs) as executor:
+            futures = [
+                executor.submit(
+                    run_sweep_values,
+                    simulation_settings,
+                    scripts_folders,
+                    run_options,
+                    parameters_headers_footers_data,
+                    job_preparation,
+                    i_batch,
+                    gpu_ids_queue,
+                    finished_sweep_values,
+                    result_cache
+                )
+                for i_batch in range(len(sweep_value_batches))
+            ]
+            num_restored = num_sweep_values_total - len(sweep_values_to_compute)
+            start = time.perf_counter()
+            # Showing sweep values restored from the result cache right away, even if there is nothing left to compute
+            print_progress_line(format_progress_line(num_restored, num_sweep_values_total, num_restored, 0.0), final=not futures)
+            pending = set(futures)
+            while pending:
+                # Progress is refreshed at least every PROGRESS_INTERVAL seconds, so that elapsed time and ETA keep counting
+                done, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+                # Sweep values are counted as the jobs finish them, not only when whole groups are done
+                num_computed = num_restored + len(finished_sweep_values)
+                for future in done:
+                    if future.exception() is not None:
+                        # Stopping jobs that have not started yet and the mumax runs of those still running, so that
+                        # leaving the pool does not wait for them, then passing the error on
+                        for pending_future in pending:
+                            pending_future.cancel()
+                        stop_mumax_processes(job_preparation['mumax_processes'])
+                        print_progress_line(format_progress_line(num_computed, num_sweep_values_total, num_restored, time.perf_counter() - start), final=True)
+                        raise future.exception()
+                # Displaying progress on a single line
+                print_progress_line(format_progress_line(num_computed, num_sweep_values_total, num_restored, time.perf_counter() - start), final=not pending)
+    finally:
+        # Cleaning up, including inputs prepared for groups that never ran
+        job_preparation['executor'].shutdown(cancel_futures=True)
+        shutil.rmtree(scratch_folder, ignore_errors=True)
 
-        # Copying results to project output folder
-        mumax_script_output_folder = f'{os.path.splitext(scripts_folders["MTJ_SCRIPT_INSTANCE"])[0]}.out'
-        m_dynamics_B_ext_sweep_folder = f'{scripts_folders["M_DYNAMICS_DATA_FOLDER"]}/B_ext_sweep_{num_sweep_value}'
-        j_tunnel_B_ext_sweep_folder = f'{scripts_folders["J_TUNNEL_DATA_FOLDER"]}/B_ext_sweep_{num_sweep_value}'
-        os.makedirs(m_dynamics_B_ext_sweep_folder, exist_ok=True)
-        os.makedirs(j_tunnel_B_ext_sweep_folder, exist_ok=True)
-        file_pattern_m = f'{mumax_script_output_folder}/{simulation_settings["m_quasi_static_final_name"][1:-1]}*'
-        file_pattern_j_tunnel = f'{mumax_script_output_folder}/{simulation_settings["j_tunnel_quasi_static_final_name"][1:-1]}*'
-        matching_files_m = glob.glob(file_pattern_m)
-        matching_files_j_tunnel = glob.glob(file_pattern_j_tunnel)
-        for file in matching_files_m:
-            shutil.copy(file, m_dynamics_B_ext_sweep_folder)
-        for file in matching_files_j_tunnel:
-            shutil.copy(file, j_tunnel_B_ext_sweep_folder)
-
-        # Cleaning up
-        shutil.rmtree(mumax_script_output_folder)
-        os.remove(scripts_folders['MTJ_SCRIPT_INSTANCE'])
-        os.remove('m_free_start_data.ovf')
-        os.remove('B_ext_data.ovf')
-
-        # Displaying progress
-        os.system('cls' if os.name=='nt' else 'clear')
-        print(f'COMPUTED:   B_ext sweep {num_sweep_value+1} / {num_sweep_values_total}')
+    # Result folders of each B_ext sweep value, in sweep order
+    results_folders = [get_sweep_value_output_folders(scripts_folders, num_sweep_value) for num_sweep_value in range(num_sweep_values_total)]
+    save_sweep_summary(simulation_settings, scripts_folders, results_folders)
+    return results_folders
@@ -0,0 +1,76 @@
+""" OERSTED FIELD: PARITY OF FFT CONVOLUTION WITH DIRECT SUMMATION AND TIMING ACROSS GRID SIZES
+
+Usage: python benchmarks/oersted_field_benchmark.py
+Exits with a non-zero status if the FFT and brute-force fields disagree.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backend.oersted_field import compute_oersted_field, compute_oersted_field_brute_force, get_oersted_kernel_spectrum
+
+
+# Grid sizes compared against the brute-force reference, and grid sizes only timed
+PARITY_GRID_SIZES = [(1, 1), (2, 3), (7, 5), (16, 16), (32, 24), (64, 64)]
+TIMING_GRID_SIZES = [(16, 16), (64, 64), (128, 128), (200, 200), (500, 500)]
+# Largest grid for which the brute-force summation is timed
+MAX_BRUTE_FORCE_CELLS = 64 * 64
+PARITY_RELATIVE_TOLERANCE = 1e-10
+
+
+""" BUILD SETTINGS AND RANDOM TUNNEL CURRENT DENSITY FOR GRID SIZE """
+def get_test_case(Nx, Ny, seed=0):
+    simulation_settings = {'Nx': Nx, 'Ny': Ny, 'size_x': 1000e-9 * Nx / 200, 'size_y': 1000e-9 * Ny / 200}
+    j_data = np.zeros((Nx, Ny, 3))
+    j_data[..., 2] = np.random.default_rng(seed).uniform(1e9, 1e11, (Nx, Ny))
+    return simulation_settings, j_data
+
+
+""" TIME FUNCTION CALL, BEST OF repeats """
+def best_time(function, repeats, *args):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+""" COMPARE FFT OERSTED FIELD WITH BRUTE-FORCE REFERENCE """
+def check_parity():
+    all_passed = True
+    for Nx, Ny in PARITY_GRID_SIZES:
+        simulation_settings, j_data = get_test_case(Nx, Ny)
+        B_oe_fft = compute_oersted_field(j_data, simulation_settings)
+        B_oe_reference = compute_oersted_field_brute_force(j_data, simulation_settings)
+        scale = max(np.abs(B_oe_reference).max(), np.finfo(float).tiny)
+        relative_error = np.abs(B_oe_fft - B_oe_reference).max() / scale
+        passed = relative_error <= PARITY_RELATIVE_TOLERANCE or np.abs(B_oe_reference).max() == 0
+        all_passed = all_passed and passed
+        print(f'parity {Nx:>4} x {Ny:<4} max relative error {relative_error:.2e}  {"OK" if passed else "FAILED"}')
+    return all_passed
+
+
+""" TIME FFT AND BRUTE-FORCE OERSTED FIELD ACROSS GRID SIZES """
+def run_timing():
+    print(f'{"grid":>11} | {"kernel setup, s":>15} | {"FFT field, s":>12} | {"brute force, s":>14}')
+    for Nx, Ny in TIMING_GRID_SIZES:
+        simulation_settings, j_data = get_test_case(Nx, Ny)
+        cell_size_x = simulation_settings['size_x'] / Nx
+        cell_size_y = simulation_settings['size_y'] / Ny
+        get_oersted_kernel_spectrum.cache_clear()
+        kernel_time = best_time(get_oersted_kernel_spectrum, 1, Nx, Ny, cell_size_x, cell_size_y)
+        fft_time = best_time(compute_oersted_field, 5, j_data, simulation_settings)
+        brute_force_time = '-'
+        if Nx * Ny <= MAX_BRUTE_FORCE_CELLS:
+            brute_force_time = f'{best_time(compute_oersted_field_brute_force, 1, j_data, simulation_settings):.4f}'
+        print(f'{Nx:>4} x {Ny:<4} | {kernel_time:>15.4f} | {fft_time:>12.4f} | {brute_force_time:>14}')
+
+
+if __name__ == '__main__':
+    parity_passed = check_parity()
+    run_timing()
+    sys.exit(0 if parity_passed else 1)
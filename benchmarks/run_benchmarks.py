@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+""" BENCHMARKS OF THE PYTHON ORCHESTRATION AND POST-PROCESSING HOT PATHS
+
+Needs no GPU: OVF files are synthetic and simulations run with the stub mumax3 executable (tools/stub_mumax3/mumax3).
+Each case reports its median wall time and its peak memory traced by tracemalloc, and is compared against the stored
+baseline; cases slower or more memory hungry than the baseline beyond the tolerances fail the benchmark run.
+Usage (from the project folder):
+- python benchmarks/run_benchmarks.py: run all cases and compare them against benchmarks/baseline.json
+- python benchmarks/run_benchmarks.py --quick: only grids up to 64x64 and sweeps up to 100 points
+- python benchmarks/run_benchmarks.py --cases extract_data gather_data: only cases whose name contains one of the words
+- python benchmarks/run_benchmarks.py --update-baseline: store the results as new baseline (baselines are machine specific)
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+from functools import partial
+
+PROJECT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_FOLDER)
+from backend.ovf_data_formatting import OVF_QUANTITIES, build_ovf_header_footer, extract_data, convert_to_ovf
+from backend.field_data import normalized_average_magnetization, normalized_vector
+from backend.simulation import DEFAULT_SIMULATION_SETTINGS, run_simulation, render_job_script, get_sweep_summary_filename
+from backend.data_visualization import gather_data, gather_data_from_output_folders
+
+
+BASELINE_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+STUB_MUMAX3_EXECUTABLE = os.path.join(PROJECT_FOLDER, 'tools', 'stub_mumax3', 'mumax3')
+
+# Free layer grids (Nx = Ny) and numbers of B_ext sweep points covered by the benchmarks
+GRID_SIZES = (16, 64, 200, 500)
+SWEEP_SIZES = (1, 10, 100, 1000)
+# Grid and sweep sizes of the simulations run end to end; large grids only with few points, so that runs stay short
+SIMULATION_SIZES = ((16, 1), (16, 10), (16, 100), (16, 1000), (64, 1), (64, 100), (200, 1), (200, 10), (500, 1))
+# Largest grid and sweep of --quick runs
+QUICK_MAX_GRID_SIZE = 64
+QUICK_MAX_SWEEP_SIZE = 100
+
+# Allowed slowdown and memory growth relative to the baseline; the absolute margins keep very short cases from failing on timer noise
+DEFAULT_TOLERANCES = {
+    'time_relative': 0.5,
+    'time_absolute_s': 0.005,
+    'memory_relative': 0.2,
+    'memory_absolute_mb': 1.0,
+}
+
+# Fixed simulation settings of the benchmarks, independent of control.py
+BENCHMARK_SIMULATION_SETTINGS = {
+    **DEFAULT_SIMULATION_SETTINGS,
+    'size_x': 5e-9,
+    'size_y': 5e-9,
+    'size_z': 5e-9,
+    'Nz': 1,
+    'Msat': 1.2e6,
+    'Aex': 1e-11,
+    'alpha': 0.02,
+    'Ku1': 30 * 1.256e-6 * 1.2e6 / 2,
+    'anisU': 'vector(0, 1, 0)',
+    'lambda': 1,
+    'Pol': 0.1,
+    'epsilonprime': 0,
+    'fixedlayer': 'vector(0, -1, 0)',
+    'm_reference': 'vector(0, -1, 0)',
+    'm_free_start_uniform': [-1, 0, 0],
+    't_quasi_static_step': 5e-9,
+    'num_quasi_static_steps': 3,
+    'V_bias': 10e-3,
+    'R_p': 74.86,
+    'R_ap': 18000.0,
+    'OutputFormat': 'OVF2_BINARY',
+    'm_quasi_static_final_name': '"m_final_quasi_static_step_"',
+    'j_tunnel_quasi_static_final_name': '"j_tunnel_final_quasi_static_step_"',
+}
+
+# Execution options of the simulations run end to end
+BENCHMARK_RUN_OPTIONS = {
+    'num_parallel_jobs': 1,
+    'sweep_batch_size': None,
+    'mumax3_executable': STUB_MUMAX3_EXECUTABLE,
+}
+
+
+""" GET SIMULATION SETTINGS OF (Nx, Ny) GRID AND B_ext SWEEP OF num_points POINTS """
+def get_benchmark_settings(grid_size, num_points, **settings):
+    B_ext_y = np.linspace(-1e-3, 1e-3, num_points) if num_points > 1 else np.array([1e-3])
+    return {
+        **BENCHMARK_SIMULATION_SETTINGS,
+        'Nx': grid_size,
+        'Ny': grid_size,
+        'B_ext_uniform': [[0.0, float(B_ext), 0.0] for B_ext in B_ext_y],
+        **settings,
+    }
+
+
+""" GET PROJECT FOLDERS OF BENCHMARK SIMULATION INSIDE ITS WORK FOLDER """
+def get_benchmark_scripts_folders(work_folder):
+    return {
+        'MTJ_SCRIPT_TEMPLATE': os.path.join(PROJECT_FOLDER, 'templates', 'simulate_MTJ_template.mx3'),
+        'MTJ_SCRIPT_INSTANCE': os.path.join(work_folder, 'simulate_MTJ.mx3'),
+        'M_DYNAMICS_DATA_FOLDER': os.path.join(work_folder, 'output_data', 'm_dynamics'),
+        'J_TUNNEL_DATA_FOLDER': os.path.join(work_folder, 'output_data', 'j_tunnel_iterations'),
+        'RESULT_STORE_FOLDER': os.path.join(work_folder, 'output_data', 'result_store'),
+        'SWEEP_SUMMARY_FILE': os.path.join(work_folder, 'output_data', 'sweep_summary.json'),
+        'SCRATCH_FOLDER': os.path.join(work_folder, 'scratch'),
+    }
+
+
+""" WRITE SYNTHETIC MAGNETIZATION OVF FILE OF (Nx, Ny) GRID IN GIVEN DATA FORMAT """
+def write_synthetic_ovf(filename, grid_size, data_format):
+    settings = get_benchmark_settings(grid_size, 1)
+    header, footer = build_ovf_header_footer(
+        *OVF_QUANTITIES['m'], grid_size, grid_size, 1,
+        settings['size_x'] / grid_size, settings['size_y'] / grid_size, settings['size_z'], data_format
+    )
+    m_data = normalized_vector(np.random.default_rng(0).normal(size=(grid_size, grid_size, 3)))
+    convert_to_ovf(filename, header, footer, m_data)
+    return header, footer, m_data
+
+
+""" PREPARE CASE READING SYNTHETIC OVF FILE """
+def prepare_extract_data(work_folder, grid_size, data_format):
+    filename = os.path.join(work_folder, f'm_{grid_size}_{data_format.replace(" ", "_")}.ovf')
+    write_synthetic_ovf(filename, grid_size, data_format)
+    return partial(extract_data, filename, get_benchmark_settings(grid_size, 1))
+
+
+""" PREPARE CASE WRITING SYNTHETIC OVF FILE """
+def prepare_convert_to_ovf(work_folder, grid_size, data_format):
+    filename = os.path.join(work_folder, f'm_{grid_size}_{data_format.replace(" ", "_")}_written.ovf')
+    header, footer, m_data = write_synthetic_ovf(filename, grid_size, data_format)
+    return partial(convert_to_ovf, filename, header, footer, m_data)
+
+
+""" PREPARE CASE RENDERING MUMAX SCRIPT OF BATCHED JOB FROM TEMPLATE """
+def prepare_render_job_script(work_folder, num_points):
+    settings = get_benchmark_settings(16, num_points)
+    return partial(render_job_script, settings, get_benchmark_scripts_folders(work_folder), work_folder, num_points)
+
+
+""" PREPARE CASE AVERAGING AND NORMALIZING MAGNETIZATION OF SYNTHETIC FIELD """
+def prepare_normalized_average_magnetization(work_folder, grid_size):
+    m_data = np.random.default_rng(0).normal(size=(grid_size, grid_size, 3))
+    return partial(normalized_average_magnetization, m_data)
+
+
+""" PREPARE CASE NORMALIZING AVERAGE MAGNETIZATION TRAJECTORIES OF ALL SWEEP POINTS ONTO THE UNIT SPHERE """
+def prepare_unit_sphere_trajectories(work_folder, num_points):
+    m_average = np.random.default_rng(0).normal(size=(num_points, 20, 3))
+    return partial(map_list, normalized_vector, m_average)
+
+
+""" APPLY FUNCTION TO EACH ITEM, RETURNING LIST """
+def map_list(function, items):
+    return [function(item) for item in items]
+
+
+""" PREPARE CASE RUNNING SIMULATION END TO END WITH STUB MUMAX3 """
+def prepare_run_simulation(work_folder, grid_size, num_points, **settings):
+    # Simulations with other settings than the benchmark settings get their own folder
+    simulation_folder = os.path.join(work_folder, '_'.join([f'simulation_{grid_size}_{num_points}', *settings]))
+    return partial(
+        run_simulation,
+        get_benchmark_settings(grid_size, num_points, **settings),
+        get_benchmark_scripts_folders(simulation_folder),
+        BENCHMARK_RUN_OPTIONS
+    )
+
+
+""" PREPARE CASE GATHERING RESULTS OF SIMULATION, RUNNING IT FIRST WHEN ITS CASE WAS NOT RUN """
+def prepare_gather_data(work_folder, grid_size, num_points, source, keep_fields):
+    simulation_folder = os.path.join(work_folder, f'simulation_{grid_size}_{num_points}')
+    settings = get_benchmark_settings(grid_size, num_points)
+    scripts_folders = get_benchmark_scripts_folders(simulation_folder)
+    if not os.path.exists(get_sweep_summary_filename(scripts_folders)):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            prepare_run_simulation(work_folder, grid_size, num_points)()
+    gather = gather_data if source == 'result_store' else gather_data_from_output_folders
+    return partial(consume, gather, settings, scripts_folders, keep_fields)
+
+
+""" RUN GENERATOR FUNCTION TO THE END """
+def consume(generator_function, *args):
+    for _ in generator_function(*args):
+        pass
+
+
+""" GET BENCHMARK CASES AS (name, prepare, repeats), prepare RETURNING THE FUNCTION TO MEASURE """
+def get_benchmark_cases(work_folder, quick):
+    grid_sizes = [grid_size for grid_size in GRID_SIZES if not quick or grid_size <= QUICK_MAX_GRID_SIZE]
+    sweep_sizes = [num_points for num_points in SWEEP_SIZES if not quick or num_points <= QUICK_MAX_SWEEP_SIZE]
+    simulation_sizes = [size for size in SIMULATION_SIZES if size[0] in grid_sizes and size[1] in sweep_sizes]
+    cases = []
+    for grid_size in grid_sizes:
+        for data_format in ('Text', 'Binary 4', 'Binary 8'):
+            # Text files of large grids take seconds per file, so they are measured once
+            repeats = 1 if data_format == 'Text' and grid_size >= 200 else 5
+            cases.append((f'extract_data[{grid_size}x{grid_size}, {data_format}]', partial(prepare_extract_data, work_folder, grid_size, data_format), repeats))
+            cases.append((f'convert_to_ovf[{grid_size}x{grid_size}, {data_format}]', partial(prepare_convert_to_ovf, work_folder, grid_size, data_format), repeats))
+        cases.append((f'normalized_average_magnetization[{grid_size}x{grid_size}]', partial(prepare_normalized_average_magnetization, work_folder, grid_size), 20))
+    for num_points in sweep_sizes:
+        cases.append((f'render_job_script[{num_points} points]', partial(prepare_render_job_script, work_folder, num_points), 20))
+        cases.append((f'unit_sphere_trajectories[{num_points} points]', partial(prepare_unit_sphere_trajectories, work_folder, num_points), 5))
+    for grid_size, num_points in simulation_sizes:
+        size_name = f'{grid_size}x{grid_size}, {num_points} points'
+        cases.append((f'run_simulation[{size_name}]', partial(prepare_run_simulation, work_folder, grid_size, num_points), 1))
+        cases.append((f'gather_data[{size_name}, result store]', partial(prepare_gather_data, work_folder, grid_size, num_points, 'result_store', False), 3))
+        cases.append((f'gather_data[{size_name}, result store, fields]', partial(prepare_gather_data, work_folder, grid_size, num_points, 'result_store', True), 3))
+        cases.append((f'gather_data[{size_name}, output folders, fields]', partial(prepare_gather_data, work_folder, grid_size, num_points, 'output_folders', True), 3))
+    # Python Oersted field: one mumax run and one FFT convolution per quasi-static step
+    for grid_size in grid_sizes[:2]:
+        cases.append((
+            f'run_simulation[{grid_size}x{grid_size}, 10 points, Oersted field from Python]',
+            partial(prepare_run_simulation, work_folder, grid_size, 10, oersted_field_from_python=True, sweep_continuation='up'),
+            1
+        ))
+    return cases
+
+
+""" MEASURE PEAK TRACED MEMORY OF ONE CALL AND MEDIAN WALL TIME OF repeats FURTHER CALLS """
+def measure_case(function, repeats):
+    # Output of the measured functions (progress lines, run trace summaries) is not shown
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        tracemalloc.start()
+        try:
+            function()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return {'time_s': float(np.median(times)), 'peak_memory_mb': peak_memory / 1e6}
+
+
+""" COMPARE RESULT OF CASE WITH ITS BASELINE; RETURNS LIST OF REGRESSIONS """
+def compare_with_baseline(result, baseline_result, tolerances):
+    regressions = []
+    if baseline_result is None:
+        return regressions
+    max_time = baseline_result['time_s'] * (1 + tolerances['time_relative']) + tolerances['time_absolute_s']
+    if result['time_s'] > max_time:
+        regressions.append(f'time {result["time_s"]:.4f} s > {max_time:.4f} s')
+    max_memory = baseline_result['peak_memory_mb'] * (1 + tolerances['memory_relative']) + tolerances['memory_absolute_mb']
+    if result['peak_memory_mb'] > max_memory:
+        regressions.append(f'peak memory {result["peak_memory_mb"]:.2f} MB > {max_memory:.2f} MB')
+    return regressions
+
+
+""" RUN BENCHMARK CASES, PRINTING ONE LINE PER CASE; RETURNS RESULTS AND REGRESSIONS BY CASE NAME """
+def run_benchmarks(cases, baseline, tolerances):
+    results = {}
+    regressions = {}
+    print(f'{"case":<72}{"time s":>10}{"baseline":>10}{"peak MB":>10}{"baseline":>10}  status')
+    for name, prepare, repeats in cases:
+        result = measure_case(prepare(), repeats)
+        results[name] = result
+        baseline_result = baseline.get(name)
+        case_regressions = compare_with_baseline(result, baseline_result, tolerances)
+        if case_regressions:
+            regressions[name] = case_regressions
+        status = 'new' if baseline_result is None else ('REGRESSION: ' + '; '.join(case_regressions) if case_regressions else 'ok')
+        baseline_time = f'{baseline_result["time_s"]:>10.4f}' if baseline_result else f'{"-":>10}'
+        baseline_memory = f'{baseline_result["peak_memory_mb"]:>10.2f}' if baseline_result else f'{"-":>10}'
+        print(f'{name:<72}{result["time_s"]:>10.4f}{baseline_time}{result["peak_memory_mb"]:>10.2f}{baseline_memory}  {status}', flush=True)
+    return results, regressions
+
+
+""" READ STORED BASELINE RESULTS BY CASE NAME """
+def load_baseline(baseline_filename):
+    if not os.path.exists(baseline_filename):
+        return {}
+    with open(baseline_filename, 'r') as f:
+        return json.load(f)['results']
+
+
+""" STORE RESULTS AS BASELINE, KEEPING BASELINE RESULTS OF CASES THAT WERE NOT RUN """
+def save_baseline(baseline_filename, results):
+    baseline = {**load_baseline(baseline_filename), **results}
+    with open(baseline_filename, 'w') as f:
+        json.dump({'machine': get_machine_description(), 'results': baseline}, f, indent=4, sort_keys=True)
+
+
+""" DESCRIBE MACHINE AND VERSIONS THE BENCHMARKS RAN WITH """
+def get_machine_description():
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'python': platform.python_version(), 'numpy': np.__version__}
+
+
+""" PARSE COMMAND LINE ARGUMENTS """
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(description='Benchmarks of the Python orchestration and post-processing hot paths')
+    parser.add_argument('--quick', action='store_true', help=f'only grids up to {QUICK_MAX_GRID_SIZE}x{QUICK_MAX_GRID_SIZE} and sweeps up to {QUICK_MAX_SWEEP_SIZE} points')
+    parser.add_argument('--cases', nargs='+', default=None, help='only cases whose name contains one of these words')
+    parser.add_argument('--baseline', default=BASELINE_FILENAME, help='baseline results file')
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as baseline instead of failing on regressions')
+    parser.add_argument('--output', default=None, help='JSON file to save the results to')
+    parser.add_argument('--time-tolerance', type=float, default=DEFAULT_TOLERANCES['time_relative'], help='allowed relative slowdown')
+    parser.add_argument('--memory-tolerance', type=float, default=DEFAULT_TOLERANCES['memory_relative'], help='allowed relative peak memory growth')
+    return parser.parse_args(arguments)
+
+
+""" RUN BENCHMARKS IN A TEMPORARY WORK FOLDER; RETURNS EXIT CODE, 1 WHEN ANY CASE REGRESSED """
+def main(arguments):
+    arguments = parse_arguments(arguments)
+    tolerances = {**DEFAULT_TOLERANCES, 'time_relative': arguments.time_tolerance, 'memory_relative': arguments.memory_tolerance}
+    baseline = load_baseline(arguments.baseline)
+    work_folder = tempfile.mkdtemp(prefix='mtj_benchmarks_')
+    try:
+        cases = get_benchmark_cases(work_folder, arguments.quick)
+        if arguments.cases:
+            cases = [case for case in cases if any(word in case[0] for word in arguments.cases)]
+        results, regressions = run_benchmarks(cases, baseline, tolerances)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump({'machine': get_machine_description(), 'results': results}, f, indent=4, sort_keys=True)
+    if arguments.update_baseline:
+        save_baseline(arguments.baseline, results)
+        print(f'Baseline of {len(results)} cases saved to {arguments.baseline}')
+        return 0
+    if regressions:
+        print(f'FAILED: {len(regressions)} of {len(results)} cases regressed against {arguments.baseline}')
+        for name, case_regressions in regressions.items():
+            print(f'  {name}: {"; ".join(case_regressions)}')
+        return 1
+    print(f'PASSED: {len(results)} cases within tolerance of {arguments.baseline}' if baseline else f'No baseline at {arguments.baseline}, run with --update-baseline to store one')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,7 +1,12 @@
 import numpy
 
 from backend.simulation import run_simulation
-from backend.data_visualization import plot_results
+from backend.data_visualization import plot_results, plot_sweep_value_data
+from backend.adaptive_sweep import run_adaptive_sweep
+from backend.multilevel import run_multilevel_simulation
+from backend.parameter_sweep import run_parameter_sweep, get_parameter_sweep_point_data
+from backend.macrospin import run_macrospin_sweep, get_macrospin_sweep_value_data
+from backend.run_trace import start_run_trace, finish_run_trace
 
 """ MUMAX SCRIPT SETTINGS """
 simulation_settings = {}
@@ -41,10 +46,21 @@ simulation_settings['B_ext_uniform'] = [
         (B_ext_max_y-B_ext_min_y)/num_points_sweep
     )
 ]
+# Hysteresis mode: None starts every B_ext value from m_free_start_uniform; 'up', 'down' or 'up_down' sweep B_ext_uniform
+# forwards, backwards or forwards and back, each value continuing from the final magnetization of the previous one
+# (warm-started values need fewer and shorter quasi-static steps)
+simulation_settings['sweep_continuation'] = None
 # Time for 1 quasi-static LLGS computation with fixed tunnel current
 simulation_settings['t_quasi_static_step'] = 5e-9
-# Number of quasi static steps per B_ext sweep value
+# Number of quasi static steps per B_ext sweep value (upper limit when a convergence tolerance is set)
 simulation_settings['num_quasi_static_steps'] = 1
+# Quasi-static steps stop early once the relative change of the total tunnel current and the change of the
+# average magnetization between steps fall below these tolerances (None disables a criterion)
+simulation_settings['j_tunnel_convergence_tolerance'] = None
+simulation_settings['m_convergence_tolerance'] = None
+# Oersted field of the tunnel current: True computes it in Python by FFT convolution (one mumax run per quasi-static step),
+# False computes it inside the mumax script by direct summation over all cell pairs (only practical for small grids)
+simulation_settings['oersted_field_from_python'] = True
 
 
 """ TUNNEL CURRENT RELATED SETTINGS """
@@ -55,22 +71,122 @@ simulation_settings['R_p'] = 74.86
 simulation_settings['R_ap'] = 18000.0
 
 
+""" OVF FILE FORMAT """
+# 'OVF2_BINARY' writes compact Binary 4 files, 'OVF2_TEXT' writes human readable files for debugging
+simulation_settings['OutputFormat'] = 'OVF2_BINARY'
+
+
 """ FILENAMES FOR QUASI-STATIC SUB-SIMULATION OUTPUT """ 
 simulation_settings['m_quasi_static_final_name'] = '"m_final_quasi_static_step_"' # Double brackets are needed due to mumax syntax
 simulation_settings['j_tunnel_quasi_static_final_name'] = '"j_tunnel_final_quasi_static_step_"'
+# Output level: 'full' saves the m and J distributions of every quasi-static step, 'minimal' only those of every
+# field_output_interval steps and of the final step (None: final step only); per-step average m, total tunnel current
+# and MTJ resistance are always written to a table
+simulation_settings['output_level'] = 'full'
+simulation_settings['field_output_interval'] = None
 
 
 """ MODULE FOLDERS AND FILENAMES """
 scripts_folders = {}
 # Script to simulate MTJ for fixed tunnel current and oersted field
 scripts_folders['MTJ_SCRIPT_TEMPLATE'] = 'templates/simulate_MTJ_template.mx3'
-# Script to generate template ovf files for header and footer extraction
+# Script to generate template ovf files, used to check the ovf headers and footers built in Python against mumax output
 scripts_folders['OVF_TEMPLATE_CREATION_SCRIPT'] = 'templates/create_ovf_m_Bext_J_template.mx3'
+# Folder caching ovf headers and footers for each grid (None disables the cache)
+scripts_folders['OVF_HEADER_CACHE_FOLDER'] = 'cache/ovf_headers'
 # Name of temporary script formed automatically at each iteration
 scripts_folders['MTJ_SCRIPT_INSTANCE'] = 'templates/simulate_MTJ.mx3'
 # Names of folders where results will be saved at each iteration
 scripts_folders['M_DYNAMICS_DATA_FOLDER'] = 'output_data/m_dynamics'
 scripts_folders['J_TUNNEL_DATA_FOLDER'] = 'output_data/j_tunnel_iterations'
+# Single store of the results of all sweep values, memory-mapped for fast plotting
+scripts_folders['RESULT_STORE_FOLDER'] = 'output_data/result_store'
+# B_ext value and number of quasi-static steps used of each sweep value
+scripts_folders['SWEEP_SUMMARY_FILE'] = 'output_data/sweep_summary.json'
+# Folder holding the results of the coarse grid levels of multilevel runs
+scripts_folders['MULTILEVEL_FOLDER'] = 'output_data/multilevel'
+# Folder holding the results of each run of parameter sweeps
+scripts_folders['PARAMETER_SWEEP_FOLDER'] = 'output_data/parameter_sweep'
+# Folder of the run traces: time spent in each stage of a run and bytes read and written, as JSON and CSV
+scripts_folders['RUN_TRACE_FOLDER'] = 'output_data/run_traces'
+# Folder holding the working folder of each running mumax job
+scripts_folders['SCRATCH_FOLDER'] = 'scratch'
+# Folder caching the results of each B_ext sweep value by a hash of its inputs, so that repeated or interrupted runs reuse them (None disables the cache)
+scripts_folders['RESULT_CACHE_FOLDER'] = 'cache/results'
+
+
+""" SIMULATION EXECUTION SETTINGS """
+run_options = {}
+# Number of B_ext sweep values simulated at the same time, each in its own working folder
+run_options['num_parallel_jobs'] = 1
+# Number of B_ext sweep values computed by a single mumax3 run (None shares all values out evenly between the parallel jobs)
+run_options['sweep_batch_size'] = None
+# GPUs handed out to parallel jobs through the mumax3 -gpu flag (None uses the default device)
+run_options['gpu_ids'] = None
+# Check the ovf headers built in Python against those written by mumax3 (costs one extra mumax3 run)
+run_options['validate_ovf_headers'] = False
+# mumax3 executable (tools/stub_mumax3/mumax3 runs the pipeline without a GPU)
+run_options['mumax3_executable'] = 'mumax3'
+# Seconds between checks for m and J files completed by a running mumax3 job, which are then moved to the output folders
+run_options['output_harvest_interval'] = 0.2
+# Result cache entries unused for longer than this many days are removed (None keeps them)
+run_options['result_cache_max_age_days'] = 30
+# Least recently used result cache entries are removed beyond this total size in GB (None sets no limit)
+run_options['result_cache_max_size_gb'] = 10
+
+
+""" ADAPTIVE B_ext SWEEP SETTINGS """
+adaptive_sweep_options = {}
+# True treats B_ext_uniform as a coarse grid and inserts midpoints between neighbouring sweep values whose converged results
+# differ most, rerunning the sweep (cached sweep values are reused) until no interval exceeds the tolerances
+adaptive_sweep_options['enabled'] = False
+# Largest allowed change between neighbours: of MTJ resistance, as a fraction of the full resistance swing, and of average m
+adaptive_sweep_options['resistance_tolerance'] = 0.05
+adaptive_sweep_options['m_tolerance'] = 0.1
+# Limits on the total number of B_ext values, the number of refinement passes and the smallest spacing between values (T)
+adaptive_sweep_options['max_points'] = 100
+adaptive_sweep_options['max_refinement_levels'] = 6
+adaptive_sweep_options['min_B_ext_spacing'] = 1e-5
+
+
+""" MULTILEVEL (COARSE-TO-FINE GRID) SETTINGS """
+multilevel_options = {}
+# True first relaxes every B_ext sweep value on coarser grids, each level starting from the interpolated and renormalized
+# final magnetization of the previous one, so that the full (Nx, Ny) grid starts close to its final state
+multilevel_options['enabled'] = False
+# Number of grid levels, each coarsening_factor times coarser than the next (the finest is (Nx, Ny))
+multilevel_options['num_levels'] = 3
+multilevel_options['coarsening_factor'] = 2
+# Number of quasi-static steps on the coarse levels (None uses num_quasi_static_steps)
+multilevel_options['coarse_num_quasi_static_steps'] = None
+
+
+""" PARAMETER SWEEP SETTINGS """
+parameter_sweep_options = {}
+# True runs the B_ext sweep for every point of the sweep axes below; points with identical settings are computed once,
+# and points differing only in B_ext_uniform share one run
+parameter_sweep_options['enabled'] = False
+# Axes over any simulation_settings keys, combined with each other as a Cartesian product:
+# 'cartesian' takes all combinations of the values of its settings, 'zip' takes the i-th values of its settings together,
+# 'latin_hypercube' samples num_samples points, covering each (low, high) range once per equal-width stratum
+parameter_sweep_options['sweep_spec'] = {
+    'axes': [
+        {'type': 'cartesian', 'settings': {'V_bias': [5e-3, 10e-3]}},
+        {'type': 'zip', 'settings': {'R_p': [74.86, 100.0], 'R_ap': [18000.0, 20000.0]}},
+        {'type': 'latin_hypercube', 'settings': {'alpha': (0.01, 0.05)}, 'num_samples': 4, 'seed': 0},
+    ],
+}
+
+
+""" MACROSPIN SCREENING SETTINGS """
+macrospin_options = {}
+# True replaces the mumax3 simulation by a single-domain (macrospin) LLGS solver in NumPy for fast screening; settings such as
+# Ku1, Pol, V_bias, R_p and R_ap may then be NumPy arrays of parameter combinations, all solved at once
+macrospin_options['enabled'] = False
+# Include the shape anisotropy of the free layer prism (Aharoni demagnetization factors)
+macrospin_options['demag'] = True
+# Largest precession angle (rad) per RK4 time step, setting the time step of the fastest precessing combination
+macrospin_options['max_precession_angle_per_time_step'] = 0.6
 
 
 """ DATA VISUALIZATION SETTINGS """
@@ -78,8 +194,44 @@ plot_options = {}
 plot_options['show_unit_sphere_dynamics'] = True
 plot_options['show_j_tunnel_convergence'] = True
 plot_options['show_j_tunnel_final'] = True
+# True saves the figures into plot_folder instead of opening a window per figure, rendering them in a pool of processes
+plot_options['headless'] = False
+plot_options['plot_folder'] = 'output_data/plots'
+# Any formats supported by matplotlib, e.g. 'png', 'svg', 'pdf'
+plot_options['file_formats'] = ('png',)
+# Processes rendering figures in headless mode, None for one per CPU
+plot_options['num_plot_processes'] = None
+# None for one figure per B_ext sweep value, 'panels' for one figure with a panel per sweep value, 'animation' for one
+# animation with a frame per sweep value (saved as GIF in headless mode)
+plot_options['combine_sweep_values'] = None
+# Frames per second of animations
+plot_options['animation_fps'] = 2
 
 
 """ RUNNING SIMULATION """
-run_simulation(simulation_settings, scripts_folders)
-plot_results(simulation_settings, scripts_folders, plot_options)
+# Running only when executed as a script, so that processes started by the plotting pool can import this file without rerunning it
+def main():
+    # Tracing the whole run, including gathering data and plotting
+    run_trace = start_run_trace()
+    if macrospin_options['enabled']:
+        macrospin_results = run_macrospin_sweep(simulation_settings, macrospin_options)
+        # Plotting the first parameter combination
+        plot_sweep_value_data(get_macrospin_sweep_value_data(macrospin_results, (0,) * (macrospin_results['R_MTJ'].ndim - 2)), simulation_settings, plot_options)
+    elif parameter_sweep_options['enabled']:
+        parameter_sweep_results = run_parameter_sweep(simulation_settings, scripts_folders, parameter_sweep_options['sweep_spec'], run_options)
+        # Plotting the first point of the parameter sweep
+        plot_sweep_value_data(get_parameter_sweep_point_data(parameter_sweep_results, (0,) * parameter_sweep_results['points'].ndim), simulation_settings, plot_options)
+    elif multilevel_options['enabled']:
+        run_multilevel_simulation(simulation_settings, scripts_folders, run_options, multilevel_options)
+        plot_results(simulation_settings, scripts_folders, plot_options)
+    elif adaptive_sweep_options['enabled']:
+        simulation_settings['B_ext_uniform'], _ = run_adaptive_sweep(simulation_settings, scripts_folders, run_options, adaptive_sweep_options)
+        plot_results(simulation_settings, scripts_folders, plot_options)
+    else:
+        run_simulation(simulation_settings, scripts_folders, run_options)
+        plot_results(simulation_settings, scripts_folders, plot_options)
+    finish_run_trace(run_trace, scripts_folders['RUN_TRACE_FOLDER'])
+
+
+if __name__ == '__main__':
+    main()